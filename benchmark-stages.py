@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+
+import click
+import importlib.util
+from itertools import islice
+import json
+import numpy as np
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+# Import my functions
+import bigbed
+import compression
+import genome
+import merge
+
+# Authorship
+__author__ = "Oriol Fornes"
+__organization__ = "The JASPAR Consortium"
+__version__ = "2025.11.10"
+__maintainer__ = "Oriol Fornes"
+__email__ = "oriol.fornes@gmail.com"
+__status__ = "Production"
+
+# Globals
+line_width = 60 # i.e. bases per line of synthetic FASTA files
+min_seconds = .1 # i.e. faster stages are too noisy to flag regressions
+n_run_size = 10000 # i.e. bases per run of Ns (or soft-masked bases)
+sites = 100 # i.e. per synthetic profile
+stages = ["profiles", "score_tables", "encode", "scan", "join", "compress",
+    "merge", "bigbed"]
+units = ["bases", "hits", "profiles"] # i.e. throughputs compared, in order
+
+CONTEXT_SETTINGS = {
+    "help_option_names": ["-h", "--help"],
+}
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option(
+    "--baseline",
+    help="Benchmark results to compare against (i.e. a JSON file from a " + \
+        "previous run).",
+    type=click.Path(exists=True, resolve_path=True),
+)
+@click.option(
+    "--chroms",
+    help="Number of chromosomes of the synthetic genome.",
+    type=int,
+    default=4,
+    show_default=True,
+)
+@click.option(
+    "-d", "--dummy-dir",
+    help="Dummy directory (i.e. for synthetic data and outputs).",
+    type=click.Path(exists=True, resolve_path=True),
+    default="/tmp/",
+    show_default=True,
+)
+@click.option(
+    "--gc",
+    help="GC content of the synthetic genome.",
+    type=float,
+    default=.41,
+    show_default=True,
+)
+@click.option(
+    "--genome-size",
+    help="Size of the synthetic genome (in bases).",
+    type=int,
+    default=10000000,
+    show_default=True,
+)
+@click.option(
+    "--ic",
+    help="Range of information content of synthetic profiles (in bits " + \
+        "per position).",
+    type=(float, float),
+    default=(.5, 1.5),
+    show_default=True,
+)
+@click.option(
+    "--lengths",
+    help="Range of lengths of synthetic profiles.",
+    type=(int, int),
+    default=(6, 20),
+    show_default=True,
+)
+@click.option(
+    "--masked",
+    help="Fraction of the synthetic genome that is soft-masked.",
+    type=float,
+    default=.1,
+    show_default=True,
+)
+@click.option(
+    "--ns",
+    help="Fraction of the synthetic genome in runs of Ns.",
+    type=float,
+    default=.02,
+    show_default=True,
+)
+@click.option(
+    "-o", "--output",
+    help="Output file (JSON).  [default: stdout]",
+    type=click.Path(resolve_path=True),
+)
+@click.option(
+    "-p", "--profiles",
+    help="Number of synthetic profiles.",
+    type=int,
+    default=20,
+    show_default=True,
+)
+@click.option(
+    "--pthresh",
+    help="P-value threshold.",
+    type=float,
+    default=.05,
+    show_default=True,
+)
+@click.option(
+    "-r", "--repeats",
+    help="Number of times to run each stage (i.e. the fastest is kept).",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--rthresh",
+    help="Relative score threshold.",
+    type=float,
+    default=.8,
+    show_default=True,
+)
+@click.option(
+    "-s", "--seed",
+    help="Seed for the synthetic genome and profiles.",
+    type=int,
+    default=0,
+    show_default=True,
+)
+@click.option(
+    "-t", "--threads",
+    help="Number of CPU threads to use (i.e. for compression and bigBed " + \
+        "encoding).",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--tolerance",
+    help="Slowdown relative to the baseline reported as a regression " + \
+        "(i.e. as a fraction of its throughput).",
+    type=float,
+    default=.2,
+    show_default=True,
+)
+
+def main(**params):
+
+    # Benchmark stages
+    regressions = benchmark_stages(params["output"], params["genome_size"],
+        params["chroms"], params["gc"], params["ns"], params["masked"],
+        params["profiles"], params["lengths"], params["ic"],
+        params["pthresh"], params["rthresh"], params["threads"],
+        params["repeats"], params["seed"], params["dummy_dir"],
+        params["baseline"], params["tolerance"])
+
+    # Exit with an error on regressions (i.e. for use in CI)
+    if len(regressions) > 0:
+        sys.exit("Regressions against baseline: %s" % ", ".join(regressions))
+
+def benchmark_stages(output=None, genome_size=10000000, chroms=4, gc=.41,
+    ns=.02, masked=.1, profiles=20, lengths=(6, 20), ic=(.5, 1.5),
+    pthresh=.05, rthresh=.8, threads=1, repeats=1, seed=0, dummy_dir="/tmp/",
+    baseline=None, tolerance=.2):
+
+    # Initialize
+    rng = np.random.default_rng(seed)
+    work_dir = tempfile.mkdtemp(prefix="%s." % os.path.basename(__file__),
+        dir=dummy_dir)
+    results = {
+        "params": {
+            "genome_size": genome_size, "chroms": chroms, "gc": gc, "ns": ns,
+            "masked": masked, "profiles": profiles, "lengths": list(lengths),
+            "ic": list(ic), "pthresh": pthresh, "rthresh": rthresh,
+            "threads": threads, "repeats": repeats, "seed": seed,
+        },
+        "environment": {
+            "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+        },
+        "stages": {},
+    }
+
+    try:
+
+        # Generate synthetic genome and profiles
+        fasta_file, chrom_sizes = write_genome(work_dir, genome_size, chroms,
+            gc, ns, masked, rng)
+        jaspar_files, info = write_profiles(work_dir, profiles, lengths, ic,
+            rng)
+        results["profiles"] = info
+
+        # Time each stage (i.e. keeping the fastest of each)
+        for _ in range(repeats):
+            for stage, timing in _run_stages(work_dir, fasta_file,
+                chrom_sizes, jaspar_files, pthresh, rthresh, threads).items():
+                if stage not in results["stages"] or timing["seconds"] < \
+                   results["stages"][stage]["seconds"]:
+                    results["stages"][stage] = timing
+
+    finally:
+        shutil.rmtree(work_dir)
+
+    # Compare against baseline
+    regressions = []
+    if baseline is not None:
+        with open(baseline) as handle:
+            results["comparison"] = compare(json.load(handle), results,
+                tolerance)
+        regressions = [s for s, c in results["comparison"].items() \
+            if c["regression"]]
+
+    # Write results (i.e. as JSON)
+    handle = sys.stdout if output is None else open(output, "w")
+    json.dump(results, handle, indent=4)
+    handle.write("\n")
+    if output is not None:
+        handle.close()
+
+    return(regressions)
+
+def write_genome(work_dir, genome_size=10000000, chroms=4, gc=.41, ns=.02,
+    masked=.1, rng=None):
+    """
+    This function writes a synthetic genome (i.e. a FASTA file and its chrom
+    sizes) of {chroms} sequences of decreasing size adding up to
+    {genome_size} bases, of the given GC content and with the given
+    fractions of bases in runs of Ns and soft-masked, and returns both files.
+    """
+
+    # Initialize
+    if rng is None:
+        rng = np.random.default_rng()
+    fasta_file = os.path.join(work_dir, "genome.fa")
+    chrom_sizes = os.path.join(work_dir, "genome.fa.sizes")
+    weights = 1. / np.arange(1, chroms + 1)
+    sizes = np.floor(weights / weights.sum() * genome_size).astype(np.int64)
+    sizes[0] += genome_size - sizes.sum()
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)
+    probs = np.array([1 - gc, gc, gc, 1 - gc]) / 2
+
+    with open(fasta_file, "wb") as handle, open(chrom_sizes, "w") as sizes_h:
+
+        # For each chrom...
+        for i, size in enumerate(sizes.tolist()):
+
+            # Random sequence (i.e. in blocks of {line_width} x 65536 bases)
+            sequence = np.empty(size, dtype=np.uint8)
+            for start in range(0, size, line_width * 65536):
+                end = min(start + line_width * 65536, size)
+                sequence[start:end] = bases[rng.choice(4, size=end - start,
+                    p=probs)]
+
+            # Runs of Ns and of soft-masked bases
+            for fraction, f in [(masked, lambda s: s | 32), (ns, lambda s: \
+                np.full(len(s), ord("N"), dtype=np.uint8))]:
+                for _ in range(int(round(size * fraction / n_run_size))):
+                    start = int(rng.integers(0, max(size - n_run_size, 1)))
+                    sequence[start:start+n_run_size] = f(
+                        sequence[start:start+n_run_size])
+
+            # Write sequence (i.e. in lines of {line_width} bases)
+            chrom = "chr%s" % (i + 1)
+            handle.write(b">%s\n" % chrom.encode())
+            for start in range(0, size, line_width * 65536):
+                block = sequence[start:start+line_width*65536].tobytes()
+                handle.write(b"".join([b"%s\n" % block[j:j+line_width] \
+                    for j in range(0, len(block), line_width)]))
+            sizes_h.write("%s\t%s\n" % (chrom, size))
+
+    return(fasta_file, chrom_sizes)
+
+def write_profiles(work_dir, profiles=20, lengths=(6, 20), ic=(.5, 1.5),
+    rng=None):
+    """
+    This function writes synthetic profiles in JASPAR format of random
+    lengths and information content (i.e. per position, within the given
+    ranges), and returns their files along with their matrix ID, length and
+    mean information content.
+    """
+
+    # Initialize
+    if rng is None:
+        rng = np.random.default_rng()
+    profiles_dir = os.path.join(work_dir, "profiles")
+    os.makedirs(profiles_dir)
+    jaspar_files = []
+    info = []
+
+    # For each profile...
+    for i in range(profiles):
+
+        # Initialize
+        matrix_id = "MA%04d.1" % (i + 1)
+        length = int(rng.integers(lengths[0], lengths[1] + 1))
+        counts = []
+
+        # Counts (i.e. a dominant base mixed with a uniform background to
+        # the target information content)
+        for target in rng.uniform(ic[0], ic[1], length).tolist():
+            frequencies = np.full(4, (1 - _get_weight(target)) / 4)
+            frequencies[rng.integers(4)] += _get_weight(target)
+            counts.append(np.rint(frequencies * sites).astype(int).tolist())
+
+        # Write profile
+        jaspar_file = os.path.join(profiles_dir, "%s.jaspar" % matrix_id)
+        with open(jaspar_file, "w") as handle:
+            handle.write(">%s SYN%s\n" % (matrix_id, i + 1))
+            for j, nucleotide in enumerate("ACGT"):
+                handle.write("%s  [%s ]\n" % (nucleotide, "".join(
+                    ["%4d" % c[j] for c in counts])))
+        jaspar_files.append(jaspar_file)
+        info.append({"matrix_id": matrix_id, "length": length,
+            "ic": round(sum(_get_ic(c) for c in counts) / length, 3)})
+
+    return(jaspar_files, info)
+
+def compare(baseline, results, tolerance=.2):
+    """
+    This function compares the throughput of each stage (i.e. in bases/s,
+    or else hits/s or profiles/s) against that of a baseline, and returns
+    their ratios, flagging those below 1 - {tolerance} as regressions (i.e.
+    unless the stage took less than {min_seconds}).
+    """
+
+    # Initialize
+    comparison = {}
+
+    # For each stage in both...
+    for stage, timing in results["stages"].items():
+        if stage not in baseline.get("stages", {}):
+            continue
+        unit = [u for u in units if "%s_per_second" % u in timing][0]
+        key = "%s_per_second" % unit
+        if key not in baseline["stages"][stage]:
+            continue
+
+        # Ratio of throughputs (i.e. < 1 is slower than the baseline)
+        ratio = timing[key] / baseline["stages"][stage][key]
+        comparison[stage] = {"unit": key,
+            "baseline": baseline["stages"][stage][key],
+            "current": timing[key], "ratio": round(ratio, 3),
+            "regression": ratio < 1 - tolerance and \
+                timing["seconds"] >= min_seconds}
+
+    return(comparison)
+
+def _run_stages(work_dir, fasta_file, chrom_sizes, jaspar_files, pthresh=.05,
+    rthresh=.8, threads=1):
+
+    # Initialize
+    get_profiles = _load_script(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "profiles", "get-profiles.py"))
+    scan_sequence = _load_script(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "scan-sequence.py"))
+    seconds = dict.fromkeys(stages, 0.)
+    counts = {stage: {} for stage in stages}
+    scans_dir = os.path.join(work_dir, "scans")
+    bed_file = os.path.join(work_dir, "genome.bed")
+    bb_file = os.path.join(work_dir, "genome.bb")
+    for file_name in [bed_file, bb_file]:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    if os.path.exists(scans_dir):
+        shutil.rmtree(scans_dir)
+    os.makedirs(scans_dir)
+
+    # Profile conversion (i.e. JASPAR to PWMScan format, as get-profiles.py)
+    t = time.perf_counter()
+    profiles = []
+    for jaspar_file in jaspar_files:
+        with open(jaspar_file) as handle:
+            matrix_id, name, matrix = get_profiles.parse_jaspar(handle.read())
+        pwm_file = "%s.pwm" % jaspar_file[:-len(".jaspar")]
+        if os.path.exists(pwm_file):
+            os.remove(pwm_file)
+        profiles.append({"matrix_id": matrix_id, "name": name,
+            "pwm": get_profiles.calculate_pwm(matrix).tolist(),
+            "pwm_file": pwm_file})
+    get_profiles.jaspar_to_pwm(profiles)
+    seconds["profiles"] = time.perf_counter() - t
+    counts["profiles"]["profiles"] = len(profiles)
+
+    # Score tables and cutoffs (i.e. as matrix_prob)
+    t = time.perf_counter()
+    cutoffs = []
+    tables = []
+    for profile in profiles:
+        cutoff, table = scan_sequence._get_score_table(profile["pwm_file"],
+            pthresh=pthresh, rthresh=rthresh)
+        cutoffs.append(cutoff)
+        tables.append(table)
+    seconds["score_tables"] = time.perf_counter() - t
+    counts["score_tables"]["profiles"] = len(profiles)
+
+    # Genome encoding and indexing of gaps
+    t = time.perf_counter()
+    for file_name in os.listdir(work_dir):
+        if file_name.startswith("genome.fa.gaps"):
+            os.remove(os.path.join(work_dir, file_name))
+    chroms = genome.encode_genome(fasta_file, work_dir, "genome")
+    genome.index_gaps(fasta_file)
+    seconds["encode"] = time.perf_counter() - t
+    length = sum(genome.get_length(seq_file) for _, seq_file in chroms)
+    counts["encode"]["bases"] = length
+
+    # Time score joining within the scan (i.e. counting hits)
+    hits = 0
+    join_scores = scan_sequence._join_scores
+    def _join_scores(chrom, starts, *args):
+        nonlocal hits
+        t = time.perf_counter()
+        lines = join_scores(chrom, starts, *args)
+        seconds["join"] += time.perf_counter() - t
+        hits += len(starts)
+        return(lines)
+    scan_sequence._join_scores = _join_scores
+
+    # For each profile...
+    for profile, cutoff, table in zip(profiles, cutoffs, tables):
+
+        # Scan, join scores and compress (i.e. as scan-sequence.py with the
+        # NumPy engine and `--stream`, timing compression apart)
+        t = time.perf_counter()
+        output_file = os.path.join(scans_dir, "%s.tsv.gz" % \
+            profile["matrix_id"])
+        handle = compression.Writer(output_file, threads)
+        handle.write = _time_calls(handle.write, seconds, "compress")
+        scan_sequence._stream_scan(profile["pwm_file"], fasta_file,
+            profile["name"], table, cutoff, handle, chroms)
+        _time_calls(handle.close, seconds, "compress")()
+        seconds["scan"] += time.perf_counter() - t
+
+    # i.e. the scan is what is left
+    seconds["scan"] -= seconds["join"] + seconds["compress"]
+
+    counts["scan"]["bases"] = length * len(profiles)
+    for stage in ["scan", "join", "compress", "merge", "bigbed"]:
+        counts[stage]["hits"] = hits
+
+    # Merge scans into a sorted BED file (i.e. as merge-scans.py)
+    t = time.perf_counter()
+    sizes = merge.read_chrom_sizes(chrom_sizes)
+    scan_files = merge.get_scan_files(scans_dir)
+    chroms = merge.sort_chroms([merge.get_chroms(f) for f in scan_files],
+        sizes)
+    with open(bed_file, "wb") as handle:
+        handle.writelines(merge.to_bed(scan_files, chroms))
+    seconds["merge"] = time.perf_counter() - t
+
+    # Encode bigBed (i.e. as merge-scans.py)
+    t = time.perf_counter()
+    with open(bed_file, "rb") as lines, bigbed.Writer(bb_file, sizes, threads,
+        dummy_dir=work_dir) as handle:
+        for batch in iter(lambda: list(islice(lines, 65536)), []):
+            handle.write(b"".join(batch))
+    seconds["bigbed"] = time.perf_counter() - t
+
+    # Throughputs (i.e. per second)
+    timings = {}
+    for stage in stages:
+        timings[stage] = {"seconds": round(seconds[stage], 4)}
+        for unit, n in counts[stage].items():
+            timings[stage][unit] = n
+            timings[stage]["%s_per_second" % unit] = round(n / \
+                max(seconds[stage], 1e-9), 1)
+
+    return(timings)
+
+def _time_calls(function, seconds, stage):
+
+    # Add the time spent in each call to that of the stage
+    def timed(*args, **kwargs):
+        t = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds[stage] += time.perf_counter() - t
+        return(result)
+
+    return(timed)
+
+def _load_script(file_name):
+
+    # Load script as a module (i.e. hyphenated names cannot be imported)
+    name = os.path.basename(file_name)[:-len(".py")].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, file_name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return(module)
+
+def _get_ic(counts):
+
+    frequencies = np.array(counts, dtype=float) / sum(counts)
+    frequencies = frequencies[frequencies > 0]
+
+    return(2 + float((frequencies * np.log2(frequencies)).sum()))
+
+def _get_weight(target):
+
+    # Bisect the weight of the dominant base giving the information content
+    lo, hi = 0., 1.
+    for _ in range(50):
+        w = (lo + hi) / 2
+        if _get_ic([w + (1 - w) / 4] + [(1 - w) / 4] * 3) < target:
+            lo = w
+        else:
+            hi = w
+
+    return((lo + hi) / 2)
+
+#-------------#
+# Main        #
+#-------------#
+
+if __name__ == "__main__":
+    main()
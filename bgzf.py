@@ -0,0 +1,275 @@
+import numpy as np
+import os
+import struct
+import zlib
+
+# Import my functions
+import compression
+
+# Globals
+block_size = 65280 # i.e. maximum uncompressed data per BGZF block
+eof = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+#-------------#
+# Functions   #
+#-------------#
+
+def compress_block(data, compresslevel=compression.level):
+    """
+    This function compresses a block of data into a BGZF block (i.e. a gzip
+    member with the total block size in its extra field).
+    """
+
+    # Initialize
+    c = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+
+    # Header (i.e. with BC extra subfield), compressed data and footer
+    header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67,
+        2, len(cdata) + 25)
+    footer = struct.pack("<II", zlib.crc32(data), len(data))
+
+    return(header + cdata + footer)
+
+def split_lines(data, size=block_size, final=True):
+    """
+    This function splits sorted, tab-delimited chrom, start, end, ... lines
+    into blocks of whole lines from a single chrom, and yields the start and
+    end of each block within {data} along with the chrom, start and end it
+    spans.  Unless {final}, the last block is held back if smaller than
+    {size}.
+    """
+
+    # Initialize
+    pos = 0
+
+    # For each block...
+    while len(data) - pos >= size or (final and pos < len(data)):
+
+        # Cut at a line boundary
+        end = min(pos + size, len(data))
+        if end < len(data):
+            end = data.rindex(b"\n", pos, end) + 1
+        chrom = data[pos:data.index(b"\t", pos)]
+
+        # ... and at a chrom boundary
+        last = max(data.rfind(b"\n", pos, end - 1) + 1, pos)
+        if not data.startswith(chrom + b"\t", last):
+            last = pos
+            while data.startswith(chrom + b"\t", last):
+                end = data.index(b"\n", last) + 1
+                last = end
+            last = max(data.rfind(b"\n", pos, end - 1) + 1, pos)
+
+        # Coordinates spanned (i.e. start of first line and end of last line)
+        first = data[pos:data.index(b"\n", pos)].split(b"\t", 2)
+        yield(pos, end, (chrom.decode(), int(first[1]),
+            int(data[last:end].split(b"\t", 3)[2])))
+        pos = end
+
+def compress_lines(data, compresslevel=compression.level):
+    """
+    This function compresses sorted, tab-delimited chrom, start, end, ...
+    lines into BGZF blocks and returns them along with their index (i.e.
+    offsets relative to the first block).
+    """
+
+    # Initialize
+    blocks = []
+    index = []
+    offset = 0
+
+    # For each block...
+    for start, end, (chrom, first, last) in split_lines(data):
+        block = compress_block(data[start:end], compresslevel)
+        blocks.append(block)
+        index.append((chrom, first, last, offset, len(block)))
+        offset += len(block)
+
+    return(b"".join(blocks), index)
+
+def index_blocks(data):
+    """
+    This function indexes BGZF blocks of sorted lines compressed elsewhere
+    (i.e. as from {compress_lines}), and returns the same index.
+    """
+
+    # Initialize
+    index = []
+    offset = 0
+
+    # For each block (i.e. its size is in the BC extra subfield)...
+    while offset < len(data):
+        size = struct.unpack_from("<H", data, offset + 16)[0] + 1
+        lines = zlib.decompress(data[offset:offset+size], 31)
+        if len(lines) > 0:
+            first = lines[:lines.index(b"\n")].split(b"\t", 2)
+            last = lines[lines.rfind(b"\n", 0, len(lines) - 1) + 1:]
+            index.append((first[0].decode(), int(first[1]),
+                int(last.split(b"\t", 3)[2]), offset, size))
+        offset += size
+
+    return(index)
+
+def get_index_file(file_name):
+    """
+    This function returns the index file of a BGZF file.
+    """
+
+    return("%s.idx" % file_name)
+
+def read_index(file_name):
+    """
+    This function reads the index of a BGZF file and returns a {dict} of
+    chrom, (starts, ends, offsets, sizes) arrays of its blocks.
+    """
+
+    # Initialize
+    index = {}
+
+    with np.load(get_index_file(file_name)) as data:
+        chrom = data["chrom"] # i.e. each array is read once
+        arrays = [data[k] for k in ["start", "end", "offset", "size"]]
+        for i, c in enumerate(data["chroms"].tolist()):
+            idx = chrom == i
+            index[c] = tuple(a[idx] for a in arrays)
+
+    return(index)
+
+def query(file_name, chrom, start, end, index=None):
+    """
+    This function yields the lines (i.e. as lists of fields) of a BGZF file
+    that overlap a region (i.e. 0-based, half-open).
+    """
+
+    # Initialize
+    if index is None:
+        index = read_index(file_name)
+    if chrom not in index:
+        return
+    starts, ends, offsets, sizes = index[chrom]
+
+    # Blocks overlapping region
+    idx = np.flatnonzero((starts < end) & (ends > start))
+
+    with open(file_name, "rb") as handle:
+
+        # For each block...
+        for offset, size in zip(offsets[idx].tolist(), sizes[idx].tolist()):
+
+            # Decompress block
+            handle.seek(offset)
+            data = zlib.decompress(handle.read(size), 31)
+
+            # Lines overlapping region
+            for line in data.decode().split("\n")[:-1]:
+                fields = line.split("\t")
+                if fields[0] == chrom and int(fields[1]) < end and \
+                   int(fields[2]) > start:
+                    yield(fields)
+
+#-------------#
+# Classes     #
+#-------------#
+
+class Writer(compression.Writer):
+    """
+    This class writes sorted, tab-delimited chrom, start, end, ... lines to a
+    BGZF file and indexes its blocks (i.e. each block holds whole lines from
+    a single chrom).  Data must be written in whole lines.
+    """
+
+    def __init__(self, file_name, threads=1):
+
+        super().__init__(file_name, threads, block_size, compress_block)
+
+        # Initialize
+        self.offset = 0
+        self.index = []
+
+    def write(self, data):
+        """
+        This function buffers lines and compresses them in blocks.
+        """
+
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.size:
+            data = b"".join(self.buffer)
+            pos = self._cut(data)
+            self.buffer = [data[pos:]]
+            self.buffered = len(data) - pos
+            self._drain(self.max_pending)
+
+    def flush(self):
+        """
+        This function compresses any buffered lines.
+        """
+
+        self._cut(b"".join(self.buffer), final=True)
+        self.buffer = []
+        self.buffered = 0
+        self._drain(self.max_pending)
+
+    def write_blocks(self, blocks, index):
+        """
+        This function writes BGZF blocks compressed elsewhere (i.e. from
+        {compress_lines}) along with their index.
+        """
+
+        # Write buffered lines first
+        self.flush()
+        self._drain(0)
+
+        # Index blocks (i.e. offsets relative to this file)
+        for chrom, start, end, offset, size in index:
+            self.index.append((chrom, start, end, self.offset + offset, size))
+
+        # Write blocks
+        self.handle.write(blocks)
+        self.offset += len(blocks)
+
+    def _cut(self, data, final=False):
+
+        # Initialize
+        pos = 0
+
+        # Submit blocks (i.e. with the coordinates they span)
+        for start, end, meta in split_lines(data, self.size, final):
+            self._submit(data[start:end], meta)
+            pos = end
+
+        return(pos)
+
+    def _write(self, block, meta=None):
+
+        # Index block
+        chrom, start, end = meta
+        self.index.append((chrom, start, end, self.offset, len(block)))
+
+        # Write block
+        self.handle.write(block)
+        self.offset += len(block)
+
+    def _finish(self):
+
+        # Initialize
+        index_file = get_index_file(self.file_name)
+        tmp_file = get_index_file(self.tmp_file)
+        chroms = list(dict.fromkeys(e[0] for e in self.index))
+        chrom_idx = {chrom: i for i, chrom in enumerate(chroms)}
+
+        # Write EOF block
+        self.handle.write(eof)
+
+        # Write index (i.e. before the BGZF file is renamed)
+        with open(tmp_file, "wb") as handle:
+            np.savez(handle,
+                chroms=np.array(chroms, dtype=str),
+                chrom=np.array([chrom_idx[e[0]] for e in self.index],
+                    dtype=np.int32),
+                start=np.array([e[1] for e in self.index], dtype=np.int64),
+                end=np.array([e[2] for e in self.index], dtype=np.int64),
+                offset=np.array([e[3] for e in self.index], dtype=np.int64),
+                size=np.array([e[4] for e in self.index], dtype=np.int32))
+        os.replace(tmp_file, index_file)
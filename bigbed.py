@@ -0,0 +1,1110 @@
+import binascii
+import heapq
+from itertools import groupby, islice
+import mmap
+import numpy as np
+from operator import itemgetter
+import re
+import shutil
+import struct
+import tempfile
+import zlib
+
+# Import my functions
+import compression
+
+# Globals
+autosql = """table jasparTFBS
+"JASPAR TFBS predictions (i.e. as from scans2bigBed)"
+    (
+    string chrom;      "Reference sequence chromosome or scaffold"
+    uint   chromStart; "Start position in chromosome"
+    uint   chromEnd;   "End position in chromosome"
+    string name;       "Matrix ID"
+    uint   score;      "-log10 p-value x 100 (i.e. capped at 1000)"
+    char[1] strand;    "+ or - for strand"
+    string TFName;     "Transcription factor name"
+    )
+"""
+block_size = 256 # i.e. children per node of the B+ and R trees
+items_per_slot = 1024 # i.e. items per data (or zoom) block
+magic = 0x8789F2EB
+bpt_magic = 0x78CA8C91
+cir_magic = 0x2468ACE0
+max_runs = 256 # i.e. sorted runs of extra index entries before merging
+max_zoom_levels = 10
+spill_size = 4194304 # i.e. extra index entries kept in memory
+version = 4
+zoom_increment = 4
+
+# Structures (i.e. little endian, as written by bedToBigBed on x86)
+header = struct.Struct("<IHHQQQHHQQIQ")
+zoom_header = struct.Struct("<IIQQ")
+total_summary = struct.Struct("<Qdddd")
+ext_header = struct.Struct("<HHQ52x")
+index_entry = struct.Struct("<HHQ4xHH")
+item = struct.Struct("<III")
+range_dtype = np.dtype([
+    ("chrom", "<u4"),
+    ("start", "<u4"),
+    ("end", "<u4"),
+    ("depth", "<u4"),
+]) # i.e. of constant coverage depth
+summary_dtype = np.dtype([
+    ("chrom", "<u4"),
+    ("start", "<u4"),
+    ("end", "<u4"),
+    ("count", "<u4"), # i.e. bases covered
+    ("min", "<f4"),
+    ("max", "<f4"),
+    ("sum", "<f4"),
+    ("sumsq", "<f4"),
+])
+
+#-------------#
+# Functions   #
+#-------------#
+
+def compress_block(data, compresslevel=compression.level):
+    """
+    This function compresses a block of data (i.e. as a zlib stream).
+    """
+
+    return(zlib.compress(data, compresslevel))
+
+def get_fields(as_def):
+    """
+    This function returns the field names of an autoSql definition.
+    """
+
+    return(re.findall(r"^\s*[\w\[\]]+\s+(\w+)\s*;", as_def, re.M))
+
+def write_bpt(handle, items, count, key_size, val_size, size=block_size,
+    dummy_dir=None):
+    """
+    This function writes a B+ tree (i.e. as from bptFileBulkIndexToOpenFile)
+    of {count} key, value pairs sorted by key to a binary handle.  Leaves are
+    written to a temporary file first, so that items can be streamed.
+    """
+
+    # Initialize
+    items = iter(items)
+    keys = []
+    leaf_size = 4 + size * (key_size + val_size)
+    index_size = 4 + size * (key_size + 8)
+    levels = 1
+    n = count
+    while n > size:
+        n = (n + size - 1) // size
+        levels += 1
+
+    with tempfile.TemporaryFile(dir=dummy_dir) as leaves:
+
+        # Leaves (i.e. the first key of each leaf is kept for the index)
+        for node in iter(lambda: list(islice(items, size)), []):
+            keys.append(node[0][0])
+            leaves.write(_pack_node(1, [k.ljust(key_size, b"\0") + v for \
+                k, v in node], size, key_size + val_size))
+        if len(keys) == 0: # i.e. an empty root
+            leaves.write(_pack_node(1, [], size, key_size + val_size))
+
+        # Header
+        handle.write(struct.pack("<IIIIQII", bpt_magic, size, key_size,
+            val_size, count, 0, 0))
+        offset = handle.tell()
+
+        # Index levels (i.e. from the root down)
+        for level in range(levels - 1, 0, -1):
+            step = size ** (level - 1) # i.e. leaves per slot
+            nodes = [keys[i:i+step*size:step] for i in \
+                range(0, len(keys), step * size)]
+            child = offset + len(nodes) * index_size
+            for node in nodes:
+                slots = []
+                for key in node:
+                    slots.append(key.ljust(key_size, b"\0") + \
+                        struct.pack("<Q", child))
+                    child += leaf_size if level == 1 else index_size
+                handle.write(_pack_node(0, slots, size, key_size + 8))
+            offset += len(nodes) * index_size
+
+        # Leaves
+        leaves.seek(0)
+        shutil.copyfileobj(leaves, handle)
+
+def write_cir_tree(handle, bounds, count, end_offset, slot=1,
+    size=block_size):
+    """
+    This function writes an R tree (i.e. as from
+    cirTreeFileBulkIndexToOpenFile) of blocks to a binary handle, given the
+    start chrom, start, end chrom, end and file offset of each block (i.e.
+    sorted), the number of items they hold, the end of the last block and
+    the items per block.
+    """
+
+    # Initialize
+    bounds = [tuple(b) for b in bounds]
+    leaf_size = 4 + size * 32
+    index_size = 4 + size * 24
+
+    # Leaf entries (i.e. blocks end where the next one starts)
+    offsets = [b[4] for b in bounds[1:]] + [end_offset]
+    entries = [b[:4] + (b[4], o - b[4]) for b, o in zip(bounds, offsets)]
+
+    # Group entries into nodes, then nodes into parents, up to the root
+    levels = [[entries[i:i+size] for i in range(0, len(entries), size)]]
+    if len(levels[0]) == 0:
+        levels[0].append([])
+    while len(levels[-1]) > 1:
+        nodes = levels[-1]
+        levels.append([nodes[i:i+size] for i in range(0, len(nodes), size)])
+
+    # Header (i.e. bounds of all blocks)
+    first = entries[0] if len(entries) > 0 else (0, 0, 0, 0)
+    last = max([e[2:4] for e in entries], default=(0, 0))
+    handle.write(struct.pack("<IIQIIIIQII", cir_magic, size, count,
+        first[0], first[1], last[0], last[1], end_offset, slot, 0))
+    offset = handle.tell()
+
+    # Index nodes (i.e. from the root down)
+    for k in range(len(levels) - 1, 0, -1):
+        child = offset + len(levels[k]) * index_size
+        child_size = leaf_size if k == 1 else index_size
+        for node in levels[k]:
+            slots = []
+            for children in node:
+                start, end = _get_node_bounds(children)
+                slots.append(struct.pack("<IIIIQ", *start, *end, child))
+                child += child_size
+            handle.write(_pack_node(0, slots, size, 24))
+        offset += len(levels[k]) * index_size
+
+    # Leaf nodes
+    for node in levels[0]:
+        handle.write(_pack_node(1, [struct.pack("<IIIIQQ", *e) for e in node],
+            size, 32))
+
+def _pack_node(is_leaf, slots, size, slot_size):
+
+    # Header, slots and empty slots (i.e. zeroed)
+    return(struct.pack("<BBH", is_leaf, 0, len(slots)) + b"".join(slots) + \
+        b"\0" * (slot_size * (size - len(slots))))
+
+def _get_node_bounds(children):
+
+    # Initialize
+    while isinstance(children[0], list): # i.e. descend to leaf entries
+        children = [e for node in children for e in node]
+
+    return(children[0][:2], max(e[2:4] for e in children))
+
+def _aggregate(carry, bins, stats, limit):
+
+    # Initialize
+    if carry is not None:
+        bins = np.concatenate(([carry[0]], bins))
+        stats = [np.concatenate(([c], s)) for c, s in zip(carry[1:], stats)]
+    if len(bins) == 0:
+        return(None, bins, stats)
+
+    # Aggregate stats by bin (i.e. bins are sorted)
+    idx = np.flatnonzero(np.diff(bins, prepend=-1) != 0)
+    bins = bins[idx]
+    count, mins, maxs, sums, sumsqs = stats
+    stats = [np.add.reduceat(count, idx), np.minimum.reduceat(mins, idx),
+        np.maximum.reduceat(maxs, idx), np.add.reduceat(sums, idx),
+        np.add.reduceat(sumsqs, idx)]
+
+    # Keep the last bin unless complete (i.e. before the limit)
+    if bins[-1] >= limit:
+        carry = (bins[-1], *[s[-1] for s in stats])
+        return(carry, bins[:-1], [s[:-1] for s in stats])
+
+    return(None, bins, stats)
+
+def _copy(src, dst, size):
+
+    # Copy {size} bytes (i.e. in chunks)
+    while size > 0:
+        data = src.read(min(size, compression.block_size))
+        if len(data) == 0:
+            raise EOFError("Truncated piece")
+        dst.write(data)
+        size -= len(data)
+
+def _write_run(handle, entries):
+    handle.writelines(b"%s\t%s\n" % (name, binascii.hexlify(val)) for \
+        name, val in entries)
+
+def _read_run(run, shift=0):
+    for line in run:
+        name, val = line.rstrip(b"\n").split(b"\t")
+        val = binascii.unhexlify(val)
+        if shift > 0:
+            offset, size = struct.unpack("<QQ", val)
+            val = struct.pack("<QQ", offset + shift, size)
+        yield(name, val)
+
+#-------------#
+# Classes     #
+#-------------#
+
+class Writer(compression.Writer):
+    """
+    This class writes sorted BED lines (i.e. chrom, start, end and other
+    fields, as from merge-scans.py) to a bigBed file in a single pass: data
+    blocks are compressed in parallel and written in order, while coverage
+    depth and extra indices are spooled to temporary files, and the zoom
+    levels (i.e. summaries of coverage depth, at scales based on the mean
+    item size, as bedToBigBed) and indices are written on close.  Chroms are
+    numbered in the order they are written.  Data must be written in whole
+    lines, or in pieces of chroms encoded elsewhere (i.e. in parallel, as
+    from {Piece}).
+    """
+
+    def __init__(self, file_name, chrom_sizes, threads=1, as_def=autosql,
+        extra_index=["TFName"], defined_fields=6, dummy_dir=None):
+
+        super().__init__(file_name, threads, items_per_slot, compress_block)
+
+        # Initialize
+        self.chrom_sizes = chrom_sizes
+        self.as_def = as_def
+        self.fields = get_fields(as_def)
+        self.defined_fields = defined_fields
+        self.extra_index = [(n, self.fields.index(n)) for n in extra_index]
+        self.dummy_dir = dummy_dir
+        self.chroms = {}
+        self.chrom = None
+        self.chrom_size = None
+        self.last_start = 0
+        self.items = []
+        self.count = 0
+        self.bounds = []
+        self.index_offset = None
+        self.zoom_levels = []
+        self.max_block = 0
+        self.zoom = _Zoom(dummy_dir)
+        self.names = [[] for _ in extra_index]
+        self.runs = [[] for _ in extra_index] # i.e. file, offset shift pairs
+        self.key_sizes = [0 for _ in extra_index]
+        self.counts = [0 for _ in extra_index]
+        self._reserve()
+
+    def write(self, data):
+        """
+        This function adds lines to data blocks (i.e. of a single chrom).
+        """
+
+        # For each chrom...
+        for chrom, fields in groupby([l.split(b"\t", 3) for l in \
+            data.split(b"\n")[:-1]], key=itemgetter(0)):
+
+            # New chrom
+            if chrom != self.chrom:
+                self._flush_block()
+                self._add_chrom(chrom)
+
+            # Add items (i.e. and pack full blocks)
+            self.items.extend(fields)
+            if len(self.items) >= items_per_slot:
+                n = len(self.items) // items_per_slot * items_per_slot
+                for i in range(0, n, items_per_slot):
+                    self._pack_block(self.items[i:i+items_per_slot])
+                self.items = self.items[n:]
+
+    def flush(self):
+        """
+        This function writes any pending data block.
+        """
+
+        self._flush_block()
+        self._drain(self.max_pending)
+
+    def close(self):
+        """
+        This function writes the remaining data blocks, the data index and
+        the zoom levels (i.e. also compressed in parallel), then the other
+        indices and the header.
+        """
+
+        # Write remaining data blocks and index
+        self.flush()
+        self._drain(0)
+        self.index_offset = self.offset
+        write_cir_tree(self.handle, self.bounds, len(self.bounds),
+            self.index_offset)
+        self.offset = self.handle.tell()
+
+        # Write zoom levels (i.e. the first one at most half the data size)
+        self.zoom.end_chrom()
+        self.zoom.summarize()
+        for scale, spool, count in self.zoom.select(self.index_offset - \
+            self.data_offset):
+            self._write_zoom(scale, spool, count)
+
+        super().close()
+
+    def write_piece(self, file_name, meta):
+        """
+        This function appends a piece (i.e. as from {Piece}, of the chroms
+        that follow those written so far): its data blocks and coverage depth
+        are copied, and its extra index entries are kept as a run, shifted to
+        the offset its data blocks are copied at.
+        """
+
+        # Write buffered lines first
+        self.flush()
+        self._drain(0)
+
+        # Initialize
+        self.zoom.end_chrom()
+        for name, i in meta["chroms"].items():
+            if name in self.chroms:
+                raise ValueError("BED lines not sorted by chrom: %s" % name)
+            self.chroms[name] = i
+            self.zoom.chrom_sizes[i] = self.chrom_sizes[name]
+        self.chrom = None
+
+        with open(file_name, "rb") as handle:
+
+            # Data blocks (i.e. their bounds shifted)
+            self.bounds.extend([b[:4] + (self.offset + b[4],) for b in \
+                meta["bounds"]])
+            _copy(handle, self.handle, meta["data_size"])
+
+            # Coverage depth
+            _copy(handle, self.zoom.spool, meta["ranges"] * \
+                range_dtype.itemsize)
+            self.zoom.ranges += meta["ranges"]
+            self.zoom.items += meta["count"]
+            self.zoom.bases += meta["bases"]
+            total = meta["total"]
+            self.zoom.total = [self.zoom.total[0] + total[0],
+                min(self.zoom.total[1], total[1]),
+                max(self.zoom.total[2], total[2]),
+                self.zoom.total[3] + total[3], self.zoom.total[4] + total[4]]
+
+            # Extra index entries (i.e. a sorted run)
+            for k, size in enumerate(meta["run_sizes"]):
+                run = tempfile.TemporaryFile(dir=self.dummy_dir)
+                _copy(handle, run, size)
+                run.seek(0)
+                self.runs[k].append((run, self.offset))
+                self.counts[k] += meta["counts"][k]
+                self.key_sizes[k] = max(self.key_sizes[k],
+                    meta["key_sizes"][k])
+                if len(self.runs[k]) >= max_runs:
+                    self._merge_runs(k)
+
+        self.count += meta["count"]
+        self.max_block = max(self.max_block, meta["max_block"])
+        self.offset += meta["data_size"]
+
+    def abort(self):
+        """
+        This function discards the temporary files.
+        """
+
+        super().abort()
+        self._close_spools()
+
+    def _reserve(self):
+
+        # Reserve header, zoom headers, autoSql, total summary, extension
+        # header and extra index list (i.e. written on close)
+        self.handle.write(b"\0" * (header.size + \
+            zoom_header.size * max_zoom_levels))
+        self.as_offset = self.handle.tell()
+        self.handle.write(self.as_def.encode() + b"\0")
+        self.total_offset = self.handle.tell()
+        self.handle.write(b"\0" * total_summary.size)
+        self.ext_offset = self.handle.tell()
+        self.handle.write(b"\0" * ext_header.size)
+        self.extra_offset = self.handle.tell()
+        self.handle.write(b"\0" * (index_entry.size * len(self.extra_index)))
+
+        # Data (i.e. preceded by the item count)
+        self.data_offset = self.handle.tell()
+        self.handle.write(b"\0" * 8)
+        self.offset = self.handle.tell()
+
+    def _add_chrom(self, chrom):
+
+        # Initialize
+        name = chrom.decode()
+        if name in self.chroms:
+            raise ValueError("BED lines not sorted by chrom: %s" % name)
+        if name not in self.chrom_sizes:
+            raise ValueError("Chrom %s not in chrom sizes" % name)
+
+        self.chroms[name] = len(self.chroms)
+        self.chrom = chrom
+        self.chrom_size = self.chrom_sizes[name]
+        self.last_start = 0
+
+    def _flush_block(self):
+
+        # Pack remaining items
+        if len(self.items) > 0:
+            self._pack_block(self.items)
+            self.items = []
+
+    def _pack_block(self, items):
+
+        # Initialize
+        chrom_id = self.chroms[self.chrom.decode()]
+        starts = np.array([f[1] for f in items], dtype=np.int64)
+        ends = np.array([f[2] for f in items], dtype=np.int64)
+        rests = [f[3] if len(f) > 3 else b"" for f in items]
+
+        # Check items (i.e. sorted by start and within the chrom)
+        bad = np.flatnonzero((np.diff(starts, prepend=self.last_start) < 0) | \
+            (ends < starts) | (ends > self.chrom_size))
+        if len(bad) > 0:
+            raise ValueError("BED line not sorted by start or out of " + \
+                "bounds: %s" % b"\t".join(items[bad[0]]).decode())
+        self.last_start = int(starts[-1])
+
+        # Pack items (i.e. chrom ID, start, end and null-terminated fields)
+        data = b"".join([item.pack(chrom_id, s, e) + r + b"\0" for s, e, r in \
+            zip(starts.tolist(), ends.tolist(), rests)])
+        self.count += len(items)
+        self.max_block = max(self.max_block, len(data))
+
+        # Coverage depth (i.e. summarized into zoom levels on close)
+        self.zoom.add(chrom_id, self.chrom_size, starts, ends)
+
+        # Values of extra index fields (i.e. one entry per value and block)
+        names = []
+        for k, (_, i) in enumerate(self.extra_index):
+            names.append(set([r.split(b"\t", i - 2)[i - 3] for r in rests]))
+            self.key_sizes[k] = max(self.key_sizes[k], max(map(len, names[k])))
+
+        # Submit block (i.e. with its bounds)
+        self._submit(data, (self.bounds, (chrom_id, int(starts[0]), chrom_id,
+            int(ends.max())), names))
+        self._drain(self.max_pending)
+
+    def _write_zoom(self, scale, spool, count):
+
+        # Initialize
+        zoom_offset = self.offset
+        bounds = []
+        self.handle.write(struct.pack("<I", count))
+        self.offset += 4
+
+        # Compress blocks of summaries
+        spool.seek(0)
+        for data in iter(lambda: spool.read(items_per_slot * \
+            summary_dtype.itemsize), b""):
+            summaries = np.frombuffer(data, dtype=summary_dtype)
+            self._submit(data, (bounds, (int(summaries["chrom"][0]),
+                int(summaries["start"][0]), int(summaries["chrom"][-1]),
+                int(summaries["end"][-1])), []))
+            self._drain(self.max_pending)
+        self._drain(0)
+
+        # Index
+        index_offset = self.offset
+        write_cir_tree(self.handle, bounds, count, index_offset,
+            items_per_slot)
+        self.offset = self.handle.tell()
+        self.zoom_levels.append((scale, zoom_offset, index_offset))
+
+    def _write(self, block, meta=None):
+
+        # Initialize
+        bounds, key, names = meta
+
+        # Index block (i.e. data blocks by the values of extra fields too)
+        bounds.append(key + (self.offset,))
+        val = struct.pack("<QQ", self.offset, len(block))
+        for k, values in enumerate(names):
+            self.names[k].extend([(name, val) for name in values])
+            self.counts[k] += len(values)
+            if len(self.names[k]) >= spill_size:
+                self._spill(k)
+
+        # Write block
+        self.handle.write(block)
+        self.offset += len(block)
+
+    def _spill(self, k):
+
+        # Write sorted run of extra index entries to a temporary file
+        run = tempfile.TemporaryFile(dir=self.dummy_dir)
+        _write_run(run, sorted(self.names[k], key=itemgetter(0)))
+        run.seek(0)
+        self.runs[k].append((run, 0))
+        self.names[k] = []
+
+    def _merge_runs(self, k):
+
+        # Merge runs of extra index entries into one (i.e. unshifted)
+        run = tempfile.TemporaryFile(dir=self.dummy_dir)
+        _write_run(run, heapq.merge(*[_read_run(*r) for r in self.runs[k]],
+            key=itemgetter(0)))
+        run.seek(0)
+        for r, _ in self.runs[k]:
+            r.close()
+        self.runs[k] = [(run, 0)]
+
+    def _get_entries(self, k):
+
+        # Merge runs of entries sorted by value, then by offset
+        return(heapq.merge(*[_read_run(*r) for r in self.runs[k]],
+            sorted(self.names[k], key=itemgetter(0)), key=itemgetter(0)))
+
+    def _close_spools(self):
+        for runs in self.runs:
+            for run, _ in runs:
+                run.close()
+        self.zoom.close()
+
+    def _finish(self):
+
+        # Chrom B+ tree (i.e. sorted by name)
+        chrom_offset = self.handle.tell()
+        chroms = sorted(self.chroms.items())
+        write_bpt(self.handle, [(c.encode(), struct.pack("<II", i,
+            self.chrom_sizes[c])) for c, i in chroms], len(chroms),
+            max([len(c.encode()) for c in self.chroms], default=0), 8,
+            max(min(block_size, len(chroms)), 1), self.dummy_dir)
+
+        # Extra B+ trees (i.e. merging runs of entries sorted by value, then
+        # by offset)
+        extra_offsets = []
+        for k in range(len(self.extra_index)):
+            extra_offsets.append(self.handle.tell())
+            write_bpt(self.handle, self._get_entries(k), self.counts[k],
+                self.key_sizes[k], 16, block_size, self.dummy_dir)
+
+        # End signature
+        self.handle.write(struct.pack("<I", magic))
+
+        # Header (i.e. buffer size for decompressing any block)
+        self.handle.seek(0)
+        self.handle.write(header.pack(magic, version, len(self.zoom_levels),
+            chrom_offset, self.data_offset, self.index_offset, len(self.fields),
+            self.defined_fields, self.as_offset, self.total_offset,
+            max(self.max_block, items_per_slot * summary_dtype.itemsize),
+            self.ext_offset))
+        for scale, zoom_offset, index_offset in self.zoom_levels:
+            self.handle.write(zoom_header.pack(scale, 0, zoom_offset,
+                index_offset))
+
+        # Total summary
+        self.handle.seek(self.total_offset)
+        if self.count > 0:
+            self.handle.write(total_summary.pack(*self.zoom.total))
+
+        # Extension header and extra index list
+        self.handle.seek(self.ext_offset)
+        self.handle.write(ext_header.pack(ext_header.size,
+            len(self.extra_index), self.extra_offset if \
+            len(self.extra_index) > 0 else 0))
+        for (_, i), offset in zip(self.extra_index, extra_offsets):
+            self.handle.write(index_entry.pack(0, 1, offset, i, 0))
+
+        # Item count
+        self.handle.seek(self.data_offset)
+        self.handle.write(struct.pack("<Q", self.count))
+
+        self._close_spools()
+
+class Piece(Writer):
+    """
+    This class writes the data blocks of some chroms (i.e. of a bigBed file
+    assembled in parallel) to a piece file, followed by their coverage depth
+    and extra index entries, for {Writer.write_piece}.  Chroms are numbered
+    as in {chroms} (i.e. across pieces), so that pieces can be appended as
+    they are.  On close, offsets and sizes are described in {meta}.
+    """
+
+    def __init__(self, file_name, chrom_sizes, chroms, threads=1,
+        as_def=autosql, extra_index=["TFName"], dummy_dir=None):
+
+        super().__init__(file_name, chrom_sizes, threads, as_def,
+            extra_index, dummy_dir=dummy_dir)
+
+        # Initialize
+        self.ids = chroms
+        self.meta = None
+
+    def close(self):
+        """
+        This function writes the remaining data blocks, then the coverage
+        depth and the sorted extra index entries.
+        """
+
+        # Write remaining data blocks
+        self.flush()
+        self._drain(0)
+        data_size = self.offset
+
+        # Write coverage depth
+        self.zoom.end_chrom()
+        self.zoom.spool.seek(0)
+        shutil.copyfileobj(self.zoom.spool, self.handle)
+
+        # Write extra index entries
+        run_sizes = []
+        for k in range(len(self.extra_index)):
+            offset = self.handle.tell()
+            _write_run(self.handle, self._get_entries(k))
+            run_sizes.append(self.handle.tell() - offset)
+
+        self.meta = {"chroms": self.chroms, "count": self.count,
+            "max_block": self.max_block, "bounds": self.bounds,
+            "data_size": data_size, "ranges": self.zoom.ranges,
+            "bases": self.zoom.bases, "total": self.zoom.total,
+            "run_sizes": run_sizes, "counts": self.counts,
+            "key_sizes": self.key_sizes}
+
+        super(Writer, self).close()
+
+    def _reserve(self):
+
+        # Data only (i.e. offsets relative to the piece)
+        self.data_offset = 0
+        self.offset = 0
+
+    def _add_chrom(self, chrom):
+
+        super()._add_chrom(chrom)
+
+        # Number chrom as across pieces
+        name = chrom.decode()
+        if name not in self.ids:
+            raise ValueError("Chrom %s not in piece" % name)
+        self.chroms[name] = self.ids[name]
+
+    def _finish(self):
+        self._close_spools()
+
+class Reader(object):
+    """
+    This class reads a bigBed file (i.e. memory mapped, as written by
+    {Writer} or bedToBigBed): the header, zoom levels, autoSql, total summary
+    and extra indices on open, and the items (or zoom level summaries) of a
+    region through the chrom B+ tree and the R trees, or those with a value
+    of an extra index field through its B+ tree.
+    """
+
+    def __init__(self, file_name):
+
+        # Memory map bigBed file
+        with open(file_name, "rb") as handle:
+            self.buffer = mmap.mmap(handle.fileno(), 0,
+                access=mmap.ACCESS_READ)
+
+        # Header and zoom headers (i.e. scale, data and index offsets)
+        if len(self.buffer) < header.size or \
+           struct.unpack_from("<I", self.buffer)[0] != magic:
+            raise ValueError("Invalid bigBed file: %s" % file_name)
+        (_, self.version, zoom_levels, chrom_offset, self.data_offset,
+            self.index_offset, self.field_count, self.defined_field_count,
+            as_offset, total_offset, self.buffer_size, ext_offset) = \
+            header.unpack_from(self.buffer)
+        self.zoom_levels = []
+        for i in range(zoom_levels):
+            scale, _, data_offset, index_offset = zoom_header.unpack_from(
+                self.buffer, header.size + i * zoom_header.size)
+            self.zoom_levels.append((scale, data_offset, index_offset))
+
+        # AutoSql, item count and total summary (i.e. bases covered, min,
+        # max, sum and sum of squares of coverage depth)
+        self.as_def = self._read_string(as_offset).decode()
+        self.count = struct.unpack_from("<Q", self.buffer,
+            self.data_offset)[0]
+        self.total = total_summary.unpack_from(self.buffer, total_offset)
+
+        # Chroms (i.e. name, ID and size)
+        self.chroms = {}
+        self.ids = {}
+        for key, val in self._read_bpt(chrom_offset):
+            chrom_id, size = struct.unpack("<II", val)
+            self.chroms[key.rstrip(b"\0").decode()] = size
+            self.ids[key.rstrip(b"\0").decode()] = chrom_id
+
+        # Extra indices (i.e. field name, B+ tree offset)
+        self.extra_indices = {}
+        fields = get_fields(self.as_def)
+        _, count, offset = ext_header.unpack_from(self.buffer, ext_offset)
+        for i in range(count if offset > 0 else 0):
+            _, _, bpt_offset, field, _ = index_entry.unpack_from(self.buffer,
+                offset + i * index_entry.size)
+            self.extra_indices[fields[field]] = bpt_offset
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.buffer.close()
+
+    def query(self, chrom, start=0, end=None):
+        """
+        This function yields the items overlapping a region (i.e. chrom,
+        start, end and rest of the fields), through the R tree.
+        """
+
+        # Initialize
+        if chrom not in self.ids:
+            return
+        chrom_id = self.ids[chrom]
+        end = self.chroms[chrom] if end is None else end
+
+        # Items of each block overlapping region
+        for offset, size in self._read_cir_tree(self.index_offset, chrom_id,
+            start, end):
+            for c, s, e, rest in self._read_items(offset, size):
+                if c == chrom_id and s < end and e > start:
+                    yield(chrom, s, e, rest)
+
+    def find(self, value, field="TFName"):
+        """
+        This function yields the items with a value of an extra index field
+        (i.e. chrom, start, end and rest of the fields), through its B+ tree.
+        """
+
+        # Initialize
+        chroms = {i: c for c, i in self.ids.items()}
+        index = get_fields(self.as_def).index(field)
+
+        # Items of each block with value (i.e. in the order of the file)
+        for offset, size in sorted([struct.unpack("<QQ", v) for _, v in \
+            self._read_bpt(self.extra_indices[field], value.encode())]):
+            for c, s, e, rest in self._read_items(offset, size):
+                if rest.split(b"\t")[index - 3] == value.encode():
+                    yield(chroms[c], s, e, rest)
+
+    def summaries(self, level, chrom, start=0, end=None):
+        """
+        This function returns the summaries of a zoom level overlapping a
+        region (i.e. as an array of {summary_dtype}), through its R tree.
+        """
+
+        # Initialize
+        if chrom not in self.ids:
+            return(np.zeros(0, dtype=summary_dtype))
+        chrom_id = self.ids[chrom]
+        end = self.chroms[chrom] if end is None else end
+        summaries = []
+
+        # Summaries of each block overlapping region
+        for offset, size in self._read_cir_tree(self.zoom_levels[level][2],
+            chrom_id, start, end):
+            data = np.frombuffer(self._read_block(offset, size),
+                dtype=summary_dtype)
+            summaries.append(data[(data["chrom"] == chrom_id) & \
+                (data["start"] < end) & (data["end"] > start)])
+
+        return(np.concatenate(summaries) if len(summaries) > 0 else \
+            np.zeros(0, dtype=summary_dtype))
+
+    def _read_string(self, offset):
+        return(self.buffer[offset:self.buffer.find(b"\0", offset)])
+
+    def _read_block(self, offset, size):
+
+        # i.e. uncompressed if the buffer size is 0
+        data = self.buffer[offset:offset+size]
+        if self.buffer_size > 0:
+            data = zlib.decompress(data)
+
+        return(data)
+
+    def _read_items(self, offset, size):
+
+        # Initialize
+        data = self._read_block(offset, size)
+        pos = 0
+
+        # Chrom ID, start, end and null-terminated rest of the fields
+        while pos < len(data):
+            chrom_id, start, end = item.unpack_from(data, pos)
+            pos += item.size
+            rest_end = data.index(b"\0", pos)
+            yield(chrom_id, start, end, data[pos:rest_end])
+            pos = rest_end + 1
+
+    def _read_bpt(self, offset, key=None):
+
+        # Header (i.e. magic, block size, key size and value size)
+        m, _, key_size, val_size = struct.unpack_from("<IIII", self.buffer,
+            offset)
+        if m != bpt_magic:
+            raise ValueError("Invalid B+ tree at offset %s" % offset)
+
+        # Key, value pairs (i.e. in key order; only those of {key}, if given)
+        if key is not None:
+            key = key.ljust(key_size, b"\0")
+        yield from self._read_bpt_node(offset + 32, key_size, val_size, key)
+
+    def _read_bpt_node(self, offset, key_size, val_size, key=None):
+
+        # Initialize
+        is_leaf, _, n = struct.unpack_from("<BBH", self.buffer, offset)
+        offset += 4
+
+        # Leaf (i.e. key, value pairs)
+        if is_leaf:
+            for i in range(n):
+                pos = offset + i * (key_size + val_size)
+                k = self.buffer[pos:pos+key_size]
+                if key is None or k == key:
+                    yield(k, self.buffer[pos+key_size:pos+key_size+val_size])
+            return
+
+        # Index node (i.e. children from whose first key to that of the next
+        # child {key} may be)
+        keys = [self.buffer[offset+i*(key_size+8):offset+i*(key_size+8)+ \
+            key_size] for i in range(n)]
+        for i in range(n):
+            if key is not None and (keys[i] > key or \
+               (i + 1 < n and keys[i + 1] < key)):
+                continue
+            child = struct.unpack_from("<Q", self.buffer,
+                offset + i * (key_size + 8) + key_size)[0]
+            yield from self._read_bpt_node(child, key_size, val_size, key)
+
+    def _read_cir_tree(self, offset, chrom_id, start, end):
+
+        # Header (i.e. magic and block size)
+        m = struct.unpack_from("<I", self.buffer, offset)[0]
+        if m != cir_magic:
+            raise ValueError("Invalid R tree at offset %s" % offset)
+
+        # Blocks overlapping region (i.e. offset, size pairs)
+        return(list(self._read_cir_node(offset + 48, (chrom_id, start),
+            (chrom_id, end))))
+
+    def _read_cir_node(self, offset, start, end):
+
+        # Initialize
+        is_leaf, _, n = struct.unpack_from("<BBH", self.buffer, offset)
+        offset += 4
+
+        # For each slot overlapping region (i.e. bounds as chrom, position)
+        for i in range(n):
+            if is_leaf:
+                sc, ss, ec, ee, block_offset, size = struct.unpack_from(
+                    "<IIIIQQ", self.buffer, offset + i * 32)
+            else:
+                sc, ss, ec, ee, child = struct.unpack_from("<IIIIQ",
+                    self.buffer, offset + i * 24)
+            if not (start < (ec, ee) and end > (sc, ss)):
+                continue
+            if is_leaf:
+                yield(block_offset, size)
+            else:
+                yield from self._read_cir_node(child, start, end)
+
+class _Zoom(object):
+
+    def __init__(self, dummy_dir=None):
+
+        # Initialize
+        self.spool = tempfile.TemporaryFile(dir=dummy_dir) # i.e. of ranges
+        self.spools = [] # i.e. uncompressed summaries
+        self.dummy_dir = dummy_dir
+        self.ranges = 0
+        self.items = 0
+        self.bases = 0
+        self.chrom_sizes = {}
+        self.scales = []
+        self.counts = []
+        self.chrom = None
+        self.chrom_size = None
+        self.last = 0
+        self.pending = np.zeros(0, dtype=np.int64) # i.e. ends of open items
+        self.total = [0, np.inf, -np.inf, 0., 0.]
+
+    def add(self, chrom_id, chrom_size, starts, ends):
+
+        # Initialize
+        if chrom_id != self.chrom:
+            self.end_chrom()
+            self.chrom = chrom_id
+            self.chrom_sizes[chrom_id] = chrom_size
+            self.last = int(starts[0])
+        b = int(starts[-1]) # i.e. coverage is final before the last start
+        self.items += len(starts)
+        self.bases += int((ends - starts).sum())
+
+        # Coverage depth since the previous block (i.e. of open items too)
+        starts = np.concatenate((np.full(len(self.pending), self.last), starts))
+        ends = np.concatenate((self.pending, ends))
+        self.pending = ends[ends > b]
+        self.last = b
+        self._add_coverage(starts, np.minimum(ends, b))
+
+    def end_chrom(self):
+
+        # Coverage after the last start (i.e. of open items)
+        if self.chrom is None:
+            return
+        if len(self.pending) > 0:
+            self._add_coverage(np.full(len(self.pending), self.last),
+                self.pending)
+        self.pending = np.zeros(0, dtype=np.int64)
+        self.chrom = None
+
+    def summarize(self):
+
+        # Initialize (i.e. scales as chosen by bedToBigBed, from the mean
+        # item size)
+        scale = max(self.bases // self.items if self.items > 0 else 0, 10)
+        while len(self.scales) < max_zoom_levels:
+            self.scales.append(scale)
+            if scale > 1000000000:
+                break
+            scale *= zoom_increment
+        self.spools = [tempfile.TemporaryFile(dir=self.dummy_dir) for _ in \
+            self.scales]
+        self.counts = [0 for _ in self.scales]
+        self.carries = [None for _ in self.scales]
+        self.inputs = [[] for _ in self.scales] # i.e. bins of the finer level
+        self.buffered = [0 for _ in self.scales]
+
+        # For each chunk of ranges...
+        self.spool.seek(0)
+        for data in iter(lambda: self.spool.read(spill_size * \
+            range_dtype.itemsize), b""):
+            ranges = np.frombuffer(data, dtype=range_dtype)
+
+            # For each chrom...
+            idx = np.flatnonzero(np.diff(ranges["chrom"].astype(np.int64),
+                prepend=-1) != 0).tolist() + [len(ranges)]
+            for a, z in zip(idx[:-1], idx[1:]):
+                chrom = int(ranges["chrom"][a])
+                if chrom != self.chrom:
+                    self._end_summaries()
+                    self.chrom = chrom
+                    self.chrom_size = self.chrom_sizes[chrom]
+                self._add_summaries(ranges["start"][a:z].astype(np.int64),
+                    ranges["end"][a:z].astype(np.int64),
+                    ranges["depth"][a:z].astype(np.float64))
+        self._end_summaries()
+
+    def select(self, data_size):
+
+        # First zoom level (i.e. at most half the size of the data)
+        first = 0
+        for i, count in enumerate(self.counts):
+            if count * summary_dtype.itemsize // 2 <= data_size // 2:
+                first = i
+                break
+
+        # Further levels (i.e. while they have fewer summaries)
+        levels = [first]
+        for i in range(first + 1, len(self.counts)):
+            if self.counts[i] >= self.counts[levels[-1]]:
+                break
+            levels.append(i)
+
+        return([(self.scales[i], self.spools[i], self.counts[i]) for i in \
+            levels if self.counts[i] > 0])
+
+    def close(self):
+        self.spool.close()
+        for spool in self.spools:
+            spool.close()
+
+    def _add_coverage(self, starts, ends):
+
+        # Ranges of constant depth (i.e. between consecutive events)
+        pos = np.concatenate((starts, ends))
+        delta = np.concatenate((np.ones(len(starts), dtype=np.int64),
+            -np.ones(len(ends), dtype=np.int64)))
+        order = np.argsort(pos, kind="stable")
+        pos = pos[order]
+        depth = np.cumsum(delta[order])
+        idx = np.flatnonzero(pos[1:] != pos[:-1])
+        idx = idx[depth[idx] > 0]
+        s = pos[idx]
+        e = pos[idx + 1]
+        v = depth[idx].astype(np.float64)
+        if len(s) == 0:
+            return
+
+        # Total summary
+        size = e - s
+        self.total[0] += int(size.sum())
+        self.total[1] = min(self.total[1], v.min())
+        self.total[2] = max(self.total[2], v.max())
+        self.total[3] += float((v * size).sum())
+        self.total[4] += float((v * v * size).sum())
+
+        # Spool ranges (i.e. summarized once the scales are known)
+        ranges = np.zeros(len(s), dtype=range_dtype)
+        ranges["chrom"] = self.chrom
+        ranges["start"] = s
+        ranges["end"] = e
+        ranges["depth"] = depth[idx]
+        self.spool.write(ranges.tobytes())
+        self.ranges += len(ranges)
+
+    def _add_summaries(self, s, e, v):
+
+        # Initialize
+        b = int(e[-1]) # i.e. ranges are sorted and do not overlap
+
+        # Split ranges into bins of the first scale
+        scale = self.scales[0]
+        first = s // scale
+        n = (e - 1) // scale - first + 1
+        i = np.repeat(np.arange(len(s)), n)
+        bins = first[i] + np.arange(len(i)) - np.repeat(np.cumsum(n) - n, n)
+        size = np.minimum(e[i], (bins + 1) * scale) - \
+            np.maximum(s[i], bins * scale)
+        v = v[i]
+
+        self._reduce(bins, [size, v, v, v * size, v * v * size], b)
+
+    def _end_summaries(self):
+
+        # Write remaining summaries
+        if self.chrom is None:
+            return
+        self._reduce(np.zeros(0, dtype=np.int64),
+            [np.zeros(0) for _ in range(5)], np.iinfo(np.int64).max, True)
+        self.chrom = None
+
+    def _reduce(self, bins, stats, b, final=False):
+
+        # For each zoom level...
+        for i, scale in enumerate(self.scales):
+
+            # Wait for a block of finer bins (i.e. unless {final})
+            if i > 0:
+                self.inputs[i].append((bins, stats))
+                self.buffered[i] += len(bins)
+                if self.buffered[i] < items_per_slot and not final:
+                    break
+                bins = np.concatenate([x[0] for x in self.inputs[i]]) // \
+                    zoom_increment
+                stats = [np.concatenate(s) for s in \
+                    zip(*[x[1] for x in self.inputs[i]])]
+                self.inputs[i] = []
+                self.buffered[i] = 0
+
+            # Aggregate bins (i.e. complete ones end before {b})
+            self.carries[i], bins, stats = _aggregate(self.carries[i], bins,
+                stats, b // scale)
+            if len(bins) == 0 and not final:
+                break
+
+            # Write summaries
+            summaries = np.zeros(len(bins), dtype=summary_dtype)
+            summaries["chrom"] = self.chrom
+            summaries["start"] = bins * scale
+            summaries["end"] = np.minimum((bins + 1) * scale, self.chrom_size)
+            for field, values in zip(summary_dtype.names[3:], stats):
+                summaries[field] = values
+            self.spools[i].write(summaries.tobytes())
+            self.counts[i] += len(summaries)
@@ -0,0 +1,97 @@
+import hashlib
+import numpy as np
+import os
+import tempfile
+import zipfile
+
+# Globals
+max_size = 1024 ** 3 # i.e. 1 Gb
+
+#-------------#
+# Functions   #
+#-------------#
+
+def get_key(*parts):
+    """
+    This function returns a content-addressed key (i.e. a SHA-256 digest) for
+    the given parts (i.e. bytes, or any other object through its repr).
+    """
+
+    # Initialize
+    h = hashlib.sha256()
+
+    # Hash each part separately (i.e. so that parts cannot run into each other)
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = repr(part).encode()
+        h.update(hashlib.sha256(part).digest())
+
+    return(h.hexdigest())
+
+def load(cache_dir, key):
+    """
+    This function returns the arrays cached under a key as a {dict}, or None
+    if the key is not in the cache.
+    """
+
+    # Initialize
+    npz_file = os.path.join(cache_dir, "%s.npz" % key)
+
+    # Load arrays
+    try:
+        with np.load(npz_file) as data:
+            arrays = {k: data[k] for k in data.files}
+        os.utime(npz_file) # i.e. mark as recently used
+    except (OSError, EOFError, ValueError, zipfile.BadZipFile):
+        return(None)
+
+    return(arrays)
+
+def save(cache_dir, key, size=max_size, **arrays):
+    """
+    This function caches arrays under a key and evicts the least recently
+    used entries if the cache exceeds {size} bytes.  Entries are written to a
+    temporary file and renamed (i.e. safe for concurrent writers).
+    """
+
+    # Create cache directory
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write entry atomically
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as handle:
+        np.savez(handle, **arrays)
+    os.replace(tmp_file, os.path.join(cache_dir, "%s.npz" % key))
+
+    # Evict entries
+    evict(cache_dir, size)
+
+def evict(cache_dir, size=max_size):
+    """
+    This function removes the least recently used entries of a cache until
+    its total size is no greater than {size} bytes.
+    """
+
+    # Initialize
+    entries = []
+
+    # Get cache entries
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(".npz"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError: # i.e. evicted by another writer
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(e[1] for e in entries)
+
+    # Remove oldest entries first
+    for _, entry_size, npz_file in sorted(entries):
+        if total <= size:
+            break
+        try:
+            os.remove(npz_file)
+        except FileNotFoundError:
+            pass
+        total -= entry_size
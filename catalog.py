@@ -0,0 +1,102 @@
+import numpy as np
+import os
+
+# Import my functions
+import pwm
+
+# Globals
+catalog_file = "profiles.npy" # i.e. from get-profiles.py
+_catalogs = {} # i.e. memory-mapped catalog and indices of each profiles dir
+
+#-------------#
+# Functions   #
+#-------------#
+
+def load(profiles_dir):
+    """
+    This function memory-maps the catalog of profiles (i.e. a {numpy}
+    structured array of matrix IDs, versions, names, taxons, lengths, counts
+    and PWMs) in a profiles directory, or returns None if there is none.
+    """
+
+    # Initialize
+    npy_file = os.path.join(profiles_dir, catalog_file)
+
+    if not os.path.exists(npy_file):
+        return(None)
+
+    return(np.load(npy_file, mmap_mode="r"))
+
+def select(catalog, latest=False, profile=set(), taxon=None):
+    """
+    This function returns the indices of the profiles in the catalog from
+    the given taxons and/or with the given IDs (default = all), optionally
+    only the latest version of each profile.
+    """
+
+    # Initialize
+    idx = np.arange(len(catalog))
+
+    # Filter by taxon and ID
+    if taxon is not None:
+        idx = idx[np.isin(catalog["taxon"][idx], list(taxon))]
+    if len(profile) > 0:
+        idx = idx[np.isin(catalog["matrix_id"][idx], list(profile))]
+
+    # Keep the latest version of each profile
+    if latest:
+        base_ids = np.char.partition(catalog["matrix_id"][idx], ".")[:, 0]
+        order = np.lexsort((-catalog["version"][idx], base_ids))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = base_ids[order][1:] != base_ids[order][:-1]
+        idx = np.sort(idx[order][first])
+
+    return(idx)
+
+def get_names(catalog, idx=None):
+    """
+    This function returns a {dict} of the names of the profiles in the
+    catalog (or of those at the given indices), keyed by matrix ID.
+    """
+
+    # Initialize
+    if idx is None:
+        idx = np.arange(len(catalog))
+
+    return(dict(zip(catalog["matrix_id"][idx].tolist(),
+        catalog["name"][idx].tolist())))
+
+def get_pwm(catalog, i):
+    """
+    This function returns the PWM of the profile at an index of the catalog
+    as a {numpy.int64} array (i.e. as from {pwm.read_pwm}).
+    """
+
+    return(np.array(catalog["pwm"][i][:catalog["length"][i]], dtype=np.int64))
+
+def read_pwm(profile_file):
+    """
+    This function returns the PWM of a profile file (i.e. <profiles_dir>/
+    <taxon>/<matrix_id>.pwm) from the memory-mapped catalog of its profiles
+    directory (i.e. once per process), or reads the file if the profile is not
+    in a catalog.
+    """
+
+    # Initialize
+    profiles_dir = os.path.dirname(os.path.dirname(profile_file))
+    matrix_id = os.path.basename(profile_file)[:-len(".pwm")]
+
+    # Memory-map catalog (i.e. indexed by matrix ID)
+    if profiles_dir not in _catalogs:
+        catalog = load(profiles_dir)
+        indices = {}
+        if catalog is not None:
+            indices = {m: i for i, m in \
+                enumerate(catalog["matrix_id"].tolist())}
+        _catalogs[profiles_dir] = (catalog, indices)
+    catalog, indices = _catalogs[profiles_dir]
+
+    if matrix_id not in indices:
+        return(pwm.read_pwm(profile_file))
+
+    return(get_pwm(catalog, indices[matrix_id]))
@@ -0,0 +1,301 @@
+from itertools import islice
+import json
+import mmap
+import numpy as np
+import os
+import struct
+import zlib
+
+# Import my functions
+import compression
+import merge
+
+# Globals
+magic = b"JASPARHITS1\x00"
+trailer = struct.Struct("<QQQQ12s") # i.e. table offset, chunks, meta offset,
+                                    # meta size and magic
+chunk_dtype = np.dtype([
+    ("profile", "<u4"),
+    ("chrom", "<u4"),
+    ("n", "<u4"),
+    ("first", "<u8"), # i.e. first start (delta encoding)
+    ("last", "<u8"), # i.e. last start
+    ("offset", "<u8"),
+    ("starts", "<u4"), # i.e. compressed sizes of each column
+    ("strands", "<u4"),
+    ("rel_scores", "<u4"),
+    ("log_pvalues", "<u4"),
+])
+columns = ["starts", "strands", "rel_scores", "log_pvalues"]
+max_chunk = 16384 # i.e. maximum hits per chunk (decoded at once by queries)
+
+#-------------#
+# Functions   #
+#-------------#
+
+def encode_chunk(starts, strands, rel_scores, log_pvalues,
+    compresslevel=compression.level):
+    """
+    This function encodes hits (i.e. sorted by start) into compressed
+    columns: delta-encoded {numpy.uint32} starts, strand bits (i.e. 1 for -)
+    and {numpy.uint16} relative scores and p-values.  It returns the first
+    and last starts, the concatenated columns and their compressed sizes.
+    """
+
+    # Initialize
+    starts = np.asarray(starts, dtype=np.int64)
+    arrays = [
+        np.diff(starts, prepend=starts[0]).astype("<u4"),
+        np.packbits(np.asarray(strands, dtype=np.uint8)),
+        np.clip(rel_scores, 0, 65535).astype("<u2"),
+        np.clip(log_pvalues, 0, 65535).astype("<u2"),
+    ]
+
+    # Compress columns
+    blocks = [zlib.compress(a.tobytes(), compresslevel) for a in arrays]
+
+    return(int(starts[0]), int(starts[-1]), b"".join(blocks),
+        [len(b) for b in blocks])
+
+def decode_chunk(buffer, chunk):
+    """
+    This function decodes the columns of a chunk (i.e. a row of the chunk
+    table) from a buffer (e.g. a memory-mapped container), and returns its
+    starts, strands, relative scores and p-values.
+    """
+
+    # Initialize
+    offset = int(chunk["offset"])
+    n = int(chunk["n"])
+    arrays = []
+
+    # Decompress columns
+    for column, dtype in zip(columns, ["<u4", "u1", "<u2", "<u2"]):
+        size = int(chunk[column])
+        data = zlib.decompress(buffer[offset:offset+size])
+        arrays.append(np.frombuffer(data, dtype=dtype))
+        offset += size
+
+    # Undo delta encoding and bit packing
+    starts = np.cumsum(arrays[0], dtype=np.int64) + int(chunk["first"])
+    strands = np.unpackbits(arrays[1])[:n]
+
+    return(starts, strands, arrays[2], arrays[3])
+
+#-------------#
+# Classes     #
+#-------------#
+
+class Writer(object):
+    """
+    This class writes hits of many profiles on a genome into a single
+    container of compressed column chunks, followed by a footer with the
+    chunk table (i.e. an index of chunks per profile and chrom), the chroms
+    and the profiles.  The container is written to a temporary file that
+    replaces the output file on close (i.e. atomically).
+    """
+
+    def __init__(self, file_name):
+
+        # Initialize
+        self.file_name = file_name
+        self.tmp_file = os.path.join(os.path.dirname(file_name),
+            ".%s.%s.tmp" % (os.path.basename(file_name), os.getpid()))
+        self.chroms = {}
+        self.profiles = {}
+        self.chunks = []
+        self.handle = open(self.tmp_file, "wb")
+        self.handle.write(magic)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.handle.close()
+            os.remove(self.tmp_file)
+
+    def add_profile(self, matrix_id, name, length):
+        """
+        This function adds a profile and returns its id.
+        """
+
+        if matrix_id not in self.profiles:
+            self.profiles[matrix_id] = (len(self.profiles), name, length)
+
+        return(self.profiles[matrix_id][0])
+
+    def add_chrom(self, chrom):
+        """
+        This function adds a chrom and returns its id.
+        """
+
+        return(self.chroms.setdefault(chrom, len(self.chroms)))
+
+    def write_chunk(self, profile, chrom, n, first, last, data, sizes):
+        """
+        This function writes an encoded chunk (i.e. from {encode_chunk}) of
+        {n} hits of a profile on a chrom.
+        """
+
+        self.chunks.append((profile, chrom, n, first, last, self.handle.tell(),
+            *sizes))
+        self.handle.write(data)
+
+    def close(self):
+        """
+        This function writes the footer and renames the container.
+        """
+
+        # Chunk table
+        table_offset = self.handle.tell()
+        table = np.array(self.chunks, dtype=chunk_dtype)
+        self.handle.write(table.tobytes())
+
+        # Chroms and profiles
+        meta_offset = self.handle.tell()
+        meta = json.dumps({
+            "chroms": sorted(self.chroms, key=self.chroms.get),
+            "profiles": [[m, n, l] for m, (_, n, l) in \
+                sorted(self.profiles.items(), key=lambda x: x[1][0])],
+        }).encode()
+        self.handle.write(meta)
+        self.handle.write(trailer.pack(table_offset, len(table), meta_offset,
+            len(meta), magic))
+        self.handle.close()
+
+        # Rename
+        os.replace(self.tmp_file, self.file_name)
+
+class Reader(object):
+    """
+    This class reads a container of hits (i.e. memory mapped).
+    """
+
+    def __init__(self, file_name):
+
+        # Memory map container
+        with open(file_name, "rb") as handle:
+            self.buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Read footer
+        if len(self.buffer) < len(magic) + trailer.size:
+            raise ValueError("Invalid hits container: %s" % file_name)
+        table_offset, n, meta_offset, meta_size, m = trailer.unpack(
+            self.buffer[-trailer.size:])
+        if m != magic or self.buffer[:len(magic)] != magic:
+            raise ValueError("Invalid hits container: %s" % file_name)
+        self.chunks = np.frombuffer(self.buffer, dtype=chunk_dtype, count=n,
+            offset=table_offset)
+        meta = json.loads(self.buffer[meta_offset:meta_offset+meta_size])
+        self.chroms = meta["chroms"]
+        self.profiles = meta["profiles"] # i.e. matrix ID, name, length
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        del self.chunks
+        self.buffer.close()
+
+    def read(self, profile=None, chrom=None):
+        """
+        This function yields the hits of a profile and/or chrom (i.e. IDs or
+        names; default = all), in the order they were written, as profile
+        id, chrom id, starts, ends, strands, relative scores and p-values.
+        """
+
+        # Initialize
+        chunks = self.chunks
+        if isinstance(profile, str):
+            profile = [p[0] for p in self.profiles].index(profile)
+        if isinstance(chrom, str):
+            chrom = self.chroms.index(chrom)
+        if profile is not None:
+            chunks = chunks[chunks["profile"] == profile]
+        if chrom is not None:
+            chunks = chunks[chunks["chrom"] == chrom]
+
+        yield from self._read(chunks)
+
+    def to_tsv(self, handle, profile):
+        """
+        This function writes the hits of a profile in the TSV layout of
+        scan-sequence.py (i.e. chrom, start, end, name, relative score,
+        p-value and strand) to a binary handle.
+        """
+
+        for hits in self.read(profile):
+            handle.write(b"".join(self._get_lines(*hits)))
+
+    def to_bed(self, handle, chroms=None):
+        """
+        This function writes all hits in the BED6+1 layout of scans2bigBed
+        (i.e. chrom, start, end, matrix ID, p-value capped at 1000, strand and
+        name) to a binary handle, sorted by chrom (i.e. in the order of
+        {chroms}, e.g. a chrom sizes file, except where the genome lists them
+        otherwise; default = as in the genome) and start as by merge-scans.py
+        (i.e. a k-way merge of the chunks of each profile, in bounded memory).
+        """
+
+        # Initialize
+        if chroms is None:
+            chroms = self.chroms
+        groups = {}
+        chrom_lists = {}
+
+        # Chunks of each chrom and profile (i.e. in the order they were
+        # written)
+        keys = (self.chunks["chrom"].astype(np.int64) << 32) | \
+            self.chunks["profile"]
+        order = np.argsort(keys, kind="stable")
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for idx in np.split(order, bounds) if len(order) > 0 else []:
+            c = self.chroms[int(self.chunks["chrom"][idx[0]])]
+            p = int(self.chunks["profile"][idx[0]])
+            groups.setdefault(c, []).append(idx)
+            chrom_lists.setdefault(p, []).append(c)
+
+        # Order chroms (i.e. as the scans of each profile by merge-scans.py)
+        chroms = merge.sort_chroms(list(chrom_lists.values()), chroms)
+
+        # For each chrom...
+        for chrom in chroms:
+
+            # Merge the hits of each profile (i.e. streams of lines)
+            streams = []
+            for idx in groups[chrom]:
+                chunks = self.chunks[idx]
+                matrix_id = self.profiles[int(chunks["profile"][0])][0]
+                streams.append((matrix_id, (self._get_lines(*hits) for hits \
+                    in self._read(chunks)), matrix_id))
+            lines = merge.merge_lines(streams, chroms)
+            for batch in iter(lambda: list(islice(lines, 65536)), []):
+                handle.write(b"".join(batch))
+
+    def _read(self, chunks):
+
+        # For each chunk...
+        for chunk in chunks:
+            starts, strands, rel_scores, log_pvalues = decode_chunk(
+                self.buffer, chunk)
+            length = self.profiles[int(chunk["profile"])][2]
+            yield(int(chunk["profile"]), int(chunk["chrom"]), starts,
+                starts + length, strands, rel_scores, log_pvalues)
+
+    def _get_lines(self, p, c, starts, ends, strands, rel_scores, log_pvalues):
+
+        # Initialize
+        chrom = self.chroms[c].encode()
+        name = self.profiles[p][1].encode()
+
+        # i.e. as scan-sequence.py
+        return([b"%s\t%d\t%d\t%s\t%d\t%d\t%s\n" % (chrom, s, e, name, r, l,
+            b"-" if t else b"+") for s, e, r, l, t in zip(starts.tolist(),
+            ends.tolist(), rel_scores.tolist(), log_pvalues.tolist(),
+            strands.tolist())])
@@ -0,0 +1,126 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import zlib
+
+# Globals
+block_size = 1048576 # i.e. 1 Mb of uncompressed data per gzip member
+level = 6 # i.e. same as gzip
+
+#-------------#
+# Functions   #
+#-------------#
+
+def compress_block(data, compresslevel=level):
+    """
+    This function compresses a block of data into a standalone gzip member
+    (i.e. gzip members can be concatenated into a valid gzip file).
+    """
+
+    c = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+
+    return(c.compress(data) + c.flush())
+
+#-------------#
+# Classes     #
+#-------------#
+
+class Writer(object):
+    """
+    This class writes a gzip file as a series of independently compressed
+    blocks (i.e. gzip members), which are compressed in parallel by a pool of
+    threads and written in order.  Data are written to a temporary file that
+    replaces the output file on close (i.e. atomically).
+    """
+
+    def __init__(self, file_name, threads=1, size=block_size,
+        compress=compress_block):
+
+        # Initialize
+        self.file_name = file_name
+        self.tmp_file = os.path.join(os.path.dirname(file_name),
+            ".%s.%s.tmp" % (os.path.basename(file_name), os.getpid()))
+        self.size = size
+        self.compress = compress
+        self.buffer = []
+        self.buffered = 0
+        self.pending = deque()
+        self.max_pending = threads * 2
+        self.executor = ThreadPoolExecutor(threads)
+        self.handle = open(self.tmp_file, "wb")
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data):
+        """
+        This function buffers data and compresses it in blocks.
+        """
+
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        """
+        This function compresses any buffered data (i.e. as one block).
+        """
+
+        # Submit block
+        if self.buffered > 0:
+            self._submit(b"".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+        # Write compressed blocks in order (i.e. bounded memory)
+        self._drain(self.max_pending)
+
+    def close(self):
+        """
+        This function writes all remaining blocks and renames the temporary
+        file to the output file.
+        """
+
+        # Write remaining blocks
+        self.flush()
+        self._drain(0)
+        self.executor.shutdown()
+        self._finish()
+        self.handle.close()
+
+        # Rename
+        os.replace(self.tmp_file, self.file_name)
+
+    def abort(self):
+        """
+        This function discards the temporary file.
+        """
+
+        self.executor.shutdown(cancel_futures=True)
+        self.handle.close()
+        if os.path.exists(self.tmp_file):
+            os.remove(self.tmp_file)
+
+    def _submit(self, data, meta=None):
+        self.pending.append((self.executor.submit(self.compress, data), meta))
+
+    def _drain(self, n):
+        while len(self.pending) > n:
+            future, meta = self.pending.popleft()
+            self._write(future.result(), meta)
+
+    def _write(self, block, meta=None):
+        self.handle.write(block)
+
+    def _finish(self):
+
+        # i.e. no data (a valid gzip file needs at least one member)
+        if self.handle.tell() == 0:
+            self.handle.write(compress_block(b""))
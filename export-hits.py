@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import click
+import os
+import sys
+
+# Import my functions
+import columnar
+import compression
+import merge
+
+# Authorship
+__author__ = "Oriol Fornes"
+__organization__ = "The JASPAR Consortium"
+__version__ = "2025.11.10"
+__maintainer__ = "Oriol Fornes"
+__email__ = "oriol.fornes@gmail.com"
+__status__ = "Production"
+
+CONTEXT_SETTINGS = {
+    "help_option_names": ["-h", "--help"],
+}
+
+@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
+@click.argument(
+    "hits_file",
+    type=click.Path(exists=True, resolve_path=True),
+)
+@click.option(
+    "-b", "--bed",
+    help="Export all hits as a sorted BED6+1 file (i.e. as from scans2bigBed).",
+    is_flag=True,
+)
+@click.option(
+    "-c", "--chrom-sizes",
+    help="Chrom sizes file, in the order of which chroms are exported (BED).  [default: as in the genome]",
+    type=click.Path(exists=True, resolve_path=True),
+)
+@click.option(
+    "-o", "--output",
+    help="Output directory (TSV) or file (BED).  [default: ./ or stdout]",
+    type=click.Path(resolve_path=True),
+)
+@click.option(
+    "--profile",
+    help="Profile ID(s) to export (TSV).  [default: all]",
+    multiple=True,
+)
+@click.option(
+    "-t", "--threads",
+    help="Number of CPU threads to use.",
+    type=int,
+    default=1,
+    show_default=True,
+)
+
+def main(**params):
+
+    # Export hits
+    export_hits(params["hits_file"], params["output"], params["bed"],
+        set(params["profile"]), params["threads"], params["chrom_sizes"])
+
+def export_hits(hits_file, output=None, bed=False, profile=set(), threads=1,
+    chrom_sizes=None):
+
+    with columnar.Reader(hits_file) as reader:
+
+        # Export all hits as BED (i.e. as merge-scans.py)
+        if bed:
+            chroms = None
+            if chrom_sizes is not None:
+                chroms = merge.read_chrom_sizes(chrom_sizes)
+            if output is None:
+                reader.to_bed(sys.stdout.buffer, chroms)
+            else:
+                with compression.Writer(output, threads) if \
+                     output.endswith(".gz") else open(output, "wb") as handle:
+                    reader.to_bed(handle, chroms)
+
+        # Export hits of each profile as TSV (i.e. as from scan-sequence.py)
+        else:
+
+            # Create output directory
+            output_dir = "./" if output is None else output
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+
+            # For each profile...
+            for matrix_id, _, _ in reader.profiles:
+                if len(profile) > 0 and matrix_id not in profile:
+                    continue
+                output_file = os.path.join(output_dir, "%s.tsv.gz" % matrix_id)
+                with compression.Writer(output_file, threads) as handle:
+                    reader.to_tsv(handle, matrix_id)
+
+#-------------#
+# Main        #
+#-------------#
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,590 @@
+from functools import lru_cache
+import numpy as np
+import os
+import struct
+import tempfile
+import zlib
+
+# Import my functions
+import cache
+
+# Globals
+nucleotides = "ACGT"
+N = len(nucleotides)
+read_size = 4194304 # i.e. bytes decompressed at once when indexing
+twobit_magic = 0x1A412743
+
+# 2bit to integer code translation table (i.e. T=0, C=1, A=2, G=3)
+_twobit_codes = np.array([3, 1, 0, 2], dtype=np.uint8)
+
+# Indices of 2bit and BGZF FASTA files and of their gaps (i.e. read once per
+# process)
+_indices = {}
+_gaps = {}
+
+# Byte to integer code translation table (A=0, C=1, G=2, T=3, other=N)
+_codes = bytearray([N] * 256)
+for i, nt in enumerate(nucleotides):
+    _codes[ord(nt)] = i
+    _codes[ord(nt.lower())] = i
+_codes = bytes(_codes)
+
+#-------------#
+# Functions   #
+#-------------#
+
+def parse_fasta(fasta_file):
+    """
+    This function parses a FASTA file and yields its sequences one by one,
+    integer-encoded, in the form chrom, sequence.
+    """
+
+    for chrom, sequence in _parse_fasta(fasta_file):
+        yield(chrom, encode(sequence))
+
+def _parse_fasta(fasta_file):
+
+    # Initialize
+    chrom = None
+    lines = []
+
+    with open(fasta_file, "rb") as handle:
+
+        # For each line...
+        for line in handle:
+
+            # New sequence
+            if line.startswith(b">"):
+                if chrom is not None:
+                    yield(chrom, b"".join(lines))
+                chrom = line[1:].split()[0].decode()
+                lines = []
+
+            else:
+                lines.append(line.rstrip())
+
+        # Last sequence
+        if chrom is not None:
+            yield(chrom, b"".join(lines))
+
+def encode(sequence):
+    """
+    This function integer-encodes a nucleotide sequence (i.e. bytes) into a
+    {numpy.uint8} array.
+    """
+
+    return(np.frombuffer(sequence.translate(_codes), dtype=np.uint8))
+
+def parse_genome(genome_file):
+    """
+    This function parses a FASTA, 2bit or BGZF FASTA file and yields its
+    sequences one by one, integer-encoded, in the form chrom, sequence.
+    """
+
+    if get_format(genome_file) == "fasta":
+        yield from parse_fasta(genome_file)
+
+    else:
+        for chrom, seq_file in index_genome(genome_file):
+            yield(chrom, load(seq_file))
+
+def get_format(genome_file):
+    """
+    This function returns the format of a genome file (i.e. "2bit", "bgzf"
+    or "fasta").
+    """
+
+    with open(genome_file, "rb") as handle:
+        header = handle.read(18)
+
+    # i.e. the signature can be in either byte order
+    if len(header) >= 4 and twobit_magic in struct.unpack("<I", header[:4]) + \
+       struct.unpack(">I", header[:4]):
+        return("2bit")
+
+    if header[:2] == b"\x1f\x8b":
+        if len(header) == 18 and header[3] & 4 and header[12:14] == b"BC":
+            return("bgzf")
+        raise ValueError("Compressed FASTA files must be BGZF " + \
+            "(i.e. compressed with bgzip): %s" % genome_file)
+
+    return("fasta")
+
+def index_genome(genome_file):
+    """
+    This function returns a list of chrom, sequence pairs of a 2bit or BGZF
+    FASTA file, where each sequence (i.e. a file, chrom pair) can be decoded
+    in full or in part with {load} (i.e. without expanding the file).
+    """
+
+    return([(chrom, (genome_file, chrom)) for chrom in _get_index(genome_file)])
+
+def encode_genome(fasta_file, output_dir, prefix):
+    """
+    This function integer-encodes each sequence of a FASTA (or 2bit or BGZF
+    FASTA) file once and saves it to disk as a NumPy array (i.e. for memory
+    mapping), returning a list of chrom, file pairs.
+    """
+
+    # Initialize
+    chroms = []
+
+    # For each sequence...
+    for i, (chrom, sequence) in enumerate(parse_genome(fasta_file)):
+        npy_file = os.path.join(output_dir, "%s.%s.npy" % (prefix, i))
+        np.save(npy_file, sequence)
+        chroms.append((chrom, npy_file))
+
+    return(chroms)
+
+def load(seq_file, start=0, end=None):
+    """
+    This function memory maps an integer-encoded sequence (i.e. a NumPy file)
+    or decodes a sequence of a 2bit or BGZF FASTA file (i.e. from
+    {index_genome}), and returns its region from {start} to {end} (i.e.
+    0-based, half-open; default = whole sequence).
+    """
+
+    if isinstance(seq_file, str):
+        return(np.load(seq_file, mmap_mode="r")[start:end])
+
+    # Initialize
+    genome_file, chrom = seq_file
+    index = _get_index(genome_file)
+    length = index[chrom][0]
+    end = length if end is None else min(end, length)
+    start = min(start, end)
+
+    if isinstance(index, TwoBitIndex):
+        return(_load_twobit(genome_file, index[chrom], start, end))
+
+    return(encode(_read_bgzf(genome_file, index, index[chrom], start, end)))
+
+def get_length(seq_file):
+    """
+    This function returns the length of a sequence (i.e. as {load}).
+    """
+
+    if isinstance(seq_file, str):
+        return(len(load(seq_file)))
+
+    genome_file, chrom = seq_file
+
+    return(_get_index(genome_file)[chrom][0])
+
+def get_gaps_file(genome_file):
+    """
+    This function returns the gaps file of a genome file (i.e. next to it or,
+    if its directory is read-only, in the temporary directory).
+    """
+
+    return(_get_index_files(genome_file, "gaps.npz")[0])
+
+def index_gaps(genome_file):
+    """
+    This function indexes the runs of Ns and the soft-masked (i.e. lower case)
+    intervals of each sequence of a FASTA, 2bit or BGZF FASTA file into a
+    file (i.e. from {get_gaps_file}), unless indexed since last modified.
+    """
+
+    # Initialize
+    gaps_file = get_gaps_file(genome_file)
+    chroms = []
+    lengths = []
+    runs = {"n": [], "mask": []}
+
+    # Skip if already indexed
+    if _is_indexed(genome_file, gaps_file):
+        return
+
+    # For each sequence...
+    for i, (chrom, length, n_runs, mask_runs) in \
+        enumerate(_find_gaps(genome_file)):
+        chroms.append(chrom)
+        lengths.append(length)
+        for k, (starts, ends) in zip(["n", "mask"], [n_runs, mask_runs]):
+            runs[k].append((np.full(len(starts), i, dtype=np.int32), starts,
+                ends))
+
+    # Write gaps (i.e. sorted by chrom and start)
+    arrays = {}
+    for k, v in runs.items():
+        for name, a in zip(["chrom", "start", "end"], zip(*v)):
+            arrays["%s_%s" % (k, name)] = np.concatenate(a)
+    tmp_file = "%s.%s.tmp" % (gaps_file, os.getpid())
+    with open(tmp_file, "wb") as handle:
+        np.savez(handle, chroms=np.array(chroms, dtype=str),
+            lengths=np.array(lengths, dtype=np.int64), **arrays)
+    os.replace(tmp_file, gaps_file)
+
+def get_gaps(genome_file, masked=False):
+    """
+    This function reads the gaps of a genome file (i.e. from {index_gaps})
+    and returns a {dict} of chrom, (length, N run starts and ends, and
+    soft-masked interval starts and ends) of each sequence (i.e. soft-masked
+    intervals are only read if {masked}).
+    """
+
+    if (genome_file, masked) not in _gaps:
+
+        # Initialize
+        gaps = {}
+
+        with np.load(get_gaps_file(genome_file)) as data:
+            arrays = {k: data[k] for k in data.files \
+                if masked or not k.startswith("mask_")}
+
+        # For each sequence...
+        for i, (chrom, length) in enumerate(zip(arrays["chroms"].tolist(),
+            arrays["lengths"].tolist())):
+            runs = []
+            for k in ["n", "mask"]:
+                if "%s_chrom" % k not in arrays:
+                    runs.extend([np.zeros(0, dtype=np.int64)] * 2)
+                    continue
+                lo, hi = np.searchsorted(arrays["%s_chrom" % k], [i, i + 1])
+                runs.extend([arrays["%s_start" % k][lo:hi],
+                    arrays["%s_end" % k][lo:hi]])
+            gaps[chrom] = (length, *runs)
+
+        _gaps[(genome_file, masked)] = gaps
+
+    return(_gaps[(genome_file, masked)])
+
+@lru_cache(maxsize=16)
+def get_intervals(genome_file, chrom, motif_length, skip_n=True,
+    skip_masked=False):
+    """
+    This function returns arrays of the starts and ends of the intervals of a
+    sequence within which windows of {motif_length} start, skipping windows
+    within runs of Ns and/or overlapping soft-masked intervals (i.e. from
+    {index_gaps}).
+    """
+
+    # Initialize
+    length, n_starts, n_ends, mask_starts, mask_ends = \
+        get_gaps(genome_file, skip_masked)[chrom]
+    starts = [np.zeros(0, dtype=np.int64)]
+    ends = [np.zeros(0, dtype=np.int64)]
+
+    # Windows within runs of Ns (i.e. at least as long as the motif)
+    if skip_n:
+        idx = n_ends - n_starts >= motif_length
+        starts.append(n_starts[idx])
+        ends.append(n_ends[idx] - motif_length + 1)
+
+    # Windows overlapping soft-masked intervals
+    if skip_masked:
+        starts.append(mask_starts - motif_length + 1)
+        ends.append(mask_ends)
+
+    # Intervals between skipped windows (i.e. up to the last window start)
+    last = length - motif_length + 1
+    skip_starts, skip_ends = _merge_runs(np.concatenate(starts),
+        np.concatenate(ends))
+    starts = np.maximum(np.append(0, skip_ends), 0)
+    ends = np.minimum(np.append(skip_starts, last), last)
+    idx = ends > starts
+
+    return(starts[idx], ends[idx])
+
+def _find_gaps(genome_file):
+
+    # Initialize
+    genome_format = get_format(genome_file)
+
+    # Runs of Ns and soft-masked blocks (i.e. stored in the 2bit file)
+    if genome_format == "2bit":
+        index = _get_index(genome_file)
+        e = index.byteorder
+        with open(genome_file, "rb") as handle:
+            for chrom, (length, _, n_starts, n_sizes, mask_offset) in \
+                index.items():
+                handle.seek(mask_offset)
+                n = struct.unpack(e + "I", handle.read(4))[0]
+                starts = np.frombuffer(handle.read(4 * n), dtype=e + "u4")
+                sizes = np.frombuffer(handle.read(4 * n), dtype=e + "u4")
+                yield(chrom, length, _merge_runs(n_starts, n_starts + n_sizes),
+                    _merge_runs(starts.astype(np.int64),
+                    starts.astype(np.int64) + sizes))
+        return
+
+    # Sequences (i.e. not integer-encoded, as case is needed)
+    if genome_format == "fasta":
+        sequences = _parse_fasta(genome_file)
+    else:
+        index = _get_index(genome_file)
+        sequences = ((chrom, _read_bgzf(genome_file, index, entry, 0,
+            entry[0])) for chrom, entry in index.items())
+
+    # For each sequence...
+    for chrom, sequence in sequences:
+        codes = np.frombuffer(sequence, dtype=np.uint8)
+        yield(chrom, len(sequence), _get_runs(encode(sequence) == N),
+            _get_runs((codes >= ord("a")) & (codes <= ord("z"))))
+
+def _get_runs(mask):
+
+    # Initialize
+    d = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+
+    return(np.flatnonzero(d == 1), np.flatnonzero(d == -1))
+
+def _merge_runs(starts, ends):
+
+    # Initialize
+    idx = np.argsort(starts, kind="stable")
+    starts = np.asarray(starts, dtype=np.int64)[idx]
+    ends = np.maximum.accumulate(np.asarray(ends, dtype=np.int64)[idx])
+    if len(starts) == 0:
+        return(starts, ends)
+
+    # Merge runs overlapping or adjacent to the previous one
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = starts[1:] > ends[:-1]
+    last = np.append(np.flatnonzero(first)[1:] - 1, len(starts) - 1)
+
+    return(starts[first], ends[last])
+
+def _get_index_files(genome_file, *extensions):
+
+    # Next to the genome file (i.e. if indexed since last modified, or if its
+    # directory is writable)
+    index_files = ["%s.%s" % (genome_file, e) for e in extensions]
+    genome_dir = os.path.dirname(os.path.abspath(genome_file))
+    if _is_indexed(genome_file, *index_files) or \
+       os.access(genome_dir, os.W_OK):
+        return(index_files)
+
+    # Otherwise in the temporary directory (i.e. keyed on the genome file
+    # path, so that genome files of the same name do not collide)
+    prefix = os.path.join(tempfile.gettempdir(), "%s.%s" % \
+        (os.path.basename(genome_file),
+        cache.get_key(os.path.abspath(genome_file))[:16]))
+
+    return(["%s.%s" % (prefix, e) for e in extensions])
+
+def _is_indexed(genome_file, *index_files):
+
+    # Initialize
+    mtime = os.path.getmtime(genome_file)
+
+    return(all(os.path.exists(f) and os.path.getmtime(f) >= mtime \
+        for f in index_files))
+
+def _get_index(genome_file):
+
+    if genome_file not in _indices:
+        if get_format(genome_file) == "2bit":
+            _indices[genome_file] = _read_twobit_index(genome_file)
+        else:
+            _indices[genome_file] = _read_bgzf_index(genome_file)
+
+    return(_indices[genome_file])
+
+def _read_twobit_index(twobit_file):
+
+    # Initialize
+    index = TwoBitIndex()
+
+    with open(twobit_file, "rb") as handle:
+
+        # Header (i.e. signature, version, sequence count and reserved)
+        e = "<" if struct.unpack("<I", handle.read(4))[0] == twobit_magic \
+            else ">"
+        version, n, _ = struct.unpack(e + "III", handle.read(12))
+        offset_format = e + ("Q" if version == 1 else "I")
+
+        # Sequence names and offsets
+        offsets = []
+        for _ in range(n):
+            name = handle.read(ord(handle.read(1))).decode()
+            offset = struct.unpack(offset_format,
+                handle.read(struct.calcsize(offset_format)))[0]
+            offsets.append((name, offset))
+
+        # For each sequence...
+        for name, offset in offsets:
+
+            # N blocks (i.e. mask blocks are skipped, as case is ignored)
+            handle.seek(offset)
+            length, n_blocks = struct.unpack(e + "II", handle.read(8))
+            n_starts = np.frombuffer(handle.read(4 * n_blocks), dtype=e + "u4")
+            n_sizes = np.frombuffer(handle.read(4 * n_blocks), dtype=e + "u4")
+            mask_blocks = struct.unpack(e + "I", handle.read(4))[0]
+            dna_offset = offset + 16 + 8 * n_blocks + 8 * mask_blocks
+
+            index[name] = (length, dna_offset, n_starts.astype(np.int64),
+                n_sizes.astype(np.int64), offset + 8 + 8 * n_blocks)
+    index.byteorder = e
+
+    return(index)
+
+def _load_twobit(twobit_file, entry, start, end):
+
+    # Initialize
+    _, dna_offset, n_starts, n_sizes, _ = entry
+    first = start // 4
+    last = (end + 3) // 4
+
+    # Read packed bases (i.e. four per byte, first base in the high bits)
+    with open(twobit_file, "rb") as handle:
+        handle.seek(dna_offset + first)
+        packed = np.frombuffer(handle.read(last - first), dtype=np.uint8)
+    codes = np.empty((len(packed), 4), dtype=np.uint8)
+    for k in range(4):
+        codes[:, k] = (packed >> (6 - 2 * k)) & 3
+    sequence = _twobit_codes[codes.ravel()][start-first*4:end-first*4]
+
+    # Mask N blocks overlapping region
+    idx = np.flatnonzero((n_starts < end) & (n_starts + n_sizes > start))
+    for s, size in zip(n_starts[idx].tolist(), n_sizes[idx].tolist()):
+        sequence[max(s - start, 0):max(min(s + size, end) - start, 0)] = N
+
+    return(sequence)
+
+def _read_bgzf_index(bgzf_file):
+
+    # Initialize
+    fai_file, gzi_file = _get_index_files(bgzf_file, "fai", "gzi")
+
+    # Index FASTA (i.e. unless indexed since last modified, e.g. by samtools)
+    if not _is_indexed(bgzf_file, fai_file, gzi_file):
+        _index_bgzf(bgzf_file, fai_file, gzi_file)
+
+    # Sequence lengths and offsets (i.e. as uncompressed)
+    index = BgzfIndex()
+    with open(fai_file) as handle:
+        for line in handle:
+            name, length, offset, line_bases, line_width = line.split()[:5]
+            index[name] = (int(length), int(offset), int(line_bases),
+                int(line_width))
+
+    # Offsets of blocks, compressed and uncompressed (i.e. the first block is
+    # implicit; ends are the end of the file)
+    with open(gzi_file, "rb") as handle:
+        n = struct.unpack("<Q", handle.read(8))[0]
+        offsets = np.frombuffer(handle.read(16 * n), dtype="<u8")
+    offsets = offsets.reshape(-1, 2).astype(np.int64)
+    index.coffsets = np.concatenate(([0], offsets[:, 0],
+        [os.path.getsize(bgzf_file)]))
+    index.uoffsets = np.concatenate(([0], offsets[:, 1],
+        [np.iinfo(np.int64).max]))
+
+    return(index)
+
+def _index_bgzf(bgzf_file, fai_file, gzi_file):
+
+    # Initialize
+    records = []
+    blocks = []
+    coffset = 0
+    uoffset = 0
+    pos = 0 # i.e. uncompressed offset of the start of the current line
+    carry = b""
+
+    with open(bgzf_file, "rb") as handle:
+
+        # For each block (i.e. its size is in the BC extra subfield)...
+        while True:
+            header = handle.read(18)
+            if len(header) < 18:
+                break
+            size = struct.unpack_from("<H", header, 16)[0] + 1
+            data = zlib.decompress(header + handle.read(size - 18), 31)
+            if coffset > 0:
+                blocks.append((coffset, uoffset))
+            coffset += size
+            uoffset += len(data)
+
+            # Index whole lines
+            lines = (carry + data).split(b"\n")
+            carry = lines.pop()
+            pos = _index_lines(lines, records, pos, bgzf_file)
+
+    # Last line (i.e. without newline)
+    _index_lines([carry], records, pos, bgzf_file)
+
+    # Write indices (i.e. as samtools faidx)
+    with open("%s.%s.tmp" % (fai_file, os.getpid()), "w") as handle:
+        for record in records:
+            handle.write("%s\n" % "\t".join(map(str, record[:5])))
+    with open("%s.%s.tmp" % (gzi_file, os.getpid()), "wb") as handle:
+        handle.write(struct.pack("<Q", len(blocks)))
+        handle.write(np.array(blocks, dtype="<u8").tobytes())
+    os.replace("%s.%s.tmp" % (fai_file, os.getpid()), fai_file)
+    os.replace("%s.%s.tmp" % (gzi_file, os.getpid()), gzi_file)
+
+def _index_lines(lines, records, pos, fasta_file):
+
+    # For each line...
+    for line in lines:
+
+        # New sequence (i.e. name, length, offset, line bases and width, and
+        # whether its last line was reached)
+        if line.startswith(b">"):
+            records.append([line[1:].split()[0].decode(), 0,
+                pos + len(line) + 1, 0, 0, False])
+
+        elif len(records) > 0:
+            record = records[-1]
+            bases = len(line.rstrip(b"\r"))
+            if record[5] and bases > 0:
+                raise ValueError("Lines of different length in sequence " + \
+                    "%s: %s" % (record[0], fasta_file))
+            if record[3] == 0:
+                record[3] = bases
+                record[4] = len(line) + 1
+            if bases != record[3]:
+                record[5] = True
+            record[1] += bases
+
+        pos += len(line) + 1
+
+    return(pos)
+
+def _read_bgzf(bgzf_file, index, entry, start, end):
+
+    # Initialize
+    _, offset, line_bases, line_width = entry
+    if start == end:
+        return(b"")
+
+    # Uncompressed offsets of the first and last bases
+    first = offset + (start // line_bases) * line_width + start % line_bases
+    last = offset + ((end - 1) // line_bases) * line_width + \
+        (end - 1) % line_bases + 1
+
+    # Blocks spanning region
+    i = np.searchsorted(index.uoffsets, first, "right") - 1
+    j = np.searchsorted(index.uoffsets, last, "left")
+    with open(bgzf_file, "rb") as handle:
+        handle.seek(index.coffsets[i])
+        data = handle.read(index.coffsets[j] - index.coffsets[i])
+
+    # Decompress blocks (i.e. gzip members)
+    chunks = []
+    while len(data) > 0:
+        d = zlib.decompressobj(31)
+        chunks.append(d.decompress(data))
+        data = d.unused_data
+    data = b"".join(chunks)[first-index.uoffsets[i]:last-index.uoffsets[i]]
+
+    return(data.translate(None, b"\r\n"))
+
+#-------------#
+# Classes     #
+#-------------#
+
+class TwoBitIndex(dict):
+    """
+    This class holds the length, offset of packed bases and N blocks of each
+    sequence of a 2bit file.
+    """
+
+class BgzfIndex(dict):
+    """
+    This class holds the length, offset, line bases and line width of each
+    sequence of a BGZF FASTA file (i.e. as uncompressed), along with the
+    compressed and uncompressed offsets of its blocks.
+    """
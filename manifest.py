@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+
+# Globals
+read_size = 1048576 # i.e. bytes read at once when checksumming
+
+#-------------#
+# Functions   #
+#-------------#
+
+def checksum(file_name):
+    """
+    This function returns the SHA-256 digest of a file.
+    """
+
+    # Initialize
+    h = hashlib.sha256()
+
+    with open(file_name, "rb") as handle:
+        for data in iter(lambda: handle.read(read_size), b""):
+            h.update(data)
+
+    return(h.hexdigest())
+
+#-------------#
+# Classes     #
+#-------------#
+
+class Manifest(object):
+    """
+    This class keeps a journal of completed work units (e.g. a profile scan
+    of a chrom), each with the size, modification time and checksum of the
+    file it was written to.  Entries are appended and synced to disk one at a
+    time, so that the journal survives crashes (i.e. a partly written last
+    entry is ignored), and are compacted when the journal is opened (unless
+    {read_only}).  Units can be given a key (e.g. a hash of the inputs and
+    parameters used) under which they can be found.
+    """
+
+    def __init__(self, manifest_file, read_only=False):
+
+        # Initialize
+        self.manifest_file = manifest_file
+        self.manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+        self.units = {}
+        self.keys = {}
+        self.handle = None
+
+        # Read journal (i.e. the last entry of each unit wins)
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as handle:
+                for line in handle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError: # i.e. truncated by a crash
+                        continue
+                    self.units[entry["unit"]] = entry
+        for unit, entry in self.units.items():
+            if entry.get("key") is not None:
+                self.keys[entry["key"]] = unit
+        if read_only:
+            return
+
+        # Compact journal (i.e. drop units whose files no longer exist)
+        self.units = {u: e for u, e in self.units.items() if \
+            os.path.exists(self._get_path(e))}
+        tmp_file = "%s.%s.tmp" % (manifest_file, os.getpid())
+        with open(tmp_file, "w") as handle:
+            for entry in self.units.values():
+                handle.write("%s\n" % json.dumps(entry))
+        os.replace(tmp_file, manifest_file)
+
+        self.handle = open(manifest_file, "a")
+
+    def __contains__(self, unit):
+        return(unit in self.units)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+
+    def add(self, unit, file_name, key=None):
+        """
+        This function records a unit as completed (i.e. written to a file).
+        """
+
+        # Initialize
+        stat = os.stat(file_name)
+        entry = {
+            "unit": unit,
+            "file": os.path.relpath(os.path.abspath(file_name),
+                self.manifest_dir),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "sha256": checksum(file_name),
+        }
+        if key is not None:
+            entry["key"] = key
+
+        # Append entry and sync to disk
+        self.handle.write("%s\n" % json.dumps(entry))
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.units[unit] = entry
+        if key is not None:
+            self.keys[key] = unit
+
+    def find(self, key):
+        """
+        This function returns the file of a completed and unchanged unit with
+        the given key, or None.
+        """
+
+        # Initialize
+        unit = self.keys.get(key)
+
+        # i.e. unit was removed or has since been recorded under another key
+        if unit not in self.units or self.units[unit].get("key") != key:
+            return(None)
+        if not self.validate(unit):
+            return(None)
+
+        return(self._get_path(self.units[unit]))
+
+    def validate(self, unit):
+        """
+        This function returns whether a unit is completed and its file is
+        unchanged (i.e. the checksum is only recomputed if the modification
+        time differs).
+        """
+
+        # Initialize
+        entry = self.units.get(unit)
+        if entry is None:
+            return(False)
+        file_name = self._get_path(entry)
+
+        try:
+            stat = os.stat(file_name)
+        except FileNotFoundError:
+            return(False)
+        if stat.st_size != entry["size"]:
+            return(False)
+        if stat.st_mtime_ns == entry["mtime"]:
+            return(True)
+
+        return(checksum(file_name) == entry["sha256"])
+
+    def _get_path(self, entry):
+        return(os.path.join(self.manifest_dir, entry["file"]))
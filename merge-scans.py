@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+import click
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+import os
+import sys
+from tqdm import tqdm
+
+# Import my functions
+import bigbed
+import compression
+import merge
+
+# Authorship
+__author__ = "Oriol Fornes"
+__organization__ = "The JASPAR Consortium"
+__version__ = "2025.11.10"
+__maintainer__ = "Oriol Fornes"
+__email__ = "oriol.fornes@gmail.com"
+__status__ = "Production"
+
+CONTEXT_SETTINGS = {
+    "help_option_names": ["-h", "--help"],
+}
+
+@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
+@click.argument(
+    "chrom_sizes",
+    type=click.Path(exists=True, resolve_path=True),
+)
+@click.argument(
+    "input_dir",
+    type=click.Path(exists=True, resolve_path=True),
+)
+@click.option(
+    "-d", "--dummy-dir",
+    help="Dummy directory (i.e. for temporary files of bigBed outputs).",
+    type=click.Path(exists=True, resolve_path=True),
+    default="/tmp/",
+    show_default=True,
+)
+@click.option(
+    "-o", "--output",
+    help="Output file (i.e. gzipped if ending in `.gz`, or a bigBed file " + \
+        "with a TFName index if ending in `.bb` or `.bigBed`).  " + \
+        "[default: stdout]",
+    type=click.Path(resolve_path=True),
+)
+@click.option(
+    "-t", "--threads",
+    help="Number of CPU threads to use (i.e. for compression, or to " + \
+        "assemble bigBed outputs by chrom from scans with an index).",
+    type=int,
+    default=1,
+    show_default=True,
+)
+
+def main(**params):
+
+    # Merge scans
+    merge_scans(params["chrom_sizes"], params["input_dir"], params["output"],
+        params["threads"], params["dummy_dir"])
+
+def merge_scans(chrom_sizes, input_dir, output=None, threads=1,
+    dummy_dir="/tmp/"):
+
+    # Initialize
+    sizes = merge.read_chrom_sizes(chrom_sizes)
+    scan_files = merge.get_scan_files(input_dir)
+
+    # Order chroms (i.e. as in chrom sizes, except where scans list them
+    # otherwise)
+    pool = Pool(threads)
+    chroms = merge.sort_chroms(pool.map(merge.get_chroms, scan_files), sizes)
+    pool.close()
+    pool.join()
+
+    # Write sorted BED6+1 lines (i.e. as from scans2bigBed)
+    if output is None:
+        sys.stdout.buffer.writelines(merge.to_bed(scan_files, chroms))
+    elif output.endswith((".bb", ".bigBed")) and threads > 1 and \
+       all(merge.is_indexed(f) for f in scan_files):
+        _merge_by_chrom(scan_files, chroms, sizes, output, threads,
+            dummy_dir)
+    elif output.endswith((".bb", ".bigBed")):
+        lines = merge.to_bed(scan_files, chroms)
+        with bigbed.Writer(output, sizes, threads,
+            dummy_dir=dummy_dir) as handle:
+            for batch in iter(lambda: list(islice(lines, 65536)), []):
+                handle.write(b"".join(batch))
+    else:
+        with compression.Writer(output, threads) if output.endswith(".gz") \
+             else open(output, "wb") as handle:
+            for line in merge.to_bed(scan_files, chroms):
+                handle.write(line)
+
+def _merge_by_chrom(scan_files, chroms, sizes, output, threads=1,
+    dummy_dir="/tmp/"):
+
+    # Initialize
+    pool = Pool(threads)
+    prefix = os.path.join(dummy_dir, "%s.%s" % (os.path.basename(output),
+        os.getpid()))
+    piece_files = ["%s.%s.piece" % (prefix, i) for i in range(len(chroms))]
+
+    try:
+
+        # Locate the blocks of each chrom in each scan (i.e. from the index)
+        p = partial(merge.split_scan, chroms=chroms)
+        splits = pool.map(p, scan_files)
+
+        # Number chroms (i.e. as if written in a single pass)
+        ids = {c: i for i, c in enumerate(chroms)}
+        tasks = [(c, [{c: s[c]} if c in s else {} for s in splits]) \
+            for c in ids]
+
+        with bigbed.Writer(output, sizes, threads,
+            dummy_dir=dummy_dir) as handle:
+
+            # Parallelize merging and encoding over chroms, and append
+            # pieces in order
+            kwargs = {"total": len(tasks), "ncols": 100}
+            p = partial(_write_piece, scan_files=scan_files, chroms=chroms,
+                sizes=sizes, ids=ids, prefix=prefix, dummy_dir=dummy_dir)
+            for piece_file, meta in tqdm(pool.imap(p, tasks), **kwargs):
+                handle.write_piece(piece_file, meta)
+                os.remove(piece_file)
+
+    finally:
+
+        pool.close()
+        pool.join()
+
+        # Remove pieces
+        for file_name in piece_files:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+def _write_piece(task, scan_files, chroms, sizes, ids, prefix,
+    dummy_dir="/tmp/"):
+
+    # Initialize
+    chrom, splits = task
+    piece_file = "%s.%s.piece" % (prefix, ids[chrom])
+    lines = merge.to_bed(scan_files, chroms, splits, chrom)
+
+    # Merge and encode the lines of chrom
+    with bigbed.Piece(piece_file, sizes, ids, dummy_dir=dummy_dir) as handle:
+        for batch in iter(lambda: list(islice(lines, 65536)), []):
+            handle.write(b"".join(batch))
+
+    return(piece_file, handle.meta)
+
+#-------------#
+# Main        #
+#-------------#
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+from contextlib import ExitStack
+import gzip
+import heapq
+import os
+import resource
+import zlib
+
+# Import my functions
+import bgzf
+
+# Globals
+batch_size = 1048576 # i.e. bytes of scan lines read at once per file
+max_score = 1000 # i.e. p-values are capped (i.e. BED scores)
+
+#-------------#
+# Functions   #
+#-------------#
+
+def read_chrom_sizes(chrom_sizes):
+    """
+    This function reads a chrom sizes file and returns a {dict} of chrom,
+    size pairs (i.e. in the order of the file).
+    """
+
+    # Initialize
+    sizes = {}
+
+    with open(chrom_sizes) as handle:
+        for line in handle:
+            fields = line.split()
+            if len(fields) >= 2:
+                sizes[fields[0]] = int(fields[1])
+
+    return(sizes)
+
+def get_scan_files(input_dir):
+    """
+    This function returns the scans (i.e. <matrix_id>.tsv.gz files from
+    scan-sequence.py) in a directory, sorted by matrix ID.
+    """
+
+    return([os.path.join(input_dir, f) for f in sorted(os.listdir(input_dir)) \
+        if f.endswith(".tsv.gz")])
+
+def get_matrix_id(scan_file):
+    """
+    This function returns the matrix ID of a scan.
+    """
+
+    return(os.path.basename(scan_file)[:-len(".tsv.gz")])
+
+def get_chroms(scan_file):
+    """
+    This function returns the chroms of a scan in the order they are listed
+    (i.e. from the index of BGZF scans; otherwise, by reading the scan).
+    """
+
+    # Initialize
+    chroms = []
+    chrom = None
+
+    # Chroms of blocks (i.e. in the order they were written)
+    if is_indexed(scan_file):
+        return(list(bgzf.read_index(scan_file)))
+
+    # Chroms of lines
+    with gzip.open(scan_file, "rb") as handle:
+        for lines in _read_lines(handle):
+
+            # Chrom boundaries (i.e. unless all lines are from the same chrom)
+            if chrom is None or not lines[0].startswith(chrom + b"\t") or \
+               not lines[-1].startswith(chrom + b"\t"):
+                for line in lines:
+                    if chrom is None or not line.startswith(chrom + b"\t"):
+                        chrom = line[:line.index(b"\t")]
+                        if chrom.decode() in chroms:
+                            raise ValueError("Scan not sorted by chrom: " + \
+                                "%s" % scan_file)
+                        chroms.append(chrom.decode())
+
+    return(chroms)
+
+def sort_chroms(chrom_lists, chroms):
+    """
+    This function returns the order in which to merge the chroms listed by
+    scans (i.e. lists, each in the order of a scan, as from {get_chroms}):
+    that of {chroms} (i.e. of chrom sizes), except where the scans list them
+    otherwise (e.g. in the order of the genome).
+    """
+
+    # Initialize
+    ranks = {chrom: i for i, chrom in enumerate(chroms)}
+    following = {}
+    preceding = {}
+
+    # Chroms following each chrom in a scan
+    for chrom_list in chrom_lists:
+        for chrom in chrom_list:
+            if chrom not in ranks:
+                raise ValueError("Chrom %s not in chrom sizes" % chrom)
+            following.setdefault(chrom, set())
+        for a, b in zip(chrom_list, chrom_list[1:]):
+            if b not in following[a]:
+                following[a].add(b)
+                preceding[b] = preceding.get(b, 0) + 1
+
+    # Order chroms (i.e. those preceded by no others, by rank)
+    heap = [(ranks[c], c) for c in following if c not in preceding]
+    heapq.heapify(heap)
+    order = []
+    while len(heap) > 0:
+        _, chrom = heapq.heappop(heap)
+        order.append(chrom)
+        for c in following[chrom]:
+            preceding[c] -= 1
+            if preceding[c] == 0:
+                heapq.heappush(heap, (ranks[c], c))
+    if len(order) < len(following):
+        raise ValueError("Scans list chroms in different orders")
+
+    return(order)
+
+def is_indexed(scan_file):
+    """
+    This function returns whether a scan is indexed (i.e. a BGZF scan, as
+    from scan-sequence.py with --index).
+    """
+
+    return(os.path.exists(bgzf.get_index_file(scan_file)))
+
+def split_scan(scan_file, chroms):
+    """
+    This function returns where the lines of each chrom of an indexed scan
+    are (i.e. a {dict} of chrom, (file, start, end) tuples, the byte range of
+    the blocks of the chrom, from the index).
+    """
+
+    # Initialize
+    splits = {}
+
+    # Blocks of each chrom (i.e. contiguous if the scan is sorted)
+    for chrom, (_, _, offsets, sizes) in bgzf.read_index(scan_file).items():
+        _check_chrom(chrom.encode(), chroms, scan_file, splits)
+        start = int(offsets.min())
+        end = int((offsets + sizes).max())
+        if int(sizes.sum()) != end - start:
+            raise ValueError("Scan not sorted by chrom: %s" % scan_file)
+        splits[chrom] = (scan_file, start, end)
+
+    return(splits)
+
+def to_bed(scan_files, chroms, splits=None, chrom=None):
+    """
+    This function merges scans (i.e. each sorted by chrom and start) in
+    bounded memory (i.e. a k-way merge of streams) and yields BED6+1 lines
+    (i.e. as from {merge_lines}, with chroms in the order of {chroms}, as
+    from {sort_chroms}).  Optionally, only the lines of a chrom are
+    merged, given where they are in each scan (i.e. as from {split_scan}).
+    """
+
+    # Initialize
+    _raise_open_files(len(scan_files))
+
+    with ExitStack() as stack:
+
+        # Stream each scan (i.e. as batches of lines)
+        if chrom is None:
+            streams = [(get_matrix_id(f), _read_lines(stack.enter_context(
+                gzip.open(f, "rb"))), f) for f in scan_files]
+        else:
+            streams = [(get_matrix_id(f), _read_split(stack.enter_context(
+                open(s[chrom][0], "rb")), *s[chrom][1:]), f) \
+                for f, s in zip(scan_files, splits) if chrom in s]
+
+        # Merge streams
+        yield from merge_lines(streams, chroms)
+
+def merge_lines(streams, chroms):
+    """
+    This function merges streams of scan lines (i.e. matrix ID, iterable of
+    batches of lines and source tuples, each sorted by chrom and start) in
+    bounded memory and yields BED6+1 lines (i.e. chrom, start, end, matrix
+    ID, p-value capped at 1000, strand and name, as from scans2bigBed) sorted
+    by chrom (i.e. in the order of {chroms}) and start.  Lines with the same
+    start are sorted as by `LC_ALL=C sort`.
+    """
+
+    # Initialize
+    ranks = {chrom.encode(): i for i, chrom in enumerate(chroms)}
+
+    # Merge streams (i.e. as rank, start, line tuples)
+    for _, _, line in heapq.merge(*[_read_scan(batches, matrix_id, ranks,
+        source) for matrix_id, batches, source in streams]):
+        yield(line)
+
+def _check_chrom(chrom, chroms, scan_file, splits):
+    if chrom.decode() not in chroms:
+        raise ValueError("Chrom %s not in chrom sizes: %s" % \
+            (chrom.decode(), scan_file))
+    if chrom.decode() in splits:
+        raise ValueError("Scan not sorted by chrom: %s" % scan_file)
+
+def _read_lines(handle):
+    yield from iter(lambda: handle.readlines(batch_size), [])
+
+def _read_split(handle, start, end):
+
+    # Initialize
+    handle.seek(start)
+    d = zlib.decompressobj(31)
+    rest = b""
+
+    # For each chunk...
+    while start < end:
+        data = handle.read(min(batch_size, end - start))
+        start += len(data)
+
+        # Decompress (i.e. BGZF blocks are gzip members)
+        chunks = []
+        while len(data) > 0:
+            chunks.append(d.decompress(data))
+            data = d.unused_data
+            if d.eof:
+                d = zlib.decompressobj(31)
+        data = b"".join(chunks)
+
+        # Whole lines
+        data = rest + data
+        pos = data.rfind(b"\n") + 1
+        rest = data[pos:]
+        if pos > 0:
+            yield(data[:pos - 1].split(b"\n"))
+
+def _read_scan(batches, matrix_id, ranks, scan_file):
+
+    # Initialize
+    matrix_id = matrix_id.encode()
+    last = (-1, -1)
+    group = []
+
+    # For each line...
+    for lines in batches:
+        for line in lines:
+
+            # Initialize
+            chrom, start, end, name, _, pvalue, strand = \
+                line.rstrip(b"\n").split(b"\t")
+            if chrom not in ranks:
+                raise ValueError("Chrom %s not in chrom sizes: %s" % \
+                    (chrom.decode(), scan_file))
+            key = (ranks[chrom], int(start))
+
+            # Lines of the previous start (i.e. sorted as whole lines)
+            if key != last:
+                if key < last:
+                    raise ValueError("Scan not sorted by chrom (i.e. in " + \
+                        "the order of chrom sizes) and start: %s" % scan_file)
+                yield from sorted(group)
+                group = []
+                last = key
+
+            group.append((*key, b"%s\t%s\t%s\t%s\t%d\t%s\t%s\n" % (chrom,
+                start, end, matrix_id, min(int(pvalue), max_score), strand,
+                name)))
+
+    yield from sorted(group)
+
+def _raise_open_files(n):
+
+    # Initialize
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = n + 256 # i.e. plus those of the interpreter and its pipes
+
+    # Raise soft limit of open files (i.e. one per scan)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        if hard != resource.RLIM_INFINITY:
+            needed = min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
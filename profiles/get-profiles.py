@@ -1,12 +1,29 @@
 #!/usr/bin/env python
 
 import argparse
-from Bio import motifs
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import http.client
+import io
 import json
+import math
+from multiprocessing import Pool
+import numpy as np
 import os
-import subprocess as sp
+import queue
+import re
+import urllib.parse
+import zipfile
 
 # Globals
+catalog_file = "profiles.npy" # i.e. memory-mappable catalog of profiles
+downloads_file = "downloads.json" # i.e. ETags and checksums of downloads
+url = "https://testjaspar.uio.no/download/data"
+
+# i.e. as in Bio.motifs.jaspar
+head_pat = re.compile(r"^>\s*(\S+)(\s+(\S+))?")
+row_pat_long = re.compile(r"\s*([ACGT])\s*\[\s*(.*)\s*\]")
+row_pat_short = re.compile(r"\s*(.+)\s*")
 taxons = [
     "fungi",
     "insects",
@@ -34,6 +51,20 @@ def parse_args():
         help="output directory (default = ./)",
         metavar="DIR"
     )
+    parser.add_argument(
+        "-t",
+        default=len(taxons),
+        help="threads to use (i.e. downloads and conversion; default = %s)" % \
+            len(taxons),
+        metavar="INT",
+        type=int
+    )
+    parser.add_argument(
+        "-u",
+        default=url,
+        help="JASPAR download URL (default = %s)" % url,
+        metavar="URL"
+    )
     parser.add_argument(
         "-v",
         default=2024,
@@ -49,95 +80,285 @@ def main():
     args = parse_args()
 
     # Get profiles
-    get_profiles(args.o, args.v)
+    archives = get_profiles(args.o, args.v, args.u, args.t)
+
+    # Read profiles (i.e. each profile is parsed once)
+    profiles = read_profiles(args.o, archives, args.t)
 
     # Convert profiles to PWMs
-    jaspar_to_pwm(args.o)
+    jaspar_to_pwm(profiles, args.o)
 
     # Get profile names
-    get_names(args.o)
+    get_names(profiles, args.o)
 
-def get_profiles(output_dir="./", version=2024):
+    # Get catalog of profiles
+    get_catalog(profiles, args.o)
+
+def get_profiles(output_dir="./", version=2024, url=url, threads=len(taxons)):
     """
     For each taxon, this function downloads all profiles from the JASPAR CORE
-    in JASPAR format.
+    in JASPAR format, concurrently and over a shared pool of connections.
+    Archives that did not change since the last download (i.e. according to
+    their ETag or checksum) are skipped; those that did are extracted in
+    memory and returned as a {dict} of taxon, {dict} of file name, profile.
     """
 
     # Initialize
-    cwd = os.getcwd()
+    archives = {}
+    output_dir = os.path.abspath(output_dir)
+    json_file = os.path.join(output_dir, downloads_file)
+    downloads = {}
+    session = Session()
 
     # Create output directory
-    if not os.path.exists(os.path.abspath(output_dir)):
-        os.makedirs(os.path.abspath(output_dir))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-    # For each taxon...
-    for taxon in taxons:
+    # Load ETags and checksums of previous downloads
+    if os.path.exists(json_file):
+        with open(json_file) as handle:
+            downloads = json.load(handle)
 
-        # Skip if taxon directory already exists
-        taxon_dir = os.path.join(os.path.abspath(output_dir), taxon)
-        if not os.path.exists(taxon_dir):
+    # Download archives concurrently
+    p = lambda taxon: _get_archive(session, output_dir, version, url, taxon,
+        downloads)
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(p, taxons))
+    session.close()
+
+    # For each downloaded archive...
+    for taxon, (file_name, entry, data) in zip(taxons, results):
 
-            # Create taxon directory
-            os.makedirs(taxon_dir)
+        # Skip if unchanged
+        downloads[file_name] = entry
+        if data is None:
+            continue
 
-            # Move to taxon directory
-            os.chdir(taxon_dir)
+        # Extract in memory (i.e. straight into the conversion step)
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            archives[taxon] = {os.path.basename(i.filename): \
+                z.read(i).decode() for i in z.infolist() if not i.is_dir()}
 
-            # Get JASPAR profiles
-            file_name = "JASPAR%s_CORE_%s_redundant_pfms_jaspar.zip" % \
-                (version, taxon)
-            url = "https://testjaspar.uio.no/download/data/%s/CORE/%s" % \
-                (version, file_name)
-            os.system("curl --silent -O %s" % url)
+        # Synchronize taxon directory
+        _write_archive(os.path.join(output_dir, taxon), archives[taxon])
 
-            # Unzip
-            os.system("unzip -qq %s" % file_name)
+    # Profiles changed (i.e. names and catalog need to be redone)
+    if len(archives) > 0:
+        for file_name in ["names.json", catalog_file]:
+            if os.path.exists(os.path.join(output_dir, file_name)):
+                os.remove(os.path.join(output_dir, file_name))
 
-            # Remove zip files
-            os.remove("%s" % file_name)
+    # Save ETags and checksums of downloads
+    with open("%s.tmp" % json_file, "w") as handle:
+        json.dump(downloads, handle, sort_keys=True, indent=4)
+    os.replace("%s.tmp" % json_file, json_file)
 
-            # Return to original directory
-            os.chdir(cwd)
+    return(archives)
 
-def jaspar_to_pwm(output_dir="./"):
+def _get_archive(session, output_dir, version, url, taxon, downloads):
+
+    # Initialize
+    file_name = "JASPAR%s_CORE_%s_redundant_pfms_jaspar.zip" % \
+        (version, taxon)
+    entry = downloads.get(file_name, {})
+    headers = {}
+
+    # Only download if changed (i.e. conditional request)
+    if os.path.exists(os.path.join(output_dir, taxon)):
+        if "etag" in entry:
+            headers["If-None-Match"] = entry["etag"]
+        if "last_modified" in entry:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    # Get JASPAR profiles
+    status, response_headers, data = session.get("%s/%s/CORE/%s" % \
+        (url.rstrip("/"), version, file_name), headers)
+    if status == 304:
+        return(file_name, entry, None)
+    if status != 200:
+        raise IOError("Could not download %s (HTTP %s)" % (file_name, status))
+
+    # Skip if unchanged (i.e. same checksum)
+    checksum = hashlib.sha256(data).hexdigest()
+    if os.path.exists(os.path.join(output_dir, taxon)):
+        if checksum == entry.get("sha256"):
+            data = None
+    entry = {"sha256": checksum}
+    for header, key in [("etag", "etag"), ("last-modified", "last_modified")]:
+        if header in response_headers:
+            entry[key] = response_headers[header]
+
+    return(file_name, entry, data)
+
+def _write_archive(taxon_dir, profiles):
+
+    # Create taxon directory
+    if not os.path.exists(taxon_dir):
+        os.makedirs(taxon_dir)
+
+    # Remove profiles no longer in the archive (and their PWMs)
+    for f in os.listdir(taxon_dir):
+        if f.endswith(".jaspar") and f not in profiles:
+            os.remove(os.path.join(taxon_dir, f))
+            if os.path.exists(os.path.join(taxon_dir, f"{f[:8]}.pwm")):
+                os.remove(os.path.join(taxon_dir, f"{f[:8]}.pwm"))
+
+    # Write new or changed profiles (i.e. their PWMs need to be redone)
+    for f, profile in profiles.items():
+        jaspar_file = os.path.join(taxon_dir, f)
+        if os.path.exists(jaspar_file):
+            with open(jaspar_file) as handle:
+                if handle.read() == profile:
+                    continue
+        with open(jaspar_file, "w") as handle:
+            handle.write(profile)
+        if os.path.exists(os.path.join(taxon_dir, f"{f[:8]}.pwm")):
+            os.remove(os.path.join(taxon_dir, f"{f[:8]}.pwm"))
+
+def read_profiles(output_dir="./", archives={}, threads=1):
     """
-    For each taxon, this function reformats all profiles from JASPAR to
-    PWMScan format.
+    For each taxon, this function reads all profiles in JASPAR format (i.e.
+    from the extracted archives, if downloaded, or else from disk) in
+    parallel, and returns a {list} of {dict}s with their matrix ID, name,
+    taxon, counts and PWM (i.e. in PWMScan format).
     """
 
     # Initialize
-    # perl_script = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-    #     "jasparconvert.pl")
+    tasks = []
 
     # For each taxon...
     for taxon in taxons:
 
         # Initialize
         taxon_dir = os.path.join(os.path.abspath(output_dir), taxon)
+        if taxon in archives:
+            files = archives[taxon]
+        else:
+            files = {f: None for f in os.listdir(taxon_dir)}
 
         # For each profile...
-        for f in os.listdir(taxon_dir):
+        for f in sorted(files):
 
             # Skip non-JASPAR profiles
             if not f.endswith(".jaspar"):
                 continue
 
-            # JASPAR to PWMScan
-            with open(os.path.join(taxon_dir, f)) as handle:
-                m = motifs.read(handle, "jaspar")
-            m.pseudocounts = motifs.jaspar.calculate_pseudocounts(m)
-            pwm = list(map(list, zip(*[m.pssm[nt] for nt in "ACGT"])))
-            pwm_file = os.path.join(taxon_dir, f"{f[:8]}.pwm")
-            if not os.path.exists(pwm_file):
-                with open(pwm_file, "w") as handle:
-                    for i in pwm:
-                        s = " ".join(["{:7d}".format(round(j*100)) for j in i])
-                        handle.write("%s\n" % s)
+            # Add profile
+            tasks.append((taxon_dir, f, files[f]))
+
+    # Parallelize reading
+    with Pool(threads) as pool:
+        profiles = pool.map(_read_profile, tasks, chunksize=64)
+
+    return(profiles)
+
+def _read_profile(task):
 
-def get_names(output_dir="./"):
+    # Initialize
+    taxon_dir, f, profile = task
+
+    # Read profile
+    if profile is None:
+        with open(os.path.join(taxon_dir, f)) as handle:
+            profile = handle.read()
+    matrix_id, name, counts = parse_jaspar(profile)
+
+    # Get profile name
+    if name.startswith(matrix_id):
+        name = name[len(matrix_id)+1:]
+
+    return({"matrix_id": matrix_id, "name": name,
+        "taxon": os.path.basename(taxon_dir), "counts": counts.tolist(),
+        "pwm": calculate_pwm(counts).tolist(),
+        "pwm_file": os.path.join(taxon_dir, f"{f[:8]}.pwm")})
+
+def parse_jaspar(profile):
     """
-    This function extracts the name of each JASPAR profile and saves them
-    in a JSON file.
+    This function parses a profile in JASPAR format (i.e. as Biopython does)
+    and returns its matrix ID, name and counts (i.e. as a {numpy.float64}
+    array of A, C, G, T counts per position).
+    """
+
+    # Initialize
+    matrix_id = None
+    name = None
+    counts = []
+
+    # For each line...
+    for line in profile.splitlines():
+        line = line.strip()
+
+        # Header (i.e. the name defaults to the matrix ID)
+        head_match = head_pat.match(line)
+        if head_match:
+            matrix_id = head_match.group(1)
+            name = head_match.group(3) or matrix_id
+            continue
+
+        # Counts (i.e. with or without nucleotide and brackets)
+        row_match = row_pat_long.match(line)
+        if row_match:
+            words = row_match.group(2).split()
+        else:
+            row_match = row_pat_short.match(line)
+            if not row_match:
+                continue
+            words = row_match.group(1).split()
+        counts.append([float(x) for x in words])
+
+    return(matrix_id, name, np.array(counts[:4], dtype=np.float64).T)
+
+def calculate_pwm(counts):
+    """
+    This function converts the counts of a profile into a PWM in PWMScan
+    format (i.e. log-odds scores x 100, rounded), adding pseudocounts as in
+    Bio.motifs.jaspar (i.e. the square root of the average number of sites,
+    times the uniform background).
+    """
+
+    # Initialize (i.e. sums in the same order as Biopython)
+    background = .25
+    sums = ((counts[:, 0] + counts[:, 1]) + counts[:, 2]) + counts[:, 3]
+
+    # Pseudocounts
+    pseudocounts = math.sqrt(sum(sums.tolist()) / len(counts)) * background
+
+    # Frequencies
+    counts = pseudocounts + counts
+    sums = ((counts[:, 0] + counts[:, 1]) + counts[:, 2]) + counts[:, 3]
+    frequencies = counts / sums[:, None]
+
+    # Log-odds (i.e. with {math.log} for identical rounding)
+    log_odds = np.array([math.log(p / background, 2) if p > 0 else -math.inf \
+        for p in frequencies.ravel().tolist()]).reshape(frequencies.shape)
+
+    return(np.rint(log_odds * 100).astype(np.int64))
+
+def jaspar_to_pwm(profiles, output_dir="./"):
+    """
+    This function reformats all profiles (i.e. from {read_profiles}) from
+    JASPAR to PWMScan format.
+    """
+
+    # Initialize
+    # perl_script = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+    #     "jasparconvert.pl")
+
+    # For each profile...
+    for profile in profiles:
+
+        # JASPAR to PWMScan
+        pwm_file = profile["pwm_file"]
+        if not os.path.exists(pwm_file):
+            with open(pwm_file, "w") as handle:
+                for i in profile["pwm"]:
+                    s = " ".join(["{:7d}".format(j) for j in i])
+                    handle.write("%s\n" % s)
+
+def get_names(profiles, output_dir="./"):
+    """
+    This function extracts the name of each JASPAR profile (i.e. from
+    {read_profiles}) and saves them in a JSON file.
     """
 
     # Initialize
@@ -147,31 +368,134 @@ def get_names(output_dir="./"):
     json_file = os.path.join(output_dir, "names.json")
     if not os.path.exists(json_file):
 
-        # For each taxon...
-        for taxon in taxons:
+        # For each profile...
+        for profile in profiles:
+            names.setdefault(profile["matrix_id"], profile["name"])
 
-            # Initialize
-            taxon_dir = os.path.join(os.path.abspath(output_dir), taxon)
+        # Write JSON
+        with open(json_file, "w") as handle:
+            json.dump(names, handle, sort_keys=True, indent=4)
 
-            # For each profile...
-            for f in os.listdir(taxon_dir):
+def get_catalog(profiles, output_dir="./"):
+    """
+    This function packs all profiles (i.e. from {read_profiles}) into a
+    catalog that can be memory-mapped (i.e. a {numpy} structured array, with
+    counts and PWMs padded to the length of the longest profile), which is
+    read by scan-sequence.py instead of listing the taxon directories.
+    """
 
-                # Skip non-JASPAR profiles
-                if not f.endswith(".jaspar"):
-                    continue
+    # Initialize
+    profiles_dict = {}
 
-                # Get profile name
-                with open(os.path.join(taxon_dir, f)) as handle:
-                    m = motifs.read(handle, "jaspar")
-                if m.name.startswith(m.matrix_id):
-                    name = m.name[len(m.matrix_id)+1:]
-                else:
-                    name = m.name
-                names.setdefault(m.matrix_id, name)
+    # Skip if already done
+    npy_file = os.path.join(output_dir, catalog_file)
+    if not os.path.exists(npy_file):
+
+        # Keep the first instance of each profile (i.e. as in names.json)
+        for profile in profiles:
+            profiles_dict.setdefault(profile["matrix_id"], profile)
+        profiles = [profiles_dict[m] for m in sorted(profiles_dict)]
+
+        # Initialize catalog
+        size = max([len(p["pwm"]) for p in profiles])
+        dtype = [
+            ("matrix_id", "U%s" % max([len(p["matrix_id"]) for p in profiles])),
+            ("version", "i4"),
+            ("name", "U%s" % max([len(p["name"]) for p in profiles])),
+            ("taxon", "U%s" % max([len(t) for t in taxons])),
+            ("length", "i4"),
+            ("counts", "f8", (size, 4)),
+            ("pwm", "i8", (size, 4)),
+        ]
+        catalog = np.zeros(len(profiles), dtype=dtype)
 
-        # Write JSON
-        with open(json_file, "w") as handle:
-            json.dump(names, handle, sort_keys=True, indent=4)
+        # For each profile...
+        for i, p in enumerate(profiles):
+            length = len(p["pwm"])
+            catalog[i]["matrix_id"] = p["matrix_id"]
+            catalog[i]["version"] = int(p["matrix_id"].split(".")[1])
+            catalog[i]["name"] = p["name"]
+            catalog[i]["taxon"] = p["taxon"]
+            catalog[i]["length"] = length
+            catalog[i]["counts"][:length] = p["counts"]
+            catalog[i]["pwm"][:length] = p["pwm"]
+
+        # Write catalog
+        np.save(npy_file, catalog)
+
+#-------------#
+# Classes     #
+#-------------#
+
+class Session(object):
+    """
+    This class keeps a pool of persistent HTTP(S) connections per host, which
+    are shared by threads (i.e. each connection is used by one thread at a
+    time), and follows redirects.
+    """
+
+    def __init__(self, timeout=60):
+
+        # Initialize
+        self.timeout = timeout
+        self.pools = {}
+
+    def get(self, url, headers={}, redirects=5):
+        """
+        This function sends a GET request and returns the status, headers
+        (i.e. with lowercase names) and body of the response.
+        """
+
+        # Initialize
+        parts = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(("", "", parts.path or "/",
+            parts.query, ""))
+        pool = self.pools.setdefault((parts.scheme, parts.netloc),
+            queue.LifoQueue())
+
+        # Reuse an idle connection (or open a new one)
+        try:
+            connection = pool.get_nowait()
+        except queue.Empty:
+            connection = self._connect(parts.scheme, parts.netloc)
+
+        # Send request (i.e. retry once if the connection went stale)
+        try:
+            response = self._request(connection, path, headers)
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            connection = self._connect(parts.scheme, parts.netloc)
+            response = self._request(connection, path, headers)
+        pool.put(connection)
+
+        # Follow redirects
+        status, response_headers, data = response
+        if status in (301, 302, 303, 307, 308) and redirects > 0:
+            return(self.get(urllib.parse.urljoin(url,
+                response_headers["location"]), headers, redirects - 1))
+
+        return(response)
+
+    def close(self):
+        """
+        This function closes all connections.
+        """
+
+        for pool in self.pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+
+    def _connect(self, scheme, netloc):
+        if scheme == "https":
+            return(http.client.HTTPSConnection(netloc, timeout=self.timeout))
+        return(http.client.HTTPConnection(netloc, timeout=self.timeout))
+
+    def _request(self, connection, path, headers):
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        return(response.status, {k.lower(): v for k, v in \
+            response.getheaders()}, data)
 
 #-------------#
 # Main        #
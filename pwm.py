@@ -0,0 +1,224 @@
+import numpy as np
+
+# Globals
+block_size = 1000000 # i.e. bases scored at once
+pvalue_format = "%.6e" # i.e. as reported by matrix_prob
+perc_format = "%.1f" # i.e. followed by "%"
+
+#-------------#
+# Functions   #
+#-------------#
+
+def read_pwm(pwm_file):
+    """
+    This function reads a PWM in PWMScan format (i.e. one row of integer A,
+    C, G, T scores per position) and returns it as a {numpy.int64} array.
+    """
+
+    with open(pwm_file) as handle:
+        rows = [list(map(int, line.split())) for line in handle if line.strip()]
+
+    return(np.array(rows, dtype=np.int64))
+
+def score_distribution(pwm, background=(.25, .25, .25, .25)):
+    """
+    This function calculates the exact distribution of scores of a PWM under
+    the given A, C, G, T background probabilities, and returns arrays of
+    achievable scores (in descending order), p-values (i.e. the probability
+    of a score greater than or equal to each score) and relative scores (as
+    percentages), as reported by matrix_prob.
+    """
+
+    # Initialize
+    mins = pwm.min(axis=1)
+    probs = np.ones(1)
+
+    # Dynamic programming over positions (i.e. offset from the minimum score)
+    for row, m in zip(pwm, mins):
+        extended = np.zeros(len(probs) + row.max() - m)
+        for score, p in zip(row - m, background):
+            extended[score:score+len(probs)] += probs * p
+        probs = extended
+
+    # Achievable scores, from highest to lowest
+    offsets = np.flatnonzero(probs)[::-1]
+    scores = offsets + mins.sum()
+    pvalues = np.cumsum(probs[::-1])[::-1][offsets]
+    if len(probs) > 1:
+        percs = offsets * 100. / (len(probs) - 1)
+    else: # i.e. every row is constant (the only score is the highest)
+        percs = np.full(len(offsets), 100.)
+
+    # Round as reported by matrix_prob
+    pvalues = np.char.mod(pvalue_format, pvalues).astype(np.float64)
+    percs = np.char.mod(perc_format, percs).astype(np.float64)
+
+    return(scores, pvalues, percs)
+
+def score_table(scores, pvalues, percs):
+    """
+    This function converts a score distribution (i.e. from
+    {score_distribution}) into arrays of scores, relative scores (x 1000) and
+    p-values (-log10 x 100), as reported in scan outputs.
+    """
+
+    rel_scores = (percs * 10).astype(np.int64)
+    log_pvalues = (np.log10(pvalues) * 1000 / -10).astype(np.int64)
+
+    return(scores, rel_scores, log_pvalues)
+
+def get_cutoff(scores, pvalues, percs, pthresh=.05, rthresh=.8):
+    """
+    This function returns the lowest score of a score distribution (i.e. from
+    {score_distribution}) passing both the p-value and relative score
+    thresholds (or the highest score if none passes).
+    """
+
+    # Initialize
+    passed = np.flatnonzero((pvalues < pthresh) & (percs >= rthresh * 100))
+    passed = passed[passed > 0]
+
+    if len(passed) == 0:
+        return(scores[0])
+
+    return(scores[passed[-1]])
+
+def score_matrices(pwm):
+    """
+    This function returns the forward and reverse complement scoring matrices
+    of a PWM, with a fifth column for N (i.e. the lowest score of each
+    position).
+    """
+
+    # Add N column
+    fwd = np.column_stack((pwm, pwm.min(axis=1)))
+
+    # Reverse complement (i.e. reverse positions and swap A/T and C/G)
+    rev = fwd[::-1][:, [3, 2, 1, 0, 4]]
+
+    return(np.ascontiguousarray(fwd), np.ascontiguousarray(rev))
+
+def score_windows(matrix, sequence):
+    """
+    This function returns the score of each window of an integer-encoded
+    sequence with a scoring matrix (i.e. from {score_matrices}).
+    """
+
+    # Initialize
+    length = matrix.shape[0]
+    n = len(sequence) - length + 1
+    scores = np.zeros(max(n, 0), dtype=np.int64)
+
+    # Sliding-window sums (i.e. one vectorized pass per matrix position)
+    for i in range(length):
+        scores += matrix[i][sequence[i:i+n]]
+
+    return(scores)
+
+def scan(pwm, sequence, cutoff, size=block_size, intervals=None):
+    """
+    This function scans both strands of an integer-encoded sequence with a
+    PWM and yields arrays of hit starts (0-based), strands (0 for +, 1 for -)
+    and scores, in coordinate order, for each block of the sequence.  If
+    {intervals} (i.e. arrays of starts and ends) are given, only windows
+    starting within them are scanned.
+    """
+
+    # Initialize
+    fwd, rev = score_matrices(pwm)
+    overlap = len(pwm) - 1
+
+    # For each block...
+    for start, end in _get_blocks(len(sequence) - overlap, size, intervals):
+
+        # Initialize
+        block = np.asarray(sequence[start:end+overlap])
+        if len(block) < len(pwm):
+            break
+
+        # Score both strands
+        hits = []
+        for strand, matrix in enumerate((fwd, rev)):
+            scores = score_windows(matrix, block)
+            positions = np.flatnonzero(scores >= cutoff)
+            hits.append((positions, np.full(len(positions), strand,
+                dtype=np.uint8), scores[positions]))
+
+        # Sort hits by position and strand
+        positions, strands, scores = map(np.concatenate, zip(*hits))
+        idx = np.lexsort((strands, positions))
+
+        yield(positions[idx] + start, strands[idx], scores[idx])
+
+def scan_stacked(pwms, sequence, cutoffs, size=block_size, intervals=None):
+    """
+    This function scans both strands of an integer-encoded sequence with
+    several PWMs of the same length at once (i.e. stacked into a single
+    scoring matrix) and yields arrays of hit profiles (i.e. indices into
+    {pwms}), starts (0-based), strands (0 for +, 1 for -) and scores, sorted
+    by profile and coordinate, for each block of the sequence.  If
+    {intervals} are given, only windows starting within them are scanned.
+    """
+
+    # Initialize
+    fwd, rev = zip(*[score_matrices(m) for m in pwms])
+    fwd = np.stack(fwd, axis=1) # i.e. position x profile x nucleotide
+    rev = np.stack(rev, axis=1)
+    cutoffs = np.array(cutoffs, dtype=np.int64)[:, None]
+    length = fwd.shape[0]
+    overlap = length - 1
+    size = max(size // len(pwms), 1000) # i.e. keep scores in cache
+
+    # For each block...
+    for start, end in _get_blocks(len(sequence) - overlap, size, intervals):
+
+        # Initialize
+        block = np.asarray(sequence[start:end+overlap])
+        n = len(block) - overlap
+        if n < 1:
+            break
+
+        # Score both strands for all profiles
+        hits = []
+        for strand, matrix in enumerate((fwd, rev)):
+            scores = np.zeros((len(pwms), n), dtype=np.int64)
+            for i in range(length):
+                scores += matrix[i][:, block[i:i+n]]
+            profiles, positions = np.nonzero(scores >= cutoffs)
+            hits.append((profiles, positions, np.full(len(positions), strand,
+                dtype=np.uint8), scores[profiles, positions]))
+
+        # Sort hits by profile, position and strand
+        profiles, positions, strands, scores = map(np.concatenate, zip(*hits))
+        idx = np.lexsort((strands, positions, profiles))
+
+        yield(profiles[idx], positions[idx] + start, strands[idx], scores[idx])
+
+def score_hits(pwm, sequence, starts, strands):
+    """
+    This function returns the scores of hits (i.e. starts and strands, as
+    from {scan}) of a PWM on an integer-encoded sequence.
+    """
+
+    # Initialize
+    fwd, rev = score_matrices(pwm)
+    positions = np.arange(len(pwm))
+    starts = np.asarray(starts, dtype=np.int64)
+
+    # Windows of each hit (i.e. one row per hit)
+    windows = np.asarray(sequence)[starts[:, None] + positions]
+
+    return(np.where(np.asarray(strands) == 1,
+        rev[positions, windows].sum(axis=1),
+        fwd[positions, windows].sum(axis=1)))
+
+def _get_blocks(n, size, intervals=None):
+
+    # Initialize
+    if intervals is None:
+        intervals = ([0], [max(n, 1)])
+
+    # Split intervals into blocks (i.e. of window starts)
+    for start, end in zip(*intervals):
+        for i in range(int(start), int(end), size):
+            yield(i, min(i + size, int(end)))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+import click
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+from urllib.parse import parse_qs, urlparse
+
+# Import my functions
+import query
+
+# Authorship
+__author__ = "Oriol Fornes"
+__organization__ = "The JASPAR Consortium"
+__version__ = "2025.11.10"
+__maintainer__ = "Oriol Fornes"
+__email__ = "oriol.fornes@gmail.com"
+__status__ = "Production"
+
+# Globals
+header = ["chrom", "start", "end", "matrix_id", "name", "rel_score",
+    "log_pvalue", "strand"]
+
+CONTEXT_SETTINGS = {
+    "help_option_names": ["-h", "--help"],
+}
+
+@click.command(no_args_is_help=True, context_settings=CONTEXT_SETTINGS)
+@click.argument(
+    "scans",
+    type=click.Path(exists=True, resolve_path=True),
+)
+@click.argument(
+    "regions",
+    nargs=-1,
+)
+@click.option(
+    "-c", "--cache-size",
+    help="Number of decoded blocks to keep in memory.",
+    type=int,
+    default=query.cache_size,
+    show_default=True,
+)
+@click.option(
+    "--host",
+    help="Host to serve queries on (with `--serve`).",
+    default="127.0.0.1",
+    show_default=True,
+)
+@click.option(
+    "-o", "--output",
+    help="Output file.  [default: stdout]",
+    type=click.Path(resolve_path=True),
+)
+@click.option(
+    "-p", "--port",
+    help="Port to serve queries on (with `--serve`).",
+    type=int,
+    default=8000,
+    show_default=True,
+)
+@click.option(
+    "--profile",
+    help="Profile ID(s) to query.  [default: all]",
+    multiple=True,
+)
+@click.option(
+    "--pthresh",
+    help="P-value threshold.  [default: none]",
+    type=float,
+)
+@click.option(
+    "--rthresh",
+    help="Relative score threshold.  [default: none]",
+    type=float,
+)
+@click.option(
+    "-s", "--serve",
+    help="Serve queries over HTTP (e.g. `GET /query?region=chr1:0-1000" + \
+        "&profile=MA0139.2&pthresh=0.001&format=json`).",
+    is_flag=True,
+)
+
+def main(**params):
+
+    # Query hits
+    query_hits(params["scans"], params["regions"], params["output"],
+        set(params["profile"]), params["pthresh"], params["rthresh"],
+        params["cache_size"], params["serve"], params["host"], params["port"])
+
+def query_hits(scans, regions=[], output=None, profile=set(), pthresh=None,
+    rthresh=None, cache_size=query.cache_size, serve=False, host="127.0.0.1",
+    port=8000):
+
+    with query.Index(scans, cache_size) as index:
+
+        # Serve queries (i.e. until interrupted)
+        if serve:
+            server = ThreadingHTTPServer((host, port), _get_handler(index))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            server.server_close()
+
+        # Write hits of each region (i.e. as TSV)
+        else:
+            handle = sys.stdout if output is None else open(output, "w")
+            handle.write("#%s\n" % "\t".join(header))
+            for region in regions:
+                for hit in index.query(*query.parse_region(region), profile,
+                    pthresh, rthresh):
+                    handle.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % hit)
+            if output is not None:
+                handle.close()
+
+def _get_handler(index):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+
+            # Initialize
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            if url.path != "/query":
+                self.send_error(404)
+                return
+
+            # Query hits of each region
+            try:
+                hits = []
+                profile = set(p for v in params.get("profile", []) \
+                    for p in v.split(","))
+                pthresh = float(params["pthresh"][0]) if "pthresh" in \
+                    params else None
+                rthresh = float(params["rthresh"][0]) if "rthresh" in \
+                    params else None
+                for region in params.get("region", []):
+                    hits.extend(index.query(*query.parse_region(region),
+                        profile, pthresh, rthresh))
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+
+            # Write hits (i.e. as JSON or TSV)
+            if params.get("format", ["tsv"])[0] == "json":
+                data = json.dumps([dict(zip(header, h)) for h in hits])
+                content_type = "application/json"
+            else:
+                data = "".join(["#%s\n" % "\t".join(header)] + \
+                    ["%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % h for h in hits])
+                content_type = "text/tab-separated-values"
+            data = data.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return(Handler)
+
+#-------------#
+# Main        #
+#-------------#
+
+if __name__ == "__main__":
+    main()
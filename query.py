@@ -0,0 +1,222 @@
+from collections import OrderedDict
+import numpy as np
+import os
+import re
+import threading
+import zlib
+
+# Import my functions
+import bgzf
+import columnar
+import merge
+
+# Globals
+cache_size = 4096 # i.e. decoded blocks kept in memory
+
+#-------------#
+# Functions   #
+#-------------#
+
+def parse_region(region):
+    """
+    This function parses a region (i.e. chrom, or chrom:start-end, 0-based
+    and half-open as in BED, with optional thousands separators) and returns
+    its chrom, start and end.
+    """
+
+    # Initialize
+    m = re.match(r"^([^:\s]+)(?::([\d,]+)-([\d,]+))?$", region.strip())
+    if m is None:
+        raise ValueError("Invalid region: %s" % region)
+    chrom, start, end = m.groups()
+
+    if start is None:
+        return(chrom, 0, np.iinfo(np.int64).max)
+
+    return(chrom, int(start.replace(",", "")), int(end.replace(",", "")))
+
+def get_cutoffs(pthresh=None, rthresh=None):
+    """
+    This function converts p-value and relative score thresholds into the
+    scales of scan outputs (i.e. -log10 p-value x 100 and relative score x
+    1000).
+    """
+
+    # Initialize
+    log_pvalue = 0
+    rel_score = 0
+
+    # Convert thresholds (i.e. as fetch_binding_sites.py did)
+    if pthresh is not None:
+        log_pvalue = int(np.log10(pthresh) * 1000 / -10)
+    if rthresh is not None:
+        rel_score = int(rthresh * 1000)
+
+    return(log_pvalue, rel_score)
+
+def decode_lines(data):
+    """
+    This function decodes lines of a scan output (i.e. chrom, start, end,
+    name, relative score, p-value and strand) into arrays of starts, ends,
+    strands (i.e. 1 for -), relative scores and p-values, at once.
+    """
+
+    # Initialize
+    fields = np.array(data.replace(b"\n", b"\t").split(b"\t")[:-1])
+    fields = fields.reshape(-1, 7)
+
+    return(fields[:, 1].astype(np.int64), fields[:, 2].astype(np.int64),
+        (fields[:, 6] == b"-").astype(np.uint8),
+        fields[:, 4].astype(np.int64), fields[:, 5].astype(np.int64))
+
+#-------------#
+# Classes     #
+#-------------#
+
+class Index(object):
+    """
+    This class queries the hits of scan-sequence.py outputs (i.e. a
+    directory of BGZF outputs written with `--index`, or a columnar
+    container) by region, profile and thresholds.  Blocks overlapping a
+    region are found through a coordinate index, decoded into arrays (i.e.
+    kept in a least recently used cache of {cache_size} blocks) and
+    filtered at once.  Queries can be run from several threads.
+    """
+
+    def __init__(self, scans, cache_size=cache_size):
+
+        # Initialize
+        self.scans = scans
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.reader = None
+        self.profiles = [] # i.e. matrix ID, name pairs
+        self.blocks = {} # i.e. per chrom, sorted by start
+        blocks = {}
+
+        # Blocks of the chunks of each profile (i.e. columnar container)
+        if os.path.isfile(scans):
+            self.reader = columnar.Reader(scans)
+            self.profiles = [(m, n) for m, n, _ in self.reader.profiles]
+            lengths = np.array([l for _, _, l in self.reader.profiles],
+                dtype=np.int64)
+            chunks = self.reader.chunks
+            for c, chrom in enumerate(self.reader.chroms):
+                idx = np.flatnonzero(chunks["chrom"] == c)
+                profiles = chunks["profile"][idx].astype(np.int64)
+                blocks[chrom] = [(profiles, chunks["first"][idx].astype(
+                    np.int64), chunks["last"][idx].astype(np.int64) + \
+                    lengths[profiles], idx, np.zeros(len(idx), dtype=np.int64))]
+
+        # Blocks of each profile (i.e. BGZF outputs)
+        else:
+            scan_files = merge.get_scan_files(scans)
+            for i, scan_file in enumerate(scan_files):
+                if not os.path.exists(bgzf.get_index_file(scan_file)):
+                    raise ValueError("Scan not indexed (i.e. rerun " + \
+                        "scan-sequence.py with `--index`): %s" % scan_file)
+                self.profiles.append((merge.get_matrix_id(scan_file), None))
+                for chrom, (starts, ends, offsets, sizes) in \
+                    bgzf.read_index(scan_file).items():
+                    blocks.setdefault(chrom, []).append((np.full(len(starts),
+                        i), starts, ends, offsets, sizes))
+            self.scan_files = scan_files
+
+        # Sort blocks of each chrom by start
+        for chrom, arrays in blocks.items():
+            profiles, starts, ends, offsets, sizes = map(np.concatenate,
+                zip(*arrays))
+            idx = np.argsort(starts, kind="stable")
+            self.blocks[chrom] = (profiles[idx], starts[idx], ends[idx],
+                offsets[idx], sizes[idx], int((ends - starts).max()))
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def query(self, chrom, start=0, end=None, profile=set(), pthresh=None,
+        rthresh=None):
+        """
+        This function returns the hits overlapping a region (i.e. 0-based,
+        half-open) of the given profiles (i.e. matrix IDs; default = all)
+        passing the p-value and relative score thresholds (default = all), as
+        chrom, start, end, matrix ID, name, relative score, p-value and strand
+        tuples sorted by start and matrix ID.
+        """
+
+        # Initialize
+        hits = []
+        if end is None:
+            end = np.iinfo(np.int64).max
+        if chrom not in self.blocks:
+            return(hits)
+        profiles, starts, ends, offsets, sizes, span = self.blocks[chrom]
+        log_pvalue, rel_score = get_cutoffs(pthresh, rthresh)
+
+        # Blocks overlapping region (i.e. starting at most {span} before it)
+        lo = np.searchsorted(starts, max(start - span, 0), "left")
+        hi = np.searchsorted(starts, end, "left")
+        idx = lo + np.flatnonzero(ends[lo:hi] > start)
+        if len(profile) > 0:
+            ids = [i for i, (m, _) in enumerate(self.profiles) if m in profile]
+            idx = idx[np.isin(profiles[idx], ids)]
+
+        # For each block...
+        for i in idx.tolist():
+
+            # Hits overlapping region and passing thresholds
+            s, e, t, r, l, name = self._get_block(int(profiles[i]),
+                int(offsets[i]), int(sizes[i]))
+            h = np.flatnonzero((s < end) & (e > start) & (l >= log_pvalue) & \
+                (r >= rel_score))
+            matrix_id = self.profiles[int(profiles[i])][0]
+            hits.extend([(chrom, a, b, matrix_id, name, c, d, "+-"[x]) for \
+                a, b, c, d, x in zip(s[h].tolist(), e[h].tolist(),
+                r[h].tolist(), l[h].tolist(), t[h].tolist())])
+
+        # Sort hits (i.e. by start, then matrix ID)
+        hits.sort(key=lambda x: (x[1], x[3], x[2], x[7]))
+
+        return(hits)
+
+    def _get_block(self, profile, offset, size):
+
+        # Decoded block (i.e. most recently used last)
+        key = (profile, offset)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return(self.cache[key])
+
+        # Decode columnar chunk
+        if self.reader is not None:
+            chunk = self.reader.chunks[offset]
+            starts, strands, rel_scores, log_pvalues = \
+                columnar.decode_chunk(self.reader.buffer, chunk)
+            block = (starts, starts + self.reader.profiles[profile][2],
+                strands, rel_scores.astype(np.int64),
+                log_pvalues.astype(np.int64), self.profiles[profile][1])
+
+        # Decode BGZF block
+        else:
+            with open(self.scan_files[profile], "rb") as handle:
+                handle.seek(offset)
+                data = zlib.decompress(handle.read(size), 31)
+            name = data[:data.index(b"\n")].split(b"\t", 4)[3].decode()
+            block = (*decode_lines(data), name)
+
+        # Cache block (i.e. evicting the least recently used)
+        with self.lock:
+            self.cache[key] = block
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return(block)
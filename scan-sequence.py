@@ -2,16 +2,30 @@
 
 import click
 from click_option_group import optgroup
+from contextlib import ExitStack
 from functools import partial
+import gzip
 from itertools import chain
 import json
 from multiprocessing import Pool
-from numpy import log10 as log
+import numpy as np
 import os
-import re
 import shutil
 import subprocess
 from tqdm import tqdm
+import zlib
+
+# Import my functions
+import bgzf
+import bigbed
+import cache
+import catalog
+import columnar
+import compression
+import genome
+import manifest
+import merge
+import pwm
 
 # Authorship
 __author__ = "Oriol Fornes"
@@ -22,7 +36,15 @@ __email__ = "oriol.fornes@gmail.com"
 __status__ = "Production"
 
 # Globals
+batch_size = 1048576 # i.e. bytes of matrix_scan output joined at once
+buffer_size = 16384 # i.e. lines buffered per profile before being written
+engines = ["pwmscan", "numpy"]
+formats = ["tsv", "columnar"]
+hits_file = "scans.hits" # i.e. columnar format
+manifest_file = "scans.manifest" # i.e. completed work units and outputs
+parts_dir = ".parts" # i.e. work units of outputs (for resuming)
 pid = os.getpid()
+track_window_size = 1000000 # i.e. bases scanned at once (with `--to-bigbed`)
 taxons = [
     "fungi",
     "insects",
@@ -45,6 +67,18 @@ CONTEXT_SETTINGS = {
     "profiles_dir",
     type=click.Path(exists=True, resolve_path=True),
 )
+@click.option(
+    "-c", "--cache-dir",
+    help="Cache directory (i.e. for score tables).  [default: no cache]",
+    type=click.Path(resolve_path=True),
+)
+@click.option(
+    "--cache-size",
+    help="Cache size (in Gb).",
+    type=float,
+    default=1.,
+    show_default=True,
+)
 @click.option(
     "-d", "--dummy-dir",
     help="Dummy directory.",
@@ -52,6 +86,18 @@ CONTEXT_SETTINGS = {
     default="/tmp/",
     show_default=True,
 )
+@click.option(
+    "-f", "--format",
+    help="Output format (`columnar` implies `--engine numpy`).",
+    type=click.Choice(formats),
+    default="tsv",
+    show_default=True,
+)
+@click.option(
+    "-i", "--index",
+    help="Write outputs as BGZF with a positional index (implies `--stream`).",
+    is_flag=True,
+)
 @click.option(
     "-o", "--output-dir",
     help="Output directory.",
@@ -59,6 +105,16 @@ CONTEXT_SETTINGS = {
     default="./",
     show_default=True,
 )
+@click.option(
+    "-r", "--reuse-dir",
+    help="Reuse unchanged scans from the output directory of a previous release.",
+    type=click.Path(exists=True, resolve_path=True),
+)
+@click.option(
+    "-s", "--stream",
+    help="Join scores and compress in-process (i.e. no awk/gzip pipeline).",
+    is_flag=True,
+)
 @click.option(
     "-t", "--threads",
     help="Number of CPU threads to use.",
@@ -66,6 +122,12 @@ CONTEXT_SETTINGS = {
     default=1,
     show_default=True,
 )
+@click.option(
+    "--to-bigbed",
+    help="Scan each chromosome once with all profiles and write the hits straight into a bigBed track (i.e. `<genome>.bb`, named after CHROM_SIZES; no per-profile outputs are written).",
+    type=click.Path(exists=True, resolve_path=True),
+    metavar="CHROM_SIZES",
+)
 @optgroup.group("Search arguments")
 @optgroup.option(
     "-b", "--background",
@@ -75,6 +137,18 @@ CONTEXT_SETTINGS = {
     default=[.25, .25, .25, .25],
     show_default=True,
 )
+@optgroup.option(
+    "-e", "--engine",
+    help="Scanning engine.",
+    type=click.Choice(engines),
+    default="pwmscan",
+    show_default=True,
+)
+@optgroup.option(
+    "-g", "--genome-major",
+    help="Scan each chromosome once with all profiles (implies `--engine numpy`).",
+    is_flag=True,
+)
 @optgroup.option(
     "-l", "--latest",
     help="Use the latest version of each profile.",
@@ -99,12 +173,29 @@ CONTEXT_SETTINGS = {
     default=.8,
     show_default=True,
 )
+@optgroup.option(
+    "--skip-masked",
+    help="Skip windows overlapping soft-masked (i.e. lower case) sequence (implies `--engine numpy`).",
+    is_flag=True,
+)
 @optgroup.option(
     "--taxon",
     help="Taxon(s) to use.  [default: all]",
     multiple=True,
     default=taxons,
 )
+@optgroup.option(
+    "--threshold",
+    help="Additional (i.e. stricter) P-value and relative score thresholds, each written to its own output subdirectory.  [default: none]",
+    type=float,
+    nargs=2,
+    multiple=True,
+)
+@optgroup.option(
+    "-w", "--window-size",
+    help="Split scans into windows of this many bases (implies `--engine numpy`).  [default: no windows]",
+    type=int,
+)
 
 def main(**params):
 
@@ -112,36 +203,258 @@ def main(**params):
     scan_sequence(params["fasta_file"], params["profiles_dir"],
         params["dummy_dir"], params["output_dir"], params["threads"],
         params["background"], params["latest"], set(params["profile"]),
-        params["pthresh"], params["rthresh"], params["taxon"])
+        params["pthresh"], params["rthresh"], params["taxon"],
+        params["engine"], params["genome_major"], params["window_size"],
+        params["cache_dir"], params["cache_size"], params["stream"],
+        params["index"], params["format"], params["reuse_dir"],
+        params["threshold"], params["skip_masked"], params["to_bigbed"])
 
 def scan_sequence(fasta_file, profiles_dir, dummy_dir="/tmp/", output_dir="./",
     threads=1, background=(.25, .25, .25, .25), latest=False, profile=set(), 
-    pthresh=.05, rthresh=.8, taxon=taxons):
+    pthresh=.05, rthresh=.8, taxon=taxons, engine="pwmscan",
+    genome_major=False, window_size=None, cache_dir=None, cache_size=1.,
+    stream=False, index=False, format="tsv", reuse_dir=None, threshold=[],
+    skip_masked=False, to_bigbed=None):
 
     # Initialize
     A, C, G, T = background
 
+    # Outputs of additional thresholds are derived from those of the scan
+    for p, r in threshold:
+        if p > pthresh or r < rthresh:
+            raise ValueError("Additional thresholds must be at least as " + \
+                "strict as the P-value and relative score thresholds")
+
     # Create output directory
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Get profiles with which to scan sequence
-    profiles = _get_profiles(profiles_dir, latest, profile, taxon)
+    # Remove dummy files left behind by runs that crashed
+    _remove_stale_files(dummy_dir, output_dir)
+
+    # Get profiles with which to scan sequence (i.e. from the catalog)
+    profiles_catalog = catalog.load(profiles_dir)
+    profiles = _get_profiles(profiles_dir, latest, profile, taxon,
+        profiles_catalog)
+
+    # Get profile names (i.e. only those passed on to workers)
+    if profiles_catalog is not None:
+        names = catalog.get_names(profiles_catalog)
+    else:
+        with open(os.path.join(profiles_dir, "names.json")) as handle:
+            names = json.load(handle)
+    names = {m: names[m] for m in [os.path.basename(p)[:8] for p in profiles]}
+
+    # Decode regions of 2bit and BGZF FASTA files in each work unit
+    chroms = None
+    dummy_files = []
+    random_access = genome.get_format(fasta_file) != "fasta"
+    if random_access and (genome_major or window_size or format == "columnar"
+       or to_bigbed):
+        chroms = genome.index_genome(fasta_file)
+
+    # Integer-encode sequence once (i.e. shared by all profile scans)
+    elif engine == "numpy" or genome_major or window_size or \
+       format == "columnar" or len(threshold) > 0 or random_access or \
+       skip_masked or to_bigbed:
+        prefix = "%s.%s" % (os.path.basename(__file__), pid)
+        chroms = genome.encode_genome(fasta_file, dummy_dir, prefix)
+        dummy_files = [seq_file for _, seq_file in chroms]
+
+    # Index gaps once (i.e. runs of Ns and soft-masked sequence are skipped)
+    if chroms is not None:
+        genome.index_gaps(fasta_file)
+
+    # Work units are only resumed for the same sequence and parameters
+    run_key = _get_run_key(fasta_file, A, C, G, T, pthresh, rthresh, index,
+        skip_masked)
+
+    # Outputs are keyed on their content (i.e. for reuse across releases)
+    keys = {}
+    if format == "tsv" and to_bigbed is None:
+        keys = _get_keys(profiles, names, fasta_file, A, C, G, T, pthresh,
+            rthresh, index, skip_masked)
+
+    # Scan profiles against sequence (i.e. recording completed work units)
+    with manifest.Manifest(os.path.join(output_dir, manifest_file)) as journal:
+        if reuse_dir is not None and format == "tsv" and to_bigbed is None:
+            _reuse_scans(profiles, output_dir, reuse_dir, journal, keys, index)
+        if to_bigbed is not None:
+            _scan_track(profiles, chroms, names, to_bigbed, dummy_dir,
+                output_dir, threads, A, C, G, T, pthresh, rthresh,
+                window_size, cache_dir, cache_size, journal, run_key,
+                fasta_file, skip_masked)
+        elif format == "columnar":
+            _scan_columnar(profiles, chroms, names, dummy_dir, output_dir,
+                threads, A, C, G, T, pthresh, rthresh, window_size, cache_dir,
+                cache_size, journal, fasta_file, skip_masked)
+        elif genome_major:
+            _scan_chroms(profiles, chroms, names, dummy_dir, output_dir,
+                threads, A, C, G, T, pthresh, rthresh, cache_dir, cache_size,
+                index, journal, run_key, keys, fasta_file, skip_masked)
+        elif window_size:
+            _scan_windows(profiles, chroms, names, dummy_dir, output_dir,
+                threads, A, C, G, T, pthresh, rthresh, window_size, cache_dir,
+                cache_size, index, journal, run_key, keys, fasta_file,
+                skip_masked)
+        else:
+            _scan_profiles(profiles, fasta_file, names, dummy_dir, output_dir,
+                threads, A, C, G, T, pthresh, rthresh, chroms, cache_dir,
+                cache_size, stream or index, index, journal, keys, skip_masked)
+
+        # Derive outputs of additional thresholds (i.e. without rescanning)
+        if len(threshold) > 0 and format == "tsv" and to_bigbed is None:
+            _derive_scans(profiles, chroms, output_dir, threads, A, C, G, T,
+                threshold, cache_dir, cache_size, index, journal)
+
+    # Remove dummy files
+    for dummy_file in dummy_files:
+        os.remove(dummy_file)
+
+def _remove_stale_files(dummy_dir="/tmp/", output_dir="./"):
+
+    # Initialize
+    prefix = "%s." % os.path.basename(__file__)
+
+    # Dummy files (i.e. named after the PID of the run)
+    for file_name in os.listdir(dummy_dir):
+        if file_name.startswith(prefix):
+            if not _is_running(file_name[len(prefix):].split(".")[0]):
+                os.remove(os.path.join(dummy_dir, file_name))
+
+    # Temporary output files (i.e. named after the PID of the writer)
+    for d in [output_dir, os.path.join(output_dir, parts_dir)]:
+        if not os.path.isdir(d):
+            continue
+        for file_name in os.listdir(d):
+            fields = file_name.split(".")
+            if fields[-1] == "idx":
+                fields.pop()
+            if file_name.startswith(".") and fields[-1] == "tmp":
+                if not _is_running(fields[-2]):
+                    os.remove(os.path.join(d, file_name))
+
+def _is_running(pid):
+
+    try:
+        os.kill(int(pid), 0)
+    except ValueError: # i.e. not a PID
+        return(True)
+    except ProcessLookupError:
+        return(False)
+    except PermissionError: # i.e. owned by another user
+        return(True)
+
+    return(True)
+
+def _get_run_key(fasta_file, A=.25, C=.25, G=.25, T=.25, pthresh=.05,
+    rthresh=.8, index=False, skip_masked=False):
+
+    # Initialize
+    stat = os.stat(fasta_file)
+    parts = [fasta_file, stat.st_size, stat.st_mtime_ns, (A, C, G, T),
+        pthresh, rthresh, index]
+
+    # i.e. keys of scans of the whole sequence are left unchanged
+    if skip_masked:
+        parts.append("skip-masked")
+
+    return(cache.get_key(*parts)[:16])
+
+def _get_keys(profiles, names, fasta_file, A=.25, C=.25, G=.25, T=.25,
+    pthresh=.05, rthresh=.8, index=False, skip_masked=False):
+
+    # Initialize
+    keys = {}
+    genome_key = manifest.checksum(fasta_file)
+
+    # Key each output on PWM content, name, sequence and parameters
+    for profile_file in profiles:
+        matrix_id = os.path.basename(profile_file)[:8]
+        with open(profile_file, "rb") as handle:
+            parts = [handle.read(), names[matrix_id], genome_key, (A, C, G, T),
+                pthresh, rthresh, index]
+        if skip_masked:
+            parts.append("skip-masked")
+        keys["%s.tsv.gz" % matrix_id] = cache.get_key(*parts)
+
+    return(keys)
+
+def _reuse_scans(profiles, output_dir, reuse_dir, journal, keys, index=False):
+
+    # Initialize
+    previous = manifest.Manifest(os.path.join(reuse_dir, manifest_file),
+        read_only=True)
 
-    # Get profile names
-    with open(os.path.join(profiles_dir, "names.json")) as handle:
-        names = json.load(handle)
+    # For each profile...
+    for profile_file in profiles:
 
-    # Scan profiles against sequence
-    _scan_profiles(profiles, fasta_file, names, dummy_dir, output_dir, threads,
-        A, C, G, T, pthresh, rthresh)
+        # Skip if profile already scanned
+        output_file = os.path.join(output_dir,
+            "%s.tsv.gz" % os.path.basename(profile_file)[:8])
+        if _is_scanned(output_file, journal):
+            continue
 
-def _get_profiles(profiles_dir, latest=False, profile=set(), taxon=taxons):
+        # Skip if profile, name, sequence or parameters have changed
+        unit = os.path.basename(output_file)
+        file_name = previous.find(keys[unit])
+        if file_name is None:
+            continue
+
+        # Hard-link (or copy) output of the previous release
+        if index:
+            _copy_output(bgzf.get_index_file(file_name),
+                bgzf.get_index_file(output_file), link=True)
+        _copy_output(file_name, output_file, link=True)
+        journal.add(unit, output_file, keys[unit])
+
+def _is_scanned(output_file, journal):
+
+    # Initialize
+    unit = os.path.relpath(output_file, journal.manifest_dir)
+
+    # Completed and unchanged since
+    if journal.validate(unit):
+        return(True)
+
+    # Written before the manifest (i.e. check that it is complete)
+    if unit not in journal and os.path.exists(output_file):
+        if _is_complete(output_file):
+            journal.add(unit, output_file)
+            return(True)
+
+    return(False)
+
+def _is_complete(output_file):
+
+    try:
+        if output_file.endswith(".gz"):
+            with gzip.open(output_file) as handle:
+                while handle.read(batch_size):
+                    pass
+        else:
+            columnar.Reader(output_file).close()
+    except (OSError, EOFError, ValueError, zlib.error):
+        return(False)
+
+    return(True)
+
+def _get_profiles(profiles_dir, latest=False, profile=set(), taxon=taxons,
+    profiles_catalog=None):
 
     # Initialize
     profiles = []
     profiles_dict = {}
 
+    # Select profiles from the catalog (i.e. no need to list taxon directories)
+    if profiles_catalog is not None:
+        idx = catalog.select(profiles_catalog, latest, profile, taxon)
+        for matrix_id, t in zip(profiles_catalog["matrix_id"][idx].tolist(),
+            profiles_catalog["taxon"][idx].tolist()):
+            profiles.append(os.path.join(os.path.abspath(profiles_dir), t,
+                "%s.pwm" % matrix_id))
+        return(profiles)
+
     # For each taxon...
     for t in taxon:
 
@@ -177,25 +490,34 @@ def _get_profiles(profiles_dir, latest=False, profile=set(), taxon=taxons):
 
 def _scan_profiles(profiles, fasta_file, names, dummy_dir="/tmp/",
     output_dir="./", threads=1, A=.25, C=.25, G=.25, T=.25, pthresh=.05,
-    rthresh=.8):
+    rthresh=.8, chroms=None, cache_dir=None, cache_size=1., stream=False,
+    index=False, journal=None, keys={}, skip_masked=False):
 
-    # Parallelize scanning
+    # Skip profiles already scanned (i.e. validated against the manifest)
+    profiles = [p for p in profiles if not _is_scanned(os.path.join(
+        output_dir, "%s.tsv.gz" % os.path.basename(p)[:8]), journal)]
+
+    # Parallelize scanning (i.e. spare threads go to compression)
     kwargs = {"total": len(profiles), "ncols": 100}
     pool = Pool(threads)
     p = partial(_scan_profile, fasta_file=fasta_file, names=names,
-        dummy_dir=dummy_dir, output_dir=output_dir, threads=threads,
-        A=A, C=C, G=G, T=T, pthresh=pthresh, rthresh=rthresh)
-    for _ in tqdm(pool.imap(p, profiles), **kwargs):
-        pass
+        dummy_dir=dummy_dir, output_dir=output_dir,
+        threads=max(threads // max(len(profiles), 1), 1), A=A, C=C, G=G, T=T,
+        pthresh=pthresh, rthresh=rthresh, chroms=chroms, cache_dir=cache_dir,
+        cache_size=cache_size, stream=stream, index=index,
+        skip_masked=skip_masked)
+    for output_file in tqdm(pool.imap(p, profiles), **kwargs):
+        unit = os.path.basename(output_file)
+        journal.add(unit, output_file, keys.get(unit))
     pool.close()
     pool.join()
 
 def _scan_profile(profile_file, fasta_file, names, dummy_dir="/tmp/",
     output_dir="./", threads=1, A=.25, C=.25, G=.25, T=.25, pthresh=.05,
-    rthresh=.8):
+    rthresh=.8, chroms=None, cache_dir=None, cache_size=1., stream=False,
+    index=False, skip_masked=False):
 
     # Initialize
-    cutoff = None
     matrix_id = os.path.basename(profile_file)[:8]
     bin_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
     tsv_file = os.path.join(dummy_dir, "%s.%s.%s" % \
@@ -203,50 +525,805 @@ def _scan_profile(profile_file, fasta_file, names, dummy_dir="/tmp/",
     gzipped_file = "%s.gz" % tsv_file
     output_file = os.path.join(output_dir, "%s.tsv.gz" % matrix_id)
 
-    # Skip if profile already scanned (i.e. for speed)
-    output_file = os.path.join(output_dir, "%s.tsv.gz" % matrix_id)
-    if not os.path.exists(output_file):
+    # Calculate distribution of PWM scores
+    arrays = _load_score_table(profile_file, A, C, G, T, pthresh, rthresh,
+        cache_dir, cache_size)
+    cutoff = int(arrays["cutoff"])
+
+    # Scan and join scores in-process (i.e. written once to output file)
+    if stream:
+        Writer = bgzf.Writer if index else compression.Writer
+        with Writer(output_file, threads) as handle:
+            _stream_scan(profile_file, fasta_file, names[matrix_id],
+                _flatten_score_table(arrays), cutoff, handle, chroms,
+                skip_masked)
+        return(output_file)
+
+    # Write score table (i.e. joined by awk)
+    _write_score_table(tsv_file, arrays)
+
+    # Scan FASTA file (ugly code but very efficient)
+    cmd_1 = "%s -m %s -c %s %s" % (os.path.join(bin_dir, "matrix_scan"),
+        profile_file, cutoff, fasta_file)
+    cmd_2 = "gzip > %s" % gzipped_file
+    cmd = '''awk -v score_tab="%s" -v name="%s" 'BEGIN { while((getline line < score_tab) > 0 ) {split(line,f," "); scores[f[1]]=f[2]; pvalues[f[1]]=f[3]} close(score_tab) } {print $1"\t"$2"\t"$3"\t"name"\t"scores[$5]"\t"pvalues[$5]"\t"$6}' | %s''' % \
+        (tsv_file, names[matrix_id], cmd_2)
+    if chroms is None:
+        cmd = "%s | %s" % (cmd_1, cmd)
+        subprocess.call(cmd, shell=True, stderr=subprocess.STDOUT)
+
+    # Scan integer-encoded sequence in-process (i.e. NumPy engine)
+    else:
+        process = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        _numpy_scan(profile_file, chroms, cutoff, process.stdin, fasta_file,
+            skip_masked)
+        process.stdin.close()
+        process.wait()
+
+    # Write output
+    _copy_output(gzipped_file, output_file)
+
+    # Remove dummy files
+    os.remove(tsv_file)
+    os.remove(gzipped_file)
+
+    return(output_file)
+
+def _copy_output(file_name, output_file, link=False):
+
+    # Initialize
+    tmp_file = _get_tmp_file(output_file)
+
+    # Hard-link (or copy) to a temporary file and rename (i.e. atomically)
+    if link:
+        try:
+            os.link(file_name, tmp_file)
+        except OSError: # i.e. on different file systems
+            link = False
+    if not link:
+        shutil.copy(file_name, tmp_file)
+    os.replace(tmp_file, output_file)
+
+def _get_tmp_file(output_file):
+    return(os.path.join(os.path.dirname(output_file), ".%s.%s.tmp" % \
+        (os.path.basename(output_file), os.getpid())))
+
+def _get_score_tables(profiles, pool, output_dir="./", A=.25, C=.25, G=.25,
+    T=.25, pthresh=.05, rthresh=.8, cache_dir=None, cache_size=1.,
+    journal=None):
+
+    # Skip profiles already scanned (i.e. validated against the manifest)
+    if journal is not None:
+        profiles = [p for p in profiles if not _is_scanned(os.path.join(
+            output_dir, "%s.tsv.gz" % os.path.basename(p)[:8]), journal)]
+    matrix_ids = [os.path.basename(p)[:8] for p in profiles]
+
+    # Calculate distributions of PWM scores (i.e. returned as arrays)
+    p = partial(_get_score_table, A=A, C=C, G=G, T=T, pthresh=pthresh,
+        rthresh=rthresh, cache_dir=cache_dir, cache_size=cache_size)
+    results = pool.map(p, profiles)
+    cutoffs = [cutoff for cutoff, _ in results]
+    tables = [table for _, table in results]
+
+    return(profiles, matrix_ids, tables, cutoffs)
+
+def _get_score_table(profile_file, A=.25, C=.25, G=.25, T=.25, pthresh=.05,
+    rthresh=.8, cache_dir=None, cache_size=1.):
+
+    # Calculate distribution of PWM scores (or load it from the cache)
+    arrays = _load_score_table(profile_file, A, C, G, T, pthresh, rthresh,
+        cache_dir, cache_size)
+
+    return(int(arrays["cutoff"]), _flatten_score_table(arrays))
+
+def _load_score_table(profile_file, A=.25, C=.25, G=.25, T=.25, pthresh=.05,
+    rthresh=.8, cache_dir=None, cache_size=1.):
+
+    # Initialize
+    arrays = None
+
+    # Load score table and cutoff from cache (i.e. keyed on PWM content)
+    if cache_dir is not None:
+        with open(profile_file, "rb") as handle:
+            key = cache.get_key(handle.read(), (A, C, G, T), pthresh, rthresh)
+        arrays = cache.load(cache_dir, key)
+
+    if arrays is None:
 
         # Calculate distribution of PWM scores
-        cmd = "%s %s" % (os.path.join(bin_dir, "matrix_prob"), profile_file)
-        process = subprocess.run([cmd], shell=True, stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
+        distribution = pwm.score_distribution(catalog.read_pwm(profile_file),
+            (A, C, G, T))
+        scores, rel_scores, log_pvalues = pwm.score_table(*distribution)
+        arrays = {
+            "scores": scores.astype("int32"),
+            "rel_scores": rel_scores.astype("int16"),
+            "log_pvalues": log_pvalues.astype("int32"),
+            "cutoff": pwm.get_cutoff(*distribution, pthresh, rthresh)
+        }
 
-        with open(tsv_file, "w") as f:
+        # Save score table and cutoff to cache
+        if cache_dir is not None:
+            cache.save(cache_dir, key, int(cache_size * 1024 ** 3), **arrays)
 
-            for line in process.stdout.decode("utf-8").split("\n"):
+    return(arrays)
 
-                matches = re.findall("(\S+)", line)
+def _write_score_table(tsv_file, arrays):
 
-                if len(matches) == 3:
+    # i.e. score, relative score and p-value
+    with open(tsv_file, "w") as f:
+        columns = ["scores", "rel_scores", "log_pvalues"]
+        for row in zip(*[arrays[c].tolist() for c in columns]):
+            f.write("%s\t%s\t%s\n" % row)
 
-                    score = matches[0]
-                    p_value = float(matches[1])
-                    perc = float(matches[2][:-1])
+def _flatten_score_table(arrays):
 
-                    f.write(f"{score}\t{int(perc * 10)}\t" +\
-                            f"{int(log(p_value) * 1000 / -10)}\n")
+    # Initialize
+    scores = arrays["scores"].astype(np.int64)
+    offset = int(scores.min())
+    rel_scores = np.zeros(scores.max() - offset + 1, dtype=np.int32)
+    log_pvalues = np.zeros(len(rel_scores), dtype=np.int32)
 
-                    # Get PWM score cutoff
-                    if cutoff is None:
-                        cutoff = score
-                    elif p_value < pthresh and perc >= rthresh * 100:
-                        cutoff = score
+    # Flatten (i.e. indexed by PWM score - lowest score)
+    rel_scores[scores - offset] = arrays["rel_scores"]
+    log_pvalues[scores - offset] = arrays["log_pvalues"]
 
-        # Scan FASTA file (ugly code but very efficient)
-        cmd_1 = "%s -m %s -c %s %s" % (os.path.join(bin_dir, "matrix_scan"),
-            profile_file, cutoff, fasta_file)
-        cmd_2 = "gzip > %s" % gzipped_file
-        cmd = '''%s | awk -v score_tab="%s" -v name="%s" 'BEGIN { while((getline line < score_tab) > 0 ) {split(line,f," "); scores[f[1]]=f[2]; pvalues[f[1]]=f[3]} close(score_tab) } {print $1"\t"$2"\t"$3"\t"name"\t"scores[$5]"\t"pvalues[$5]"\t"$6}' | %s''' % \
-            (cmd_1, tsv_file, names[matrix_id], cmd_2)
-        subprocess.call(cmd, shell=True, stderr=subprocess.STDOUT)
+    return(offset, rel_scores, log_pvalues)
+
+def _join_scores(chrom, starts, strands, scores, length, name, table):
+
+    # Initialize
+    offset, rel_scores, log_pvalues = table
+    idx = scores - offset
+
+    # i.e. chrom, start, end, name, relative score, p-value and strand
+    return(["%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (chrom, s, s + length, name, r,
+        l, "+-"[t]) for s, r, l, t in zip(starts.tolist(),
+        rel_scores[idx].tolist(), log_pvalues[idx].tolist(),
+        strands.tolist())])
+
+def _stream_scan(profile_file, fasta_file, name, table, cutoff, handle,
+    chroms=None, skip_masked=False):
+
+    # Initialize
+    bin_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+    offset, rel_scores, log_pvalues = table
+
+    # Scan FASTA file, joining scores in batches of matrix_scan output
+    if chroms is None:
+        name = name.encode()
+        cmd = [os.path.join(bin_dir, "matrix_scan"), "-m", profile_file, "-c",
+            str(cutoff), fasta_file]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        for lines in iter(lambda: process.stdout.readlines(batch_size), []):
+            fields = [line.split() for line in lines]
+            idx = np.array([int(f[4]) for f in fields]) - offset
+            handle.write(b"".join([b"%s\t%s\t%s\t%s\t%d\t%d\t%s\n" % (f[0],
+                f[1], f[2], name, r, l, f[5]) for f, r, l in zip(fields,
+                rel_scores[idx].tolist(), log_pvalues[idx].tolist())]))
+        process.stdout.close()
+        process.wait()
+
+    # Scan integer-encoded sequence (i.e. NumPy engine)
+    else:
+        matrix = catalog.read_pwm(profile_file)
+        length = len(matrix)
+        for chrom, seq_file in chroms:
+            sequence = genome.load(seq_file)
+            intervals = _get_intervals(fasta_file, chrom, [matrix], [cutoff],
+                skip_masked=skip_masked)
+            for starts, strands, scores in pwm.scan(matrix, sequence, cutoff,
+                intervals=intervals):
+                handle.write("".join(_join_scores(chrom, starts, strands,
+                    scores, length, name, table)).encode())
+
+def _numpy_scan(profile_file, chroms, cutoff, handle, fasta_file=None,
+    skip_masked=False):
+
+    # Initialize
+    matrix = catalog.read_pwm(profile_file)
+    length = len(matrix)
+
+    # For each sequence...
+    for chrom, seq_file in chroms:
+
+        # Write hits in the same format as matrix_scan (i.e. BED-like)
+        sequence = genome.load(seq_file)
+        intervals = _get_intervals(fasta_file, chrom, [matrix], [cutoff],
+            skip_masked=skip_masked)
+        for starts, strands, scores in pwm.scan(matrix, sequence, cutoff,
+            intervals=intervals):
+            lines = ["%s\t%s\t%s\t.\t%s\t%s\n" % (chrom, s, s + length,
+                score, "+-"[strand]) for s, strand, score in \
+                zip(starts.tolist(), strands.tolist(), scores.tolist())]
+            handle.write("".join(lines).encode())
+
+def _get_intervals(fasta_file, chrom, matrices, cutoffs, start=0, end=None,
+    skip_masked=False):
+
+    # Windows within runs of Ns only score the lowest score of each position
+    skip_n = all(cutoff > matrix.min(axis=1).sum() for matrix, cutoff in \
+        zip(matrices, cutoffs))
+    starts, ends = genome.get_intervals(fasta_file, chrom, len(matrices[0]),
+        skip_n, skip_masked)
+
+    # Intervals within region (i.e. relative to its start)
+    if end is None:
+        end = np.iinfo(np.int64).max
+    lo = np.searchsorted(ends, start, "right")
+    hi = np.searchsorted(starts, end, "left")
+
+    return(np.maximum(starts[lo:hi], start) - start,
+        np.minimum(ends[lo:hi], end) - start)
+
+def _derive_scans(profiles, chroms, output_dir="./", threads=1, A=.25, C=.25,
+    G=.25, T=.25, threshold=[], cache_dir=None, cache_size=1., index=False,
+    journal=None):
+
+    # Initialize
+    tasks = []
+    dirs = [_get_threshold_dir(output_dir, p, r) for p, r in threshold]
+
+    # Create output subdirectories
+    for d in dirs:
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+    # Skip outputs already derived (i.e. validated against the manifest)
+    for profile_file in profiles:
+        output_file = "%s.tsv.gz" % os.path.basename(profile_file)[:8]
+        if not journal.validate(output_file):
+            continue
+        todo = [k for k, d in enumerate(dirs) if not _is_scanned(
+            os.path.join(d, output_file), journal)]
+        if len(todo) > 0:
+            tasks.append((profile_file, [dirs[k] for k in todo],
+                [threshold[k] for k in todo]))
+
+    # Parallelize deriving over profiles
+    kwargs = {"total": len(tasks), "ncols": 100}
+    pool = Pool(threads)
+    p = partial(_derive_scan, chroms=chroms, output_dir=output_dir, A=A, C=C,
+        G=G, T=T, cache_dir=cache_dir, cache_size=cache_size, index=index)
+    for output_files in tqdm(pool.imap(p, tasks), **kwargs):
+        for output_file in output_files:
+            journal.add(os.path.relpath(output_file, journal.manifest_dir),
+                output_file)
+    pool.close()
+    pool.join()
+
+def _get_threshold_dir(output_dir, pthresh=.05, rthresh=.8):
+    return(os.path.join(output_dir, "p%s_r%s" % (pthresh, rthresh)))
+
+def _derive_scan(task, chroms, output_dir="./", A=.25, C=.25, G=.25, T=.25,
+    cache_dir=None, cache_size=1., index=False):
+
+    # Initialize
+    profile_file, dirs, threshold = task
+    matrix = catalog.read_pwm(profile_file)
+    matrix_id = os.path.basename(profile_file)[:8]
+    seq_files = dict(chroms)
+    output_files = [os.path.join(d, "%s.tsv.gz" % matrix_id) for d in dirs]
+    Writer = bgzf.Writer if index else compression.Writer
+
+    # Calculate cutoffs
+    cutoffs = [int(_load_score_table(profile_file, A, C, G, T, p, r,
+        cache_dir, cache_size)["cutoff"]) for p, r in threshold]
+
+    # Filter hits of the scan into each output in a single pass
+    with ExitStack() as stack:
+        handles = [stack.enter_context(Writer(f)) for f in output_files]
+        handle = stack.enter_context(gzip.open(os.path.join(output_dir,
+            "%s.tsv.gz" % matrix_id)))
+        for lines in iter(lambda: handle.readlines(batch_size), []):
+
+            # Initialize
+            fields = [line.split(b"\t", 2) for line in lines]
+            chrom_list = np.array([f[0] for f in fields])
+            starts = np.array([int(f[1]) for f in fields], dtype=np.int64)
+            strands = np.array([line[-2:-1] == b"-" for line in lines],
+                dtype=np.uint8)
+            scores = np.zeros(len(lines), dtype=np.int64)
+
+            # Rescore hits (i.e. relative scores and p-values are rounded)
+            for chrom in dict.fromkeys(chrom_list.tolist()):
+                idx = np.flatnonzero(chrom_list == chrom)
+                start = int(starts[idx].min())
+                sequence = genome.load(seq_files[chrom.decode()], start,
+                    int(starts[idx].max()) + len(matrix))
+                scores[idx] = pwm.score_hits(matrix, sequence,
+                    starts[idx] - start, strands[idx])
+
+            # Write hits passing each cutoff
+            for h, cutoff in zip(handles, cutoffs):
+                h.write(b"".join([lines[i] for i in \
+                    np.flatnonzero(scores >= cutoff).tolist()]))
+
+    return(output_files)
+
+def _scan_windows(profiles, chroms, names, dummy_dir="/tmp/",
+    output_dir="./", threads=1, A=.25, C=.25, G=.25, T=.25, pthresh=.05,
+    rthresh=.8, window_size=1000000, cache_dir=None, cache_size=1.,
+    index=False, journal=None, run_key="", keys={}, fasta_file=None,
+    skip_masked=False):
+
+    # Initialize
+    tasks = []
+    indices = {}
+
+    # Calculate distributions of PWM scores
+    pool = Pool(threads)
+    profiles, matrix_ids, tables, cutoffs = _get_score_tables(profiles,
+        pool, output_dir, A, C, G, T, pthresh, rthresh, cache_dir, cache_size,
+        journal)
+    output_files = [os.path.join(output_dir, "%s.tsv.gz" % m) \
+        for m in matrix_ids]
+
+    # Split scans into work units (i.e. profile, sequence, window), skipping
+    # windows with nothing to scan (e.g. within gaps)
+    lengths = [genome.get_length(seq_file) for _, seq_file in chroms]
+    for j in range(len(profiles)):
+        matrix = catalog.read_pwm(profiles[j])
+        for i, length in enumerate(lengths):
+            for start in range(0, length, window_size):
+                end = min(start + window_size, length)
+                if len(_get_intervals(fasta_file, chroms[i][0], [matrix],
+                   [cutoffs[j]], start, end, skip_masked)[0]) > 0:
+                    tasks.append((j, i, start, end))
+    parts = [[] for _ in profiles]
+    for j, i, start, _ in tasks:
+        parts[j].append(_get_part_file(output_dir, matrix_ids[j], i, start))
+
+    # Skip work units already completed (i.e. validated against the manifest)
+    units = [_get_unit(matrix_ids[j], chroms[i][0], start, run_key) \
+        for j, i, start, _ in tasks]
+    todo = [k for k, unit in enumerate(units) if not journal.validate(unit)]
+    remaining = [0] * len(profiles)
+    for k in todo:
+        remaining[tasks[k][0]] += 1
+
+    # Stitch profiles whose work units were all completed earlier
+    for j, output_file in enumerate(output_files):
+        if remaining[j] == 0:
+            _stitch_parts(parts[j], output_file, journal, index,
+                key=keys.get(os.path.basename(output_file)))
+
+    # Parallelize scanning over work units (i.e. each sent along with the
+    # score table of its profile)
+    kwargs = {"total": len(todo), "ncols": 100}
+    p = partial(_scan_window, profiles=profiles, chroms=chroms,
+        cutoffs=cutoffs, names=names, index=index, fasta_file=fasta_file,
+        skip_masked=skip_masked)
+    results = pool.imap(p, [tasks[k] + (tables[tasks[k][0]],) for k in todo])
+    for k, data in zip(todo, tqdm(results, **kwargs)):
+
+        # Write work unit and record it as completed
+        j, i, start, _ = tasks[k]
+        part_file = _get_part_file(output_dir, matrix_ids[j], i, start)
+        if index:
+            data, indices[part_file] = data
+        with open(part_file, "wb") as handle:
+            handle.write(data)
+        journal.add(units[k], part_file)
+
+        # Last work unit of profile (i.e. stitched in coordinate order)
+        remaining[j] -= 1
+        if remaining[j] == 0:
+            _stitch_parts(parts[j], output_files[j], journal, index, indices,
+                keys.get(os.path.basename(output_files[j])))
+
+    pool.close()
+    pool.join()
+
+    # Remove directory of work units
+    _remove_part_dir(output_dir)
+
+def _get_part_file(output_dir, matrix_id, i, start=0):
+
+    # Initialize
+    part_dir = os.path.join(output_dir, parts_dir)
+    if not os.path.exists(part_dir):
+        os.makedirs(part_dir, exist_ok=True)
+
+    return(os.path.join(part_dir, "%s.%s.%s.gz" % (matrix_id, i, start)))
+
+def _remove_part_dir(output_dir):
+
+    # Initialize
+    part_dir = os.path.join(output_dir, parts_dir)
+
+    # Remove directory of work units once empty
+    if os.path.isdir(part_dir) and len(os.listdir(part_dir)) == 0:
+        os.rmdir(part_dir)
+
+def _get_unit(matrix_id, chrom, start=0, run_key=""):
+    return("%s:%s:%s:%s" % (matrix_id, chrom, start, run_key))
+
+def _stitch_parts(part_files, output_file, journal, index=False,
+    indices=None, key=None):
+
+    # Initialize
+    if indices is None:
+        indices = {}
+
+    # Concatenate BGZF blocks of each work unit, shifting their index
+    if index:
+        with bgzf.Writer(output_file) as handle:
+            for part_file in part_files:
+                with open(part_file, "rb") as part:
+                    data = part.read()
+                if part_file not in indices: # i.e. completed by an earlier run
+                    indices[part_file] = bgzf.index_blocks(data)
+                handle.write_blocks(data, indices.pop(part_file))
+
+    # Concatenate gzip members of each work unit (i.e. in coordinate order)
+    else:
+        tmp_file = _get_tmp_file(output_file)
+        with open(tmp_file, "wb") as handle:
+            for part_file in part_files:
+                with open(part_file, "rb") as part:
+                    shutil.copyfileobj(part, handle)
+            # i.e. no hits (a valid gzip file needs at least one member)
+            if handle.tell() == 0:
+                handle.write(gzip.compress(b""))
+        os.replace(tmp_file, output_file)
+
+    # Record output as completed
+    journal.add(os.path.basename(output_file), output_file, key)
+
+    # Remove work units
+    for part_file in part_files:
+        os.remove(part_file)
+
+def _scan_window(task, profiles, chroms, cutoffs, names, index=False,
+    fasta_file=None, skip_masked=False):
+
+    # Initialize
+    j, i, start, end, table = task
+    chrom, seq_file = chroms[i]
+    matrix = catalog.read_pwm(profiles[j])
+    length = len(matrix)
+    name = names[os.path.basename(profiles[j])[:8]]
+    lines = []
+
+    # Scan window (i.e. plus overlap of motif length - 1)
+    sequence = genome.load(seq_file, start, end + length - 1)
+    intervals = _get_intervals(fasta_file, chrom, [matrix], [cutoffs[j]],
+        start, end, skip_masked)
+    for starts, strands, scores in pwm.scan(matrix, sequence, cutoffs[j],
+        intervals=intervals):
+        lines.extend(_join_scores(chrom, starts + start, strands, scores,
+            length, name, table))
+
+    # Return as indexed BGZF blocks (i.e. compressed by the worker)
+    if index:
+        return(bgzf.compress_lines("".join(lines).encode()))
+
+    # Return as a gzip member (i.e. compressed by the worker)
+    if len(lines) == 0:
+        return(b"")
+
+    return(gzip.compress("".join(lines).encode(), compresslevel=6))
+
+def _scan_chroms(profiles, chroms, names, dummy_dir="/tmp/", output_dir="./",
+    threads=1, A=.25, C=.25, G=.25, T=.25, pthresh=.05, rthresh=.8,
+    cache_dir=None, cache_size=1., index=False, journal=None, run_key="",
+    keys={}, fasta_file=None, skip_masked=False):
+
+    # Initialize
+    tasks = []
+    indices = {}
+
+    # Calculate distributions of PWM scores
+    pool = Pool(threads)
+    profiles, matrix_ids, tables, cutoffs = _get_score_tables(profiles,
+        pool, output_dir, A, C, G, T, pthresh, rthresh, cache_dir, cache_size,
+        journal)
+    parts = [[_get_part_file(output_dir, m, i) for i in range(len(chroms))] \
+        for m in matrix_ids]
+
+    # Skip work units already completed (i.e. validated against the manifest)
+    units = [[_get_unit(m, chrom, 0, run_key) for chrom, _ in chroms] \
+        for m in matrix_ids]
+    for i, (chrom, seq_file) in enumerate(chroms):
+        todo = [j for j in range(len(profiles)) if \
+            not journal.validate(units[j][i])]
+        if len(todo) > 0:
+            tasks.append((i, chrom, seq_file, todo))
+
+    # Parallelize scanning over sequences (i.e. each sequence is read once)
+    kwargs = {"total": len(tasks), "ncols": 100}
+    p = partial(_scan_chrom, profiles=profiles, tables=tables,
+        part_files=parts, cutoffs=cutoffs, names=names, index=index,
+        fasta_file=fasta_file, skip_masked=skip_masked)
+    for task, index_lists in zip(tasks, tqdm(pool.imap(p, tasks), **kwargs)):
+
+        # Record work units as completed
+        i, _, _, todo = task
+        for j in todo:
+            indices[parts[j][i]] = index_lists[j]
+            journal.add(units[j][i], parts[j][i])
+
+    pool.close()
+    pool.join()
+
+    # Stitch work units of each sequence (i.e. in sequence order)
+    for j, matrix_id in enumerate(matrix_ids):
+        _stitch_parts(parts[j], os.path.join(output_dir,
+            "%s.tsv.gz" % matrix_id), journal, index, indices,
+            keys.get("%s.tsv.gz" % matrix_id))
+
+    # Remove directory of work units
+    _remove_part_dir(output_dir)
+
+def _scan_chrom(task, profiles, tables, part_files, cutoffs, names,
+    index=False, fasta_file=None, skip_masked=False):
+
+    # Initialize
+    i, chrom, seq_file, todo = task
+    sequence = genome.load(seq_file)
+    matrices = {j: catalog.read_pwm(profiles[j]) for j in todo}
+    groups = {}
+    indices = [[] for _ in profiles]
+
+    # Group profiles by length (i.e. for stacking their PWMs)
+    for j, matrix in matrices.items():
+        groups.setdefault(len(matrix), []).append(j)
+
+    # For each group of profiles...
+    for length, idx in sorted(groups.items()):
+
+        # Initialize
+        labels = [names[os.path.basename(profiles[j])[:8]] for j in idx]
+        if index:
+            handles = [open(part_files[j][i], "wb") for j in idx]
+        else:
+            handles = [gzip.open(part_files[j][i], "wb", compresslevel=6) \
+                for j in idx]
+        buffers = [[] for _ in idx]
+        intervals = _get_intervals(fasta_file, chrom,
+            [matrices[j] for j in idx], [cutoffs[j] for j in idx],
+            skip_masked=skip_masked)
+
+        # Scan sequence with all profiles at once
+        for hits in pwm.scan_stacked([matrices[j] for j in idx], sequence,
+            [cutoffs[j] for j in idx], intervals=intervals):
+
+            # Split hits by profile
+            ks, starts, strands, scores = hits
+            for k in np.unique(ks).tolist():
+                mask = ks == k
+                buffers[k].extend(_join_scores(chrom, starts[mask],
+                    strands[mask], scores[mask], length, labels[k],
+                    tables[idx[k]]))
+
+            # Write full buffers
+            for k, j in enumerate(idx):
+                if len(buffers[k]) >= buffer_size:
+                    _write_lines(handles[k], buffers[k], indices[j], index)
+                    buffers[k] = []
+
+        # Write remaining buffers and close members
+        for k, j in enumerate(idx):
+            _write_lines(handles[k], buffers[k], indices[j], index)
+            handles[k].close()
+
+    return(indices)
+
+def _write_lines(handle, lines, indices, index=False):
+
+    # Initialize
+    data = "".join(lines).encode()
+
+    # Write as indexed BGZF blocks (i.e. offsets relative to this member)
+    if index:
+        data, entries = bgzf.compress_lines(data)
+        offset = handle.tell()
+        indices.extend([(chrom, start, end, offset + o, size) \
+            for chrom, start, end, o, size in entries])
+
+    handle.write(data)
+
+def _scan_track(profiles, chroms, names, chrom_sizes, dummy_dir="/tmp/",
+    output_dir="./", threads=1, A=.25, C=.25, G=.25, T=.25, pthresh=.05,
+    rthresh=.8, window_size=None, cache_dir=None, cache_size=1.,
+    journal=None, run_key="", fasta_file=None, skip_masked=False):
+
+    # Initialize
+    genome_name = os.path.basename(chrom_sizes)
+    if genome_name.endswith(".fa.sizes"): # i.e. as from scans2bigBed
+        genome_name = genome_name[:-len(".fa.sizes")]
+    output_file = os.path.join(output_dir, "%s.bb" % genome_name)
+    sizes = merge.read_chrom_sizes(chrom_sizes)
+    seq_files = dict(chroms)
+    prefix = os.path.join(dummy_dir, "%s.%s" % (os.path.basename(__file__),
+        pid))
+
+    # Skip if sequence already scanned (i.e. with the same profiles and
+    # parameters, validated against the manifest)
+    unit = "%s:%s" % (os.path.basename(output_file), cache.get_key(run_key,
+        [os.path.basename(p) for p in profiles], sizes)[:16])
+    if journal.validate(unit):
+        return
+
+    # Number chroms as in chrom sizes, except where the genome lists them
+    # otherwise (i.e. the order of the track, as by merge-scans.py)
+    ids = {c: i for i, c in enumerate(merge.sort_chroms([list(seq_files)],
+        sizes))}
+    tasks = [(c, seq_files[c]) for c in ids]
+
+    # Calculate distributions of PWM scores (i.e. of all profiles)
+    pool = Pool(threads)
+    profiles, matrix_ids, tables, cutoffs = _get_score_tables(profiles,
+        pool, output_dir, A, C, G, T, pthresh, rthresh, cache_dir, cache_size)
+
+    # Parallelize scanning and encoding over sequences, and append the
+    # pieces of the track in order
+    kwargs = {"total": len(tasks), "ncols": 100}
+    p = partial(_scan_track_chrom, profiles=profiles, tables=tables,
+        cutoffs=cutoffs, names=names, sizes=sizes, ids=ids, prefix=prefix,
+        window_size=window_size, dummy_dir=dummy_dir, fasta_file=fasta_file,
+        skip_masked=skip_masked)
+    with bigbed.Writer(output_file, sizes, threads,
+        dummy_dir=dummy_dir) as handle:
+        for piece_file, meta in tqdm(pool.imap(p, tasks), **kwargs):
+            handle.write_piece(piece_file, meta)
+            os.remove(piece_file)
+
+    pool.close()
+    pool.join()
+
+    # Record output as completed
+    journal.add(unit, output_file)
+
+def _scan_track_chrom(task, profiles, tables, cutoffs, names, sizes, ids,
+    prefix, window_size=None, dummy_dir="/tmp/", fasta_file=None,
+    skip_masked=False):
+
+    # Initialize
+    chrom, seq_file = task
+    piece_file = "%s.%s.piece" % (prefix, ids[chrom])
+    window_size = window_size if window_size else track_window_size
+    length = genome.get_length(seq_file)
+    matrices = [catalog.read_pwm(p) for p in profiles]
+    matrix_ids = [os.path.basename(p)[:8] for p in profiles]
+    labels = [names[m].encode() for m in matrix_ids]
+    matrix_ids = [m.encode() for m in matrix_ids]
+    groups = {}
+    flat_tables = {}
+
+    # Group profiles by length (i.e. for stacking their PWMs)
+    for j, matrix in enumerate(matrices):
+        groups.setdefault(len(matrix), []).append(j)
+
+    # Flatten capped p-values of each group (i.e. indexed by the base of each
+    # profile + PWM score)
+    for L, idx in groups.items():
+        offsets, _, log_pvalues = zip(*[tables[j] for j in idx])
+        bases = np.cumsum([0] + [len(p) for p in log_pvalues])[:-1]
+        flat_tables[L] = (bases - np.array(offsets, dtype=np.int64),
+            np.minimum(np.concatenate(log_pvalues), merge.max_score))
+
+    with bigbed.Piece(piece_file, sizes, ids, dummy_dir=dummy_dir) as handle:
+
+        # For each window...
+        for start in range(0, length, window_size):
+
+            # Initialize
+            end = min(start + window_size, length)
+            sequence = genome.load(seq_file, start, end + max(groups) - 1)
+            lines = []
+
+            # Scan window with all profiles of each length at once (i.e.
+            # plus overlap of motif length - 1)
+            for L, idx in sorted(groups.items()):
+                bases, pvalues = flat_tables[L]
+                intervals = _get_intervals(fasta_file, chrom,
+                    [matrices[j] for j in idx], [cutoffs[j] for j in idx],
+                    start, end, skip_masked)
+                for k, s, strands, scores in pwm.scan_stacked([matrices[j] \
+                    for j in idx], sequence[:end-start+L-1],
+                    [cutoffs[j] for j in idx], intervals=intervals):
+
+                    # BED6+1 lines (i.e. as from merge-scans.py)
+                    s = s + start
+                    v = pvalues[bases[k] + scores]
+                    lines.extend([(x, b"%s\t%d\t%d\t%s\t%d\t%s\t%s\n" % \
+                        (chrom.encode(), x, x + L, matrix_ids[idx[i]], y,
+                        b"-" if z else b"+", labels[idx[i]])) for i, x, y, z \
+                        in zip(k.tolist(), s.tolist(), v.tolist(),
+                        strands.tolist())])
+
+            # Write hits sorted by start (i.e. then as by `LC_ALL=C sort`)
+            lines.sort()
+            handle.write(b"".join([line for _, line in lines]))
+
+    return(piece_file, handle.meta)
+
+def _scan_columnar(profiles, chroms, names, dummy_dir="/tmp/",
+    output_dir="./", threads=1, A=.25, C=.25, G=.25, T=.25, pthresh=.05,
+    rthresh=.8, window_size=None, cache_dir=None, cache_size=1.,
+    journal=None, fasta_file=None, skip_masked=False):
+
+    # Initialize
+    output_file = os.path.join(output_dir, hits_file)
+    tasks = []
+
+    # Skip if sequence already scanned (i.e. validated against the manifest)
+    if _is_scanned(output_file, journal):
+        return
+
+    # Calculate distributions of PWM scores (i.e. of all profiles)
+    pool = Pool(threads)
+    profiles, matrix_ids, tables, cutoffs = _get_score_tables(profiles,
+        pool, output_dir, A, C, G, T, pthresh, rthresh, cache_dir, cache_size)
+
+    # Split scans into work units (i.e. profile, sequence, window), skipping
+    # windows with nothing to scan (e.g. within gaps)
+    lengths = [genome.get_length(seq_file) for _, seq_file in chroms]
+    for j in range(len(profiles)):
+        matrix = catalog.read_pwm(profiles[j])
+        for i, length in enumerate(lengths):
+            size = window_size if window_size else max(length, 1)
+            for start in range(0, length, size):
+                end = min(start + size, length)
+                if len(_get_intervals(fasta_file, chroms[i][0], [matrix],
+                   [cutoffs[j]], start, end, skip_masked)[0]) > 0:
+                    tasks.append((j, i, start, end))
+
+    # Parallelize scanning over work units (i.e. each sent along with the
+    # score table of its profile)
+    kwargs = {"total": len(tasks), "ncols": 100}
+    p = partial(_scan_chunks, profiles=profiles, chroms=chroms,
+        cutoffs=cutoffs, fasta_file=fasta_file, skip_masked=skip_masked)
+    with columnar.Writer(output_file) as handle:
+
+        # Add profiles and sequences
+        for j, matrix_id in enumerate(matrix_ids):
+            handle.add_profile(matrix_id, names[matrix_id],
+                len(catalog.read_pwm(profiles[j])))
+        for chrom, _ in chroms:
+            handle.add_chrom(chrom)
+
+        # Write chunks (i.e. in profile and coordinate order)
+        for k, chunks in enumerate(tqdm(pool.imap(p, [t + (tables[t[0]],) \
+            for t in tasks]), **kwargs)):
+            j, i, _, _ = tasks[k]
+            for chunk in chunks:
+                handle.write_chunk(j, i, *chunk)
+
+    pool.close()
+    pool.join()
+
+    # Record output as completed
+    journal.add(hits_file, output_file)
+
+def _scan_chunks(task, profiles, chroms, cutoffs, fasta_file=None,
+    skip_masked=False):
+
+    # Initialize
+    j, i, start, end, (offset, rel_scores, log_pvalues) = task
+    chrom, seq_file = chroms[i]
+    matrix = catalog.read_pwm(profiles[j])
+    chunks = []
+
+    # Scan window (i.e. plus overlap of motif length - 1)
+    sequence = genome.load(seq_file, start, end + len(matrix) - 1)
+    intervals = _get_intervals(fasta_file, chrom, [matrix], [cutoffs[j]],
+        start, end, skip_masked)
+    hits = list(pwm.scan(matrix, sequence, cutoffs[j], intervals=intervals))
+    if len(hits) == 0:
+        return(chunks)
+    starts, strands, scores = map(np.concatenate, zip(*hits))
 
-        # Write output
-        shutil.copy(gzipped_file, output_file)
+    # Encode hits in chunks (i.e. joining scores through flat arrays)
+    for k in range(0, len(starts), columnar.max_chunk):
+        idx = slice(k, k + columnar.max_chunk)
+        chunk = columnar.encode_chunk(starts[idx] + start, strands[idx],
+            rel_scores[scores[idx] - offset], log_pvalues[scores[idx] - offset])
+        chunks.append((len(starts[idx]), *chunk))
 
-        # Remove dummy files
-        os.remove(tsv_file)
-        os.remove(gzipped_file)
+    return(chunks)
 
 #-------------#
 # Main        #
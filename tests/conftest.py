@@ -0,0 +1,87 @@
+import importlib.util
+import json
+import os
+import pytest
+import shutil
+import sys
+
+# Globals
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data_dir = os.path.join(root_dir, "tests", "data")
+bin_dir = os.path.join(root_dir, "bin")
+
+# Import my functions (i.e. regardless of the working directory)
+sys.path.insert(0, root_dir)
+
+#-------------#
+# Functions   #
+#-------------#
+
+def load_script(file_name):
+
+    # Load script as a module (i.e. hyphenated names cannot be imported; the
+    # module is registered for the workers to unpickle its functions)
+    file_name = os.path.join(root_dir, file_name)
+    name = os.path.basename(file_name)[:-len(".py")].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, file_name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+    return(module)
+
+def which(program):
+
+    # Programs from the `bin` directory (i.e. as the scripts) or the PATH
+    exe_file = os.path.join(bin_dir, program)
+    if os.path.isfile(exe_file) and os.access(exe_file, os.X_OK):
+        return(exe_file)
+
+    return(shutil.which(program))
+
+@pytest.fixture(scope="session")
+def scan_sequence():
+    return(load_script("scan-sequence.py"))
+
+@pytest.fixture(scope="session")
+def get_profiles():
+    return(load_script(os.path.join("profiles", "get-profiles.py")))
+
+@pytest.fixture(scope="session")
+def functions():
+
+    # Functions of the original scripts (i.e. imported as `functions`)
+    return(load_script(os.path.join("version-1.0", "functions.py")))
+
+@pytest.fixture(scope="session")
+def jaspar_search(functions):
+
+    # Scanning script of the original scripts (i.e. requires Biopython)
+    pytest.importorskip("Bio.motifs")
+    return(load_script(os.path.join("version-1.0", "jaspar_search.py")))
+
+@pytest.fixture
+def fasta_file(tmp_path):
+
+    # Copy the test genome (i.e. gaps are indexed next to it)
+    fasta_file = str(tmp_path / "genome.fa")
+    shutil.copy(os.path.join(data_dir, "genome.fa"), fasta_file)
+
+    return(fasta_file)
+
+@pytest.fixture
+def pwm_file():
+    return(os.path.join(data_dir, "MA0004.1.pwm"))
+
+@pytest.fixture
+def profiles_dir(tmp_path):
+
+    # Profiles directory (i.e. as from `get-profiles.py`)
+    profiles_dir = tmp_path / "profiles"
+    (profiles_dir / "vertebrates").mkdir(parents=True)
+    shutil.copy(os.path.join(data_dir, "MA0004.1.pwm"),
+        profiles_dir / "vertebrates")
+    with open(profiles_dir / "names.json", "w") as handle:
+        json.dump({"MA0004.1": "Arnt"}, handle)
+
+    return(str(profiles_dir))
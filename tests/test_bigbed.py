@@ -0,0 +1,209 @@
+import numpy as np
+import os
+import pytest
+import subprocess
+
+from conftest import which
+import bigbed
+
+# Globals
+chrom_sizes = {"chr1": 200000, "chr2": 50000, "chr10": 120000}
+
+#-------------#
+# Functions   #
+#-------------#
+
+def _get_lines(seed=0):
+
+    # Initialize
+    rng = np.random.default_rng(seed)
+    lines = []
+
+    # Sorted BED6+1 lines (i.e. as from merge-scans.py), the first block of
+    # short items (i.e. unlike the rest)
+    for chrom, size in chrom_sizes.items():
+        starts = np.sort(rng.integers(0, size - 50, 3000))
+        sizes = rng.integers(6, 30, len(starts))
+        if len(lines) == 0:
+            sizes[:bigbed.items_per_slot] = 6
+        for start, end in zip(starts.tolist(), (starts + sizes).tolist()):
+            k = int(rng.integers(1, 10))
+            lines.append(("%s\t%s\t%s\tMA000%s.1\t%s\t%s\tTF%s\n" % \
+                (chrom, start, end, k, rng.integers(0, 1001), "+-"[k % 2],
+                k)).encode())
+
+    return(lines)
+
+def _write(bb_file, lines, dummy_dir):
+    with bigbed.Writer(bb_file, chrom_sizes, 2, dummy_dir=dummy_dir) as handle:
+        for i in range(0, len(lines), 1000):
+            handle.write(b"".join(lines[i:i+1000]))
+
+def _write_pieces(bb_file, lines, dummy_dir):
+
+    # Initialize
+    ids = {c: i for i, c in enumerate(chrom_sizes)}
+
+    # One piece per chrom (i.e. as merge-scans.py with threads)
+    with bigbed.Writer(bb_file, chrom_sizes, dummy_dir=dummy_dir) as handle:
+        for chrom in chrom_sizes:
+            piece_file = os.path.join(dummy_dir, "%s.piece" % chrom)
+            with bigbed.Piece(piece_file, chrom_sizes, {chrom: ids[chrom]},
+                dummy_dir=dummy_dir) as piece:
+                piece.write(b"".join([l for l in lines \
+                    if l.startswith(b"%s\t" % chrom.encode())]))
+            handle.write_piece(piece_file, piece.meta)
+            os.remove(piece_file)
+
+def _read_zoom_scales(bb_file):
+    with bigbed.Reader(bb_file) as reader:
+        return([scale for scale, _, _ in reader.zoom_levels])
+
+def _get_depth(lines, chrom):
+
+    # Coverage depth of each base (i.e. of the items of chrom)
+    depth = np.zeros(chrom_sizes[chrom], dtype=np.int64)
+    for f in lines:
+        if f[0] == chrom:
+            depth[int(f[1]):int(f[2])] += 1
+
+    return(depth)
+
+def _get_summaries(lines, chrom, scale):
+
+    # Initialize
+    depth = _get_depth(lines, chrom)
+
+    # Bases covered, min, max, sum and sum of squares of each bin (i.e. of
+    # the covered bases)
+    summaries = []
+    for start in range(0, chrom_sizes[chrom], scale):
+        d = depth[start:start+scale]
+        d = d[d > 0]
+        if len(d) > 0:
+            summaries.append((start, min(start + scale, chrom_sizes[chrom]),
+                len(d), d.min(), d.max(), d.sum(), (d * d).sum()))
+
+    return(summaries)
+
+def _parse_lines(lines):
+    return([tuple(l.decode().rstrip("\n").split("\t")) for l in lines])
+
+@pytest.fixture(scope="module")
+def bb_file(tmp_path_factory):
+
+    # Initialize
+    dummy_dir = tmp_path_factory.mktemp("bigbed")
+    bb_file = str(dummy_dir / "track.bb")
+    _write(bb_file, _get_lines(), str(dummy_dir))
+
+    return(bb_file)
+
+#-------------#
+# Tests       #
+#-------------#
+
+def test_zoom_scales(bb_file):
+
+    # i.e. as bedToBigBed, from the mean size of all items (x 4 per level)
+    lines = _parse_lines(_get_lines())
+    size = sum(int(f[2]) - int(f[1]) for f in lines) // len(lines)
+    scales = [max(size, 10) * bigbed.zoom_increment ** i for i in \
+        range(bigbed.max_zoom_levels)]
+    zoom_scales = _read_zoom_scales(bb_file)
+    assert len(zoom_scales) > 0
+    i = scales.index(zoom_scales[0])
+    assert zoom_scales == scales[i:i+len(zoom_scales)]
+
+def test_pieces(bb_file, tmp_path):
+
+    # Assembling pieces (i.e. in parallel) writes the same bigBed file
+    pieces_file = str(tmp_path / "pieces.bb")
+    _write_pieces(pieces_file, _get_lines(), str(tmp_path))
+
+    with open(bb_file, "rb") as a, open(pieces_file, "rb") as b:
+        assert a.read() == b.read()
+
+def test_empty(tmp_path):
+
+    bb_file = str(tmp_path / "empty.bb")
+    _write(bb_file, [], str(tmp_path))
+    assert _read_zoom_scales(bb_file) == []
+    with bigbed.Reader(bb_file) as reader:
+        assert reader.count == 0
+        assert reader.chroms == {}
+        assert list(reader.query("chr1")) == []
+        assert list(reader.find("TF1")) == []
+
+def test_reader(bb_file):
+
+    # Initialize
+    lines = _parse_lines(_get_lines())
+    rng = np.random.default_rng(0)
+
+    with bigbed.Reader(bb_file) as reader:
+
+        # Header, autoSql, chroms (i.e. numbered in the order written) and
+        # extra index
+        assert reader.version == bigbed.version
+        assert reader.field_count == 7 and reader.defined_field_count == 6
+        assert reader.as_def == bigbed.autosql
+        assert reader.count == len(lines)
+        assert reader.chroms == chrom_sizes
+        assert reader.ids == {c: i for i, c in enumerate(chrom_sizes)}
+        assert list(reader.extra_indices) == ["TFName"]
+
+        # Items of whole chroms and of regions (i.e. through the R tree, as
+        # by a linear scan)
+        entries = [(c, str(s), str(e), *rest.decode().split("\t")) for \
+            chrom in chrom_sizes for c, s, e, rest in reader.query(chrom)]
+        assert entries == lines
+        for _ in range(50):
+            chrom = str(rng.choice(list(chrom_sizes)))
+            start = int(rng.integers(0, chrom_sizes[chrom]))
+            end = start + int(rng.integers(1, 5000))
+            assert [(c, str(s), str(e), *r.decode().split("\t")) for c, s, e, \
+                r in reader.query(chrom, start, end)] == [f for f in lines \
+                if f[0] == chrom and int(f[1]) < end and int(f[2]) > start]
+        assert list(reader.query("chrX")) == []
+
+        # Items of each TF name (i.e. through its B+ tree)
+        for name in ["TF1", "TF5", "TF9", "TF0"]:
+            assert [(c, str(s), str(e), *r.decode().split("\t")) for c, s, e, \
+                r in reader.find(name)] == [f for f in lines if f[6] == name]
+
+        # Total summary and zoom levels (i.e. summaries of coverage depth)
+        depth = np.concatenate([_get_depth(lines, c) for c in chrom_sizes])
+        depth = depth[depth > 0]
+        assert list(reader.total) == [len(depth), depth.min(), depth.max(),
+            depth.sum(), (depth * depth).sum()]
+        for level, (scale, _, _) in enumerate(reader.zoom_levels):
+            for chrom in chrom_sizes:
+                summaries = reader.summaries(level, chrom)
+                assert [tuple(s) for s in summaries[["start", "end", "count",
+                    "min", "max", "sum", "sumsq"]].tolist()] == \
+                    _get_summaries(lines, chrom, scale)
+
+@pytest.mark.skipif(which("bigBedToBed") is None,
+    reason="bigBedToBed (UCSC) not installed")
+def test_bigbedtobed(bb_file, tmp_path):
+
+    # Round trip (i.e. with UCSC's bigBedToBed)
+    bed_file = str(tmp_path / "track.bed")
+    subprocess.run([which("bigBedToBed"), bb_file, bed_file], check=True)
+
+    with open(bed_file, "rb") as handle:
+        assert _parse_lines(handle) == _parse_lines(_get_lines())
+
+def test_pybigwig(bb_file):
+
+    # Round trip (i.e. with libBigWig)
+    pyBigWig = pytest.importorskip("pyBigWig")
+    bb = pyBigWig.open(bb_file)
+    assert bb.isBigBed()
+    assert bb.chroms() == chrom_sizes
+    assert bb.SQL().decode().rstrip("\0") == bigbed.autosql
+    entries = [(chrom, str(s), str(e), *rest.split("\t")) for chrom in \
+        chrom_sizes for s, e, rest in bb.entries(chrom, 0, chrom_sizes[chrom])]
+    bb.close()
+    assert entries == _parse_lines(_get_lines())
@@ -0,0 +1,39 @@
+import os
+import shutil
+
+from conftest import data_dir
+import catalog
+import pwm
+
+def _get_catalog(get_profiles, profiles_dir):
+
+    # Read profile (i.e. as from a JASPAR archive)
+    taxon_dir = os.path.join(profiles_dir, "vertebrates")
+    shutil.copy(os.path.join(data_dir, "MA0004.1.jaspar"), taxon_dir)
+    profile = get_profiles._read_profile((taxon_dir, "MA0004.1.jaspar", None))
+    get_profiles.get_catalog([profile], profiles_dir)
+
+    return(catalog.load(profiles_dir))
+
+def test_catalog(get_profiles, profiles_dir):
+
+    profiles_catalog = _get_catalog(get_profiles, profiles_dir)
+    assert catalog.get_names(profiles_catalog) == {"MA0004.1": "Arnt"}
+    assert catalog.select(profiles_catalog, taxon=["plants"]).tolist() == []
+    assert catalog.select(profiles_catalog, latest=True).tolist() == [0]
+
+def test_read_pwm(get_profiles, profiles_dir, pwm_file):
+
+    # PWMs are read from the catalog (i.e. not from the files)
+    _get_catalog(get_profiles, profiles_dir)
+    profile_file = os.path.join(profiles_dir, "vertebrates", "MA0004.1.pwm")
+    os.remove(profile_file)
+    assert catalog.read_pwm(profile_file).tolist() == \
+        pwm.read_pwm(pwm_file).tolist()
+
+def test_read_pwm_files(profiles_dir, pwm_file):
+
+    # PWMs are read from the files (i.e. without a catalog)
+    profile_file = os.path.join(profiles_dir, "vertebrates", "MA0004.1.pwm")
+    assert catalog.read_pwm(profile_file).tolist() == \
+        pwm.read_pwm(pwm_file).tolist()
@@ -0,0 +1,53 @@
+import gzip
+import os
+
+import bgzf
+import compression
+
+def test_writer(tmp_path):
+
+    # Blocks are written in order (i.e. as concatenated gzip members)
+    output_file = str(tmp_path / "output.gz")
+    lines = [b"%s\n" % str(i).encode() for i in range(100000)]
+    with compression.Writer(output_file, threads=4, size=4096) as handle:
+        for line in lines:
+            handle.write(line)
+
+    with gzip.open(output_file) as handle:
+        assert handle.read() == b"".join(lines)
+    assert os.listdir(tmp_path) == ["output.gz"]
+
+def test_writer_empty(tmp_path):
+
+    # Nothing written (i.e. one empty gzip member)
+    output_file = str(tmp_path / "output.gz")
+    with compression.Writer(output_file):
+        pass
+
+    with open(output_file, "rb") as handle:
+        assert handle.read() == compression.compress_block(b"")
+    with gzip.open(output_file) as handle:
+        assert handle.read() == b""
+
+def test_writer_abort(tmp_path):
+
+    # Outputs are only written on success
+    output_file = str(tmp_path / "output.gz")
+    try:
+        with compression.Writer(output_file) as handle:
+            handle.write(b"chr1\t0\t6\n")
+            raise ValueError
+    except ValueError:
+        pass
+
+    assert os.listdir(tmp_path) == []
+
+def test_bgzf_writer_empty(tmp_path):
+
+    # Nothing written (i.e. the EOF block only)
+    output_file = str(tmp_path / "output.tsv.gz")
+    with bgzf.Writer(output_file):
+        pass
+
+    with open(output_file, "rb") as handle:
+        assert handle.read() == bgzf.eof
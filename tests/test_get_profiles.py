@@ -0,0 +1,206 @@
+import hashlib
+import http.server
+import io
+import json
+import os
+import pytest
+import threading
+import zipfile
+
+from conftest import data_dir
+
+# Globals
+version = 2024
+
+#-------------#
+# Functions   #
+#-------------#
+
+def _get_profile(matrix_id, name, counts):
+
+    # i.e. in JASPAR format
+    rows = ["%s  [ %s ]" % (nt, " ".join(["%5s" % c for c in row])) \
+        for nt, row in zip("ACGT", counts)]
+
+    return(">%s\t%s\n%s\n" % (matrix_id, name, "\n".join(rows)))
+
+def _get_archive(profiles):
+
+    # i.e. a zip file of profiles in JASPAR format
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as z:
+        for file_name, profile in profiles.items():
+            z.writestr(file_name, profile)
+
+    return(data.getvalue())
+
+def _list_profiles(taxon_dir):
+    return(sorted(os.listdir(taxon_dir)))
+
+#-------------#
+# Classes     #
+#-------------#
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    # i.e. persistent connections
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+
+        # Initialize
+        self.server.requests.append((self.path,
+            self.headers.get("If-None-Match")))
+
+        if self.path not in self.server.archives:
+            self._send(404)
+            return
+
+        # Only send if changed (i.e. conditional request)
+        data = self.server.archives[self.path]
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, etag)
+        else:
+            self._send(200, etag, data)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, etag=None, data=b""):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+#-------------#
+# Fixtures    #
+#-------------#
+
+@pytest.fixture
+def server():
+
+    # Serve archives (i.e. on localhost)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.archives = {}
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield(server)
+
+    server.shutdown()
+    server.server_close()
+
+#-------------#
+# Tests       #
+#-------------#
+
+def test_get_profiles(get_profiles, server, tmp_path):
+
+    # Initialize
+    output_dir = str(tmp_path / "profiles")
+    url = "http://127.0.0.1:%s/download/data" % server.server_address[1]
+    with open(os.path.join(data_dir, "MA0004.1.jaspar")) as handle:
+        arnt = handle.read()
+    profiles = {
+        "MA0001.1.jaspar": _get_profile("MA0001.1", "AGL3",
+            [[0, 3, 79], [94, 75, 4], [1, 0, 3], [2, 19, 11]]),
+        "MA0004.1.jaspar": arnt,
+    }
+    paths = {}
+    for taxon in get_profiles.taxons:
+        file_name = "JASPAR%s_CORE_%s_redundant_pfms_jaspar.zip" % \
+            (version, taxon)
+        paths[taxon] = "/download/data/%s/CORE/%s" % (version, file_name)
+        server.archives[paths[taxon]] = _get_archive({})
+    server.archives[paths["vertebrates"]] = _get_archive(profiles)
+    taxon_dir = os.path.join(output_dir, "vertebrates")
+
+    def run():
+        archives = get_profiles.get_profiles(output_dir, version, url, 2)
+        profiles = get_profiles.read_profiles(output_dir, archives)
+        get_profiles.jaspar_to_pwm(profiles, output_dir)
+        get_profiles.get_names(profiles, output_dir)
+        get_profiles.get_catalog(profiles, output_dir)
+        return(archives)
+
+    # First download (i.e. every archive)
+    archives = run()
+    assert sorted(archives) == sorted(get_profiles.taxons)
+    assert archives["vertebrates"] == profiles
+    assert _list_profiles(taxon_dir) == ["MA0001.1.jaspar", "MA0001.1.pwm",
+        "MA0004.1.jaspar", "MA0004.1.pwm"]
+    with open(os.path.join(output_dir, "names.json")) as handle:
+        assert json.load(handle) == {"MA0001.1": "AGL3", "MA0004.1": "Arnt"}
+    with open(os.path.join(output_dir, get_profiles.downloads_file)) as handle:
+        downloads = json.load(handle)
+    assert len(downloads) == len(get_profiles.taxons)
+    assert all("etag" in entry and "sha256" in entry \
+        for entry in downloads.values())
+
+    # Unchanged archives (i.e. 304 Not Modified)
+    server.requests = []
+    mtimes = {f: os.path.getmtime(os.path.join(taxon_dir, f)) \
+        for f in os.listdir(taxon_dir)}
+    assert get_profiles.get_profiles(output_dir, version, url, 2) == {}
+    assert sorted(server.requests) == sorted([(paths[taxon],
+        downloads[os.path.basename(paths[taxon])]["etag"]) \
+        for taxon in get_profiles.taxons])
+    assert {f: os.path.getmtime(os.path.join(taxon_dir, f)) \
+        for f in os.listdir(taxon_dir)} == mtimes
+    assert os.path.exists(os.path.join(output_dir, "names.json"))
+    assert os.path.exists(os.path.join(output_dir, get_profiles.catalog_file))
+
+    # Changed archive (i.e. new, changed and removed profiles)
+    profiles = {
+        "MA0003.1.jaspar": _get_profile("MA0003.1", "TFAP2A",
+            [[0, 0, 0, 22], [1, 0, 0, 0], [0, 22, 23, 1], [22, 1, 0, 0]]),
+        "MA0004.1.jaspar": arnt.replace("Arnt", "ARNT"),
+    }
+    server.archives[paths["vertebrates"]] = _get_archive(profiles)
+    archives = run()
+    assert sorted(archives) == ["vertebrates"]
+    assert _list_profiles(taxon_dir) == ["MA0003.1.jaspar", "MA0003.1.pwm",
+        "MA0004.1.jaspar", "MA0004.1.pwm"]
+    for f, profile in profiles.items():
+        with open(os.path.join(taxon_dir, f)) as handle:
+            assert handle.read() == profile
+    with open(os.path.join(output_dir, "names.json")) as handle:
+        assert json.load(handle) == {"MA0003.1": "TFAP2A", "MA0004.1": "ARNT"}
+
+@pytest.mark.parametrize("profile", [
+    # i.e. with nucleotides and brackets
+    None,
+    # i.e. plain rows of counts
+    ">MA0001.1 AGL3\n0 3 79\n94 75 4\n1 0 3\n2 19 11\n",
+    # i.e. non-integer counts (and without a name)
+    ">MA0002.1\nA [ 0.5 12.25 3 ]\nC [ 7 0 0.75 ]\nG [ 1.5 2 9 ]\n" + \
+        "T [ 11 0.125 1 ]\n",
+    # i.e. many sites (and tabs)
+    ">MA0003.1\tTFAP2A\nA\t[\t0 1000 0 22 ]\nC\t[\t9000 0 22 1 ]\n" + \
+        "G\t[\t1 0 23 0 ]\nT\t[\t22 1 0 9000 ]\n",
+])
+def test_biopython(get_profiles, profile):
+
+    # Initialize
+    motifs = pytest.importorskip("Bio.motifs")
+    if profile is None:
+        with open(os.path.join(data_dir, "MA0004.1.jaspar")) as handle:
+            profile = handle.read()
+
+    # Parse profile (i.e. as Biopython does)
+    matrix_id, name, counts = get_profiles.parse_jaspar(profile)
+    m = motifs.read(io.StringIO(profile), "jaspar")
+    assert matrix_id == m.matrix_id
+    assert name == m.name
+    assert counts.tolist() == [[m.counts[nt][i] for nt in "ACGT"] \
+        for i in range(m.length)]
+
+    # Calculate PWM (i.e. as get-profiles.py did with Biopython)
+    m.pseudocounts = motifs.jaspar.calculate_pseudocounts(m)
+    assert get_profiles.calculate_pwm(counts).tolist() == \
+        [[round(m.pssm[nt][i] * 100) for nt in "ACGT"] \
+        for i in range(m.length)]
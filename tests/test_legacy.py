@@ -0,0 +1,364 @@
+import gzip
+import numpy as np
+import os
+import pytest
+import re
+import subprocess
+
+from conftest import which
+
+#-------------#
+# Functions   #
+#-------------#
+
+def _get_records(seed=0):
+
+    # Initialize
+    rng = np.random.default_rng(seed)
+
+    # i.e. soft-masked, with Us and non-nucleotides, and of sizes around the
+    # window size
+    records = {}
+    for i, size in enumerate([0, 1, 99, 100, 101, 150, 189, 190, 191, 1234]):
+        seq = "".join(rng.choice(list("ACGTacgtNUx"), size,
+            p=[.2, .2, .2, .2, .04, .04, .04, .04, .02, .01, .01]).tolist())
+        records["seq%s description %s" % (i, size)] = seq
+
+    return(records)
+
+def _clean(seq):
+
+    # i.e. uppercase, Us to Ts and non-nucleotides to Ns
+    seq = seq.upper().replace("U", "T")
+
+    return("".join([c if c in "ACGT" else "N" for c in seq]))
+
+def _write_fasta(fasta_file, records, width=60, newline="\n"):
+
+    # Initialize
+    lines = []
+
+    # i.e. in lines of {width} nucleotides
+    for header, seq in records.items():
+        lines.append(">%s" % header)
+        lines.extend([seq[i:i+width] for i in range(0, len(seq), width)])
+    data = "".join(["%s%s" % (l, newline) for l in lines]).encode()
+    if fasta_file.endswith(".gz"):
+        data = gzip.compress(data)
+    with open(fasta_file, "wb") as f:
+        f.write(data)
+
+def _stub_tools(functions, jaspar_search, monkeypatch):
+
+    # Initialize
+    calls = []
+
+    def get_sites(fasta_file, pattern):
+
+        # i.e. on the + strand, or on the - strand if reverse complemented
+        # (1-based)
+        for record, seq in functions.parse_fasta_file(fasta_file):
+            for m in re.finditer("(?=(%s))" % pattern, seq):
+                yield record, m.start() + 1, m.start() + 3, \
+                    "-" if m.group(1) == "CGT" else "+"
+
+    def stub_jaspar(matrix_file, fasta_file, thresh=0.75):
+        calls.append(fasta_file)
+        for record, start, end, strand in get_sites(fasta_file, "ACG|CGT"):
+            yield record, start, end, strand, .9 if strand == "+" else .85
+
+    def stub_fimo(meme_dir, meme_file, fasta_file, thresh=0.05):
+        yield "chrX:0", 1, 3, "+", .001
+        for record, start, end, strand in get_sites(fasta_file,
+            "ACG|CGT|GTA"):
+            yield record, start, end, strand, .001 if strand == "+" else .002
+
+    # i.e. instead of jaspar_search.pl and fimo
+    monkeypatch.setattr(jaspar_search, "jaspar_search", stub_jaspar)
+    monkeypatch.setattr(jaspar_search, "fimo_search", stub_fimo)
+
+    return(calls)
+
+def _scan(jaspar_search, fasta_file, output_dir, dummy_dir, batch_size):
+
+    # i.e. a motif of 3 nucleotides in windows of 100
+    os.makedirs(output_dir, exist_ok=True)
+    jaspar_search.scan_fasta_file(fasta_file, "MA0001.1", "MA0001.1.pfm",
+        "meme", "MA0001.1.meme", 3, batch_size, dummy_dir, output_dir,
+        window_size=100)
+
+def _read_scans(output_dir):
+
+    # Initialize
+    scans = {}
+
+    for file_name in sorted(os.listdir(output_dir)):
+        with gzip.open(os.path.join(output_dir, file_name), "rt") as f:
+            scans[file_name] = f.read()
+
+    return(scans)
+
+#-------------#
+# Tests       #
+#-------------#
+
+def test_writer(functions, tmp_path):
+
+    # Initialize
+    lines = ["%s\t%s" % (i, "ACGT" * (i % 7)) for i in range(1000)]
+    out_file = str(tmp_path / "lines.txt")
+
+    # Lines are buffered (i.e. until {buffer_size} characters)
+    with functions.Writer(out_file, buffer_size=100) as handle:
+        for line in lines:
+            handle.write(line)
+            assert 0 <= handle.buffered < 100
+            assert handle.buffered == sum(len(l) + 1 for l in handle.buffer)
+        assert len(handle.buffer) > 0
+    assert handle.handle is None and handle.buffer == []
+    handle.close()
+    with open(out_file) as f:
+        assert f.read() == "".join(["%s\n" % l for l in lines])
+
+    # i.e. as written line by line
+    write_file = str(tmp_path / "write.txt")
+    for line in lines:
+        functions.write(write_file, line)
+    with open(out_file, "rb") as a, open(write_file, "rb") as b:
+        assert a.read() == b.read()
+
+    # Lines are gzipped as they are written
+    gz_file = str(tmp_path / "lines.txt.gz")
+    with functions.Writer(gz_file, gz=True) as handle:
+        for line in lines:
+            handle.write(line)
+    with gzip.open(gz_file, "rt") as f:
+        assert f.read() == "".join(["%s\n" % l for l in lines])
+
+    # Nothing written (i.e. an empty file)
+    empty_file = str(tmp_path / "empty.txt")
+    functions.Writer(empty_file).close()
+    assert os.path.getsize(empty_file) == 0
+
+    with pytest.raises(ValueError, match="Could not open file"):
+        functions.Writer(str(tmp_path / "missing" / "lines.txt"))
+
+def test_writer_stdout(functions, capsys):
+
+    # Lines are written to stdout (i.e. left open)
+    with functions.Writer(buffer_size=10) as handle:
+        handle.write("chr1\t10")
+        assert capsys.readouterr().out == ""
+        handle.write("chr2\t20")
+    assert capsys.readouterr().out == "chr1\t10\nchr2\t20\n"
+    print("chr3")
+    assert capsys.readouterr().out == "chr3\n"
+
+@pytest.mark.parametrize("window_size,overlap", [(100, 0), (100, 10),
+    (100, 99), (7, 3)])
+def test_parse_fasta_windows(functions, tmp_path, window_size, overlap):
+
+    # Initialize
+    records = _get_records()
+    fasta_file = str(tmp_path / "sequences.fa.gz")
+    _write_fasta(fasta_file, records, width=47)
+
+    # Windows of each sequence (i.e. in order)
+    windows = {}
+    for header, offset, window in functions.parse_fasta_windows(fasta_file,
+        window_size, overlap, gz=True):
+        windows.setdefault(header, [])
+        windows[header].append((offset, window))
+    assert list(windows) == [h for h, seq in records.items() if len(seq) > 0]
+
+    for header, seq in records.items():
+
+        # Each window is of {window_size} nucleotides (except for the last
+        # one) and starts with the last {overlap} nucleotides of the previous
+        # one
+        seq = _clean(seq)
+        w = windows.get(header, [])
+        assert all(seq[o:o+len(x)] == x for o, x in w)
+        assert all(len(x) == window_size for o, x in w[:-1])
+        assert all(b[0] == a[0] + window_size - overlap for a, b in \
+            zip(w, w[1:]))
+
+        # Every motif of {overlap} + 1 nucleotides is in a window, and the
+        # last window is not fully overlapped (i.e. unless the only one)
+        assert "".join([x[:window_size - overlap] for o, x in w[:-1]] + \
+            [x for o, x in w[-1:]]) == seq
+        if len(w) > 1:
+            assert len(w[-1][1]) > overlap
+
+    # Last windows (i.e. by 100 nt windows, dropped if fully overlapped)
+    if (window_size, overlap) == (100, 10):
+        offsets = {h.split()[0]: [o for o, x in w] for h, w in windows.items()}
+        assert offsets["seq1"] == offsets["seq2"] == offsets["seq3"] == [0]
+        assert offsets["seq4"] == offsets["seq5"] == offsets["seq6"] == \
+            offsets["seq7"] == [0, 90]
+        assert offsets["seq8"] == [0, 90, 180]
+
+def test_parse_fasta_windows_invalid(functions, tmp_path):
+
+    # Initialize
+    fasta_file = str(tmp_path / "sequences.fa")
+    _write_fasta(fasta_file, _get_records())
+
+    for overlap in [-1, 100, 101]:
+        with pytest.raises(ValueError, match="Overlap"):
+            list(functions.parse_fasta_windows(fasta_file, 100, overlap))
+    with pytest.raises(ValueError, match="does not exist"):
+        list(functions.parse_fasta_windows(fasta_file + ".gz", 100))
+
+def test_parse_fasta_file(functions, tmp_path):
+
+    # Initialize
+    records = _get_records()
+    fasta_file = str(tmp_path / "sequences.fa")
+    _write_fasta(fasta_file, records)
+
+    # Every record, cleaned (i.e. including the last one)
+    assert list(functions.parse_fasta_file(fasta_file)) == \
+        [(h, _clean(seq)) for h, seq in records.items()]
+
+@pytest.mark.parametrize("width,newline", [(60, "\n"), (1, "\n"),
+    (50, "\r\n")])
+def test_fetch_fasta_sequence(functions, tmp_path, width, newline):
+
+    # Initialize
+    records = _get_records()
+    fasta_file = str(tmp_path / "sequences.fa")
+    _write_fasta(fasta_file, records, width, newline)
+    rng = np.random.default_rng(0)
+
+    # i.e. as samtools faidx (header up to the first space, length, offset,
+    # line bases and line width)
+    index = functions.index_fasta_file(fasta_file)
+    assert list(index) == [h.split()[0] for h in records]
+    with open(fasta_file, "rb") as f:
+        data = f.read()
+    for header, seq in records.items():
+        length, offset, line_bases, line_width = index[header.split()[0]]
+        assert length == len(seq)
+        assert data[offset-len(newline)-len(header)-1:offset] == \
+            (">%s%s" % (header, newline)).encode()
+        if len(seq) > 0:
+            assert line_bases == min(width, len(seq))
+            assert line_width == line_bases + len(newline)
+    assert functions.parse_fasta_index(fasta_file) == index
+
+    # Regions (i.e. by seeking, as slices of the sequence)
+    for header, seq in records.items():
+        header = header.split()[0]
+        seq = _clean(seq)
+        assert functions.fetch_fasta_sequence(fasta_file, header) == seq
+        for _ in range(20):
+            start = int(rng.integers(0, len(seq) + 1))
+            end = int(rng.integers(start, len(seq) + 10))
+            assert functions.fetch_fasta_sequence(fasta_file, header, start,
+                end, index) == seq[start:end]
+        assert functions.fetch_fasta_sequence(fasta_file, header, 10, 5) == ""
+
+    with pytest.raises(ValueError, match="not in FASTA file"):
+        functions.fetch_fasta_sequence(fasta_file, "seq", index=index)
+
+def test_fetch_fasta_sequence_invalid(functions, tmp_path):
+
+    # Lines of different lengths (i.e. within a sequence)
+    fasta_file = str(tmp_path / "sequences.fa")
+    with open(fasta_file, "w") as f:
+        f.write(">seq1\nACGT\nAC\nACGT\n")
+    with pytest.raises(ValueError, match="Lines of different lengths"):
+        functions.index_fasta_file(fasta_file)
+    with open(fasta_file, "w") as f:
+        f.write(">seq1\nACGT\nACGTA\n")
+    with pytest.raises(ValueError, match="Lines of different lengths"):
+        functions.index_fasta_file(fasta_file)
+
+    # Compressed FASTA (i.e. cannot be seeked)
+    gz_file = str(tmp_path / "sequences.fa.gz")
+    _write_fasta(gz_file, _get_records())
+    with pytest.raises(ValueError, match="uncompressed FASTA"):
+        functions.fetch_fasta_sequence(gz_file, "seq1")
+
+@pytest.mark.skipif(which("samtools") is None,
+    reason="samtools not installed")
+def test_samtools_faidx(functions, tmp_path):
+
+    # Initialize
+    fasta_file = str(tmp_path / "sequences.fa")
+    _write_fasta(fasta_file, {h: s for h, s in _get_records().items() \
+        if len(s) > 0})
+
+    # i.e. the same index as samtools faidx
+    functions.index_fasta_file(fasta_file)
+    with open("%s.fai" % fasta_file) as f:
+        fai = f.read()
+    os.remove("%s.fai" % fasta_file)
+    subprocess.run([which("samtools"), "faidx", fasta_file], check=True)
+    with open("%s.fai" % fasta_file) as f:
+        assert f.read() == fai
+
+def test_batch_search(functions, jaspar_search, monkeypatch, tmp_path):
+
+    # Initialize
+    calls = _stub_tools(functions, jaspar_search, monkeypatch)
+    records = _get_records()
+    fasta_file = str(tmp_path / "sequences.fa")
+    _write_fasta(fasta_file, records)
+    dummy_dir = str(tmp_path / "dummy")
+    os.makedirs(dummy_dir)
+
+    # Outputs (i.e. named after sequence identifiers) do not depend on the
+    # batch size (i.e. one tool call per batch)
+    scans = {}
+    for batch_size in [1, 2, 3, 1000]:
+        calls.clear()
+        output_dir = str(tmp_path / ("scans.%s" % batch_size))
+        _scan(jaspar_search, fasta_file, output_dir, dummy_dir, batch_size)
+        windows = list(functions.parse_fasta_windows(fasta_file, 100, 2))
+        assert len(calls) == -(-len(windows) // batch_size)
+        assert os.listdir(dummy_dir) == []
+        scans[batch_size] = _read_scans(output_dir)
+    assert scans[1] == scans[2] == scans[3] == scans[1000]
+    assert sorted(scans[1]) == sorted(["MA0001.1.%s.tab.gz" % h.split()[0] \
+        for h, seq in records.items() if len(seq) > 0])
+
+    # Matches of both tools (i.e. in sequence coordinates)
+    for header, seq in records.items():
+        if len(seq) == 0:
+            continue
+        sites = set()
+        for m in re.finditer("(?=(ACG|CGT))", _clean(seq)):
+            sites.add("%s\t%s" % (m.start() + 1,
+                "+\t900\t300" if m.group(1) == "ACG" else "-\t850\t269"))
+        scan = scans[1]["MA0001.1.%s.tab.gz" % header.split()[0]]
+        assert set(scan.splitlines()) == sites
+
+    # Existing outputs are skipped (i.e. only missing ones are scanned)
+    calls.clear()
+    output_dir = str(tmp_path / "scans.1")
+    os.remove(os.path.join(output_dir, "MA0001.1.seq9.tab.gz"))
+    _scan(jaspar_search, fasta_file, output_dir, dummy_dir, 1)
+    assert len(calls) == len([w for w in windows if w[0].startswith("seq9")])
+    assert _read_scans(output_dir) == scans[1]
+
+def test_duplicate_identifiers(functions, jaspar_search, monkeypatch,
+    tmp_path):
+
+    # Initialize
+    _stub_tools(functions, jaspar_search, monkeypatch)
+    dummy_dir = str(tmp_path / "dummy")
+    os.makedirs(dummy_dir)
+
+    # i.e. sequences with the same header up to the first space, one after
+    # the other or not
+    for i, headers in enumerate([["chr1 a", "chr2", "chr1 b"],
+        ["chr1", "chr1"]]):
+        fasta_file = str(tmp_path / ("sequences.%s.fa" % i))
+        with open(fasta_file, "w") as f:
+            for header in headers:
+                f.write(">%s\n%s\n" % (header, "ACGT" * 30))
+        with pytest.raises(ValueError, match="Duplicate sequence identifier"):
+            _scan(jaspar_search, fasta_file, str(tmp_path / ("scans.%s" % i)),
+                dummy_dir, 2)
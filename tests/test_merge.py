@@ -0,0 +1,165 @@
+import gzip
+import numpy as np
+import os
+import pytest
+
+from conftest import load_script
+import bgzf
+import merge
+
+# Globals
+chrom_sizes = {"chr1": 50000, "chr2": 40000, "chr3": 30000, "chrM": 16569}
+
+#-------------#
+# Functions   #
+#-------------#
+
+def _write_scans(scans_dir, chroms, n=3, index=False, seed=0):
+
+    # Initialize
+    rng = np.random.default_rng(seed)
+    lines = {}
+
+    # Sorted scan lines (i.e. as from scan-sequence.py), with chroms in the
+    # given order
+    for i in range(n):
+        matrix_id = "MA000%s.1" % (i + 1)
+        lines[matrix_id] = []
+        for chrom in chroms:
+            starts = np.sort(rng.integers(0, chrom_sizes[chrom] - 20, 500))
+            for start in starts.tolist():
+                lines[matrix_id].append(("%s\t%s\t%s\tTF%s\t%s\t%s\t%s\n" % \
+                    (chrom, start, start + 6 + i, i, rng.integers(0, 1001),
+                    rng.integers(0, 2000), "+-"[start % 2])).encode())
+        scan_file = os.path.join(scans_dir, "%s.tsv.gz" % matrix_id)
+        data = b"".join(lines[matrix_id])
+        if index:
+            with bgzf.Writer(scan_file) as handle:
+                handle.write(data)
+        else:
+            with open(scan_file, "wb") as handle:
+                handle.write(gzip.compress(data))
+
+    return(lines)
+
+def _merge(lines, chroms):
+
+    # Initialize
+    ranks = {chrom: i for i, chrom in enumerate(chroms)}
+    merged = []
+
+    # BED6+1 lines (i.e. sorted by chrom, start, then as by `LC_ALL=C sort`)
+    for matrix_id, scan_lines in lines.items():
+        for line in scan_lines:
+            chrom, start, end, name, _, pvalue, strand = \
+                line.decode().rstrip("\n").split("\t")
+            merged.append((ranks[chrom], int(start),
+                ("%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (chrom, start, end,
+                matrix_id, min(int(pvalue), merge.max_score), strand,
+                name)).encode()))
+
+    return(b"".join([line for _, _, line in sorted(merged)]))
+
+def _write_chrom_sizes(sizes_file, chroms):
+    with open(sizes_file, "w") as handle:
+        for chrom in chroms:
+            handle.write("%s\t%s\n" % (chrom, chrom_sizes[chrom]))
+
+#-------------#
+# Tests       #
+#-------------#
+
+def test_sort_chroms():
+
+    # i.e. in the order of chrom sizes, unless scans list them otherwise
+    assert merge.sort_chroms([["chr1", "chr3"], ["chr2"]],
+        chrom_sizes) == ["chr1", "chr2", "chr3"]
+    assert merge.sort_chroms([["chr3", "chr1"], ["chr2"]],
+        chrom_sizes) == ["chr2", "chr3", "chr1"]
+    assert merge.sort_chroms([["chr1", "chr2", "chr3"]],
+        ["chr3", "chr1", "chr2", "chrM"]) == ["chr1", "chr2", "chr3"]
+    assert merge.sort_chroms([], chrom_sizes) == []
+    with pytest.raises(ValueError, match="different orders"):
+        merge.sort_chroms([["chr1", "chr2"], ["chr2", "chr1"]], chrom_sizes)
+    with pytest.raises(ValueError, match="not in chrom sizes"):
+        merge.sort_chroms([["chr1", "chrX"]], chrom_sizes)
+
+@pytest.mark.parametrize("index", [False, True])
+@pytest.mark.parametrize("sizes", [
+    # i.e. as the scans
+    ["chr2", "chr1", "chr3", "chrM"],
+    # i.e. chr1 and chr2 out of the order of the scans
+    ["chr1", "chr2", "chr3", "chrM"],
+    ["chrM", "chr3", "chr1", "chr2"],
+])
+def test_out_of_order(index, sizes, tmp_path):
+
+    # Initialize
+    merge_scans = load_script("merge-scans.py")
+    scans_dir = str(tmp_path / "scans")
+    os.makedirs(scans_dir)
+    lines = _write_scans(scans_dir, ["chr2", "chr1", "chr3"], index=index)
+    sizes_file = str(tmp_path / "chrom.sizes")
+    _write_chrom_sizes(sizes_file, sizes)
+    scan_files = merge.get_scan_files(scans_dir)
+
+    # Chroms are listed in the order of each scan
+    assert [merge.get_chroms(f) for f in scan_files] == \
+        [["chr2", "chr1", "chr3"]] * len(scan_files)
+
+    # Scans listing chroms out of the order of chrom sizes are merged (i.e.
+    # with chroms in the order of the scans, and otherwise as chrom sizes)
+    chroms = merge.sort_chroms([merge.get_chroms(f) for f in scan_files],
+        merge.read_chrom_sizes(sizes_file))
+    assert chroms == ["chr2", "chr1", "chr3"]
+    bed_file = str(tmp_path / "merged.bed")
+    merge_scans.merge_scans(sizes_file, scans_dir, bed_file)
+    with open(bed_file, "rb") as handle:
+        assert handle.read() == _merge(lines, chroms)
+
+def test_not_sorted(tmp_path):
+
+    # Initialize
+    scan_file = str(tmp_path / "MA0001.1.tsv.gz")
+    with open(scan_file, "wb") as handle:
+        handle.write(gzip.compress(b"chr1\t5\t11\tTF\t900\t10\t+\n" + \
+            b"chr2\t5\t11\tTF\t900\t10\t+\n" + \
+            b"chr1\t7\t13\tTF\t900\t10\t+\n"))
+
+    # Chroms listed more than once (i.e. not sorted by chrom)
+    with pytest.raises(ValueError, match="not sorted by chrom"):
+        merge.get_chroms(scan_file)
+
+@pytest.mark.parametrize("index", [False, True])
+def test_threads(index, monkeypatch, tmp_path):
+
+    # Initialize
+    merge_scans = load_script("merge-scans.py")
+    scans_dir = str(tmp_path / "scans")
+    os.makedirs(scans_dir)
+    _write_scans(scans_dir, ["chr1", "chr2", "chr3"], index=index)
+    sizes_file = str(tmp_path / "chrom.sizes")
+    _write_chrom_sizes(sizes_file, chrom_sizes)
+    dummy_dir = str(tmp_path / "dummy")
+    os.makedirs(dummy_dir)
+    merge_by_chrom = merge_scans._merge_by_chrom
+    calls = []
+
+    def spy(*args, **kwargs):
+        calls.append(args)
+        return(merge_by_chrom(*args, **kwargs))
+
+    # A single thread (i.e. a single stream)
+    bb_file = str(tmp_path / "merged.bb")
+    merge_scans.merge_scans(sizes_file, scans_dir, bb_file, 1, dummy_dir)
+
+    # Tracks are assembled by chrom from indexed scans only (i.e. others are
+    # merged in a single stream, rather than decompressed into the dummy
+    # directory), and are the same either way
+    monkeypatch.setattr(merge_scans, "_merge_by_chrom", spy)
+    threads_file = str(tmp_path / "threads.bb")
+    merge_scans.merge_scans(sizes_file, scans_dir, threads_file, 4, dummy_dir)
+    assert len(calls) == (1 if index else 0)
+    assert os.listdir(dummy_dir) == []
+    with open(bb_file, "rb") as a, open(threads_file, "rb") as b:
+        assert a.read() == b.read()
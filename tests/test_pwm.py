@@ -0,0 +1,94 @@
+from itertools import product
+import numpy as np
+import os
+import pytest
+import subprocess
+import warnings
+
+from conftest import data_dir, which
+import pwm
+
+# Globals
+prob_file = os.path.join(data_dir, "MA0004.1.prob") # i.e. as from matrix_prob
+
+#-------------#
+# Functions   #
+#-------------#
+
+def _parse_matrix_prob(output):
+
+    # Initialize
+    rows = []
+
+    # i.e. score, p-value and relative score (as a percentage)
+    for line in output.decode().splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[2].endswith("%"):
+            rows.append(fields)
+
+    return(rows)
+
+def _format_distribution(scores, pvalues, percs):
+
+    # i.e. as printed by matrix_prob
+    return([[str(s), pwm.pvalue_format % p, pwm.perc_format % r + "%"] \
+        for s, p, r in zip(scores.tolist(), pvalues.tolist(), percs.tolist())])
+
+def test_score_distribution(pwm_file):
+
+    # Initialize
+    matrix = pwm.read_pwm(pwm_file)
+    counts = {}
+
+    # Enumerate every sequence (i.e. 4^6)
+    for seq in product(range(4), repeat=len(matrix)):
+        score = int(matrix[np.arange(len(matrix)), seq].sum())
+        counts[score] = counts.get(score, 0) + 1
+    total = sum(counts.values())
+    lo = matrix.min(axis=1).sum()
+    hi = matrix.max(axis=1).sum()
+
+    scores, pvalues, percs = pwm.score_distribution(matrix)
+    assert scores.tolist() == sorted(counts, reverse=True)
+    for score, pvalue, perc in zip(scores, pvalues, percs):
+        p = sum(c for s, c in counts.items() if s >= score) / total
+        assert pvalue == float(pwm.pvalue_format % p)
+        assert perc == float(pwm.perc_format % ((score - lo) * 100. / \
+            (hi - lo)))
+
+def test_score_distribution_constant():
+
+    # Every row is constant (i.e. a single achievable score)
+    matrix = np.array([[5, 5, 5, 5], [-3, -3, -3, -3]])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        scores, pvalues, percs = pwm.score_distribution(matrix)
+    assert scores.tolist() == [2]
+    assert pvalues.tolist() == [1.]
+    assert percs.tolist() == [100.]
+    assert pwm.get_cutoff(scores, pvalues, percs) == 2
+
+def test_score_distribution_reference(pwm_file):
+
+    # Scores, p-values and percentages are printed identically
+    with open(prob_file, "rb") as handle:
+        rows = _parse_matrix_prob(handle.read())
+    assert len(rows) > 0
+    assert _format_distribution(*pwm.score_distribution(
+        pwm.read_pwm(pwm_file))) == rows
+
+@pytest.mark.skipif(which("matrix_prob") is None,
+    reason="matrix_prob (PWMScan) not installed")
+def test_matrix_prob(pwm_file):
+
+    # Calculate distribution of PWM scores with matrix_prob
+    cmd = [which("matrix_prob"), pwm_file]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    rows = _parse_matrix_prob(output)
+
+    # i.e. as the reference distribution
+    with open(prob_file, "rb") as handle:
+        assert rows == _parse_matrix_prob(handle.read())
+    assert _format_distribution(*pwm.score_distribution(
+        pwm.read_pwm(pwm_file))) == rows
@@ -0,0 +1,224 @@
+import gzip
+import json
+import numpy as np
+import os
+import pytest
+import threading
+import urllib.error
+import urllib.request
+
+from conftest import load_script
+import columnar
+import query
+
+# Globals
+sizes = {"chr1": 40000, "chr2": 20000}
+profiles = {
+    "MA0001.1": ("AGL3", [[90, -60, -60, -60], [-60, 90, -60, -60],
+        [-60, -60, -60, 90], [-60, -60, 90, -60]]),
+}
+
+#-------------#
+# Functions   #
+#-------------#
+
+def _get_hits(output_dir):
+
+    # Initialize
+    hits = []
+
+    # i.e. as tuples of query.Index
+    for file_name in sorted(os.listdir(output_dir)):
+        if not file_name.endswith(".tsv.gz"):
+            continue
+        with gzip.open(os.path.join(output_dir, file_name), "rt") as handle:
+            for line in handle:
+                c, s, e, name, r, l, t = line.rstrip("\n").split("\t")
+                hits.append((c, int(s), int(e), file_name[:8], name, int(r),
+                    int(l), t))
+
+    return(hits)
+
+def _filter(hits, chrom, start, end, profile=set(), pthresh=None,
+    rthresh=None):
+
+    # Initialize
+    log_pvalue, rel_score = query.get_cutoffs(pthresh, rthresh)
+
+    # i.e. as by a linear scan, sorted by start and matrix ID
+    return(sorted([h for h in hits if h[0] == chrom and h[1] < end and \
+        h[2] > start and (len(profile) == 0 or h[3] in profile) and \
+        h[6] >= log_pvalue and h[5] >= rel_score],
+        key=lambda x: (x[1], x[3], x[2], x[7])))
+
+@pytest.fixture
+def scans(scan_sequence, profiles_dir, tmp_path):
+
+    # Initialize
+    rng = np.random.default_rng(0)
+    fasta_file = str(tmp_path / "random.fa")
+    with open(fasta_file, "w") as handle:
+        for chrom, size in sizes.items():
+            seq = "".join(rng.choice(list("ACGT"), size).tolist())
+            handle.write(">%s\n" % chrom)
+            for i in range(0, size, 60):
+                handle.write("%s\n" % seq[i:i+60])
+    with open(os.path.join(profiles_dir, "names.json")) as handle:
+        names = json.load(handle)
+    for matrix_id, (name, rows) in profiles.items():
+        with open(os.path.join(profiles_dir, "vertebrates",
+            "%s.pwm" % matrix_id), "w") as handle:
+            for row in rows:
+                handle.write("%s\n" % "".join(["%7s" % v for v in row]))
+        names[matrix_id] = name
+    with open(os.path.join(profiles_dir, "names.json"), "w") as handle:
+        json.dump(names, handle)
+
+    # Scan (i.e. BGZF outputs and a columnar container of the same hits)
+    kwargs = {"engine": "numpy", "pthresh": .5, "rthresh": .5,
+        "taxon": ["vertebrates"]}
+    bgzf_dir = str(tmp_path / "bgzf")
+    scan_sequence.scan_sequence(fasta_file, profiles_dir, str(tmp_path),
+        bgzf_dir, index=True, stream=True, **kwargs)
+    columnar_dir = str(tmp_path / "columnar")
+    scan_sequence.scan_sequence(fasta_file, profiles_dir, str(tmp_path),
+        columnar_dir, format="columnar", **kwargs)
+
+    return({"bgzf": bgzf_dir, "columnar": os.path.join(columnar_dir,
+        scan_sequence.hits_file), "hits": _get_hits(bgzf_dir)})
+
+#-------------#
+# Tests       #
+#-------------#
+
+def test_parse_region():
+
+    # i.e. chrom, or chrom:start-end (with thousands separators)
+    assert query.parse_region("chr1") == ("chr1", 0, np.iinfo(np.int64).max)
+    assert query.parse_region("chr1:1,000-2,500") == ("chr1", 1000, 2500)
+    assert query.parse_region(" chrUn_KI270302v1:0-10\n") == \
+        ("chrUn_KI270302v1", 0, 10)
+    for region in ["", "chr1:", "chr1:10", "chr1:a-b", "chr1:1-2-3",
+        "chr 1:1-2"]:
+        with pytest.raises(ValueError, match="Invalid region"):
+            query.parse_region(region)
+
+@pytest.mark.parametrize("format", ["bgzf", "columnar"])
+def test_query(scans, format):
+
+    # Initialize
+    hits = scans["hits"]
+    rng = np.random.default_rng(0)
+    assert len(set(h[3] for h in hits)) == 2
+
+    with query.Index(scans[format]) as index:
+
+        # Hits of regions, profiles and thresholds (i.e. as by a linear
+        # scan), including regions past the end and unknown chroms
+        regions = [("chr1", 0, 1), ("chr1", 0, 50000), ("chr2", 19990,
+            20010), ("chr1", 5000, 5000), ("chrX", 0, 100)]
+        for _ in range(20):
+            chrom = str(rng.choice(list(sizes)))
+            start = int(rng.integers(0, sizes[chrom]))
+            regions.append((chrom, start, start + int(rng.integers(1, 5000))))
+        for region in regions:
+            for profile in [set(), {"MA0001.1"}, {"MA0004.1", "MA0009.1"}]:
+                for pthresh, rthresh in [(None, None), (.01, None),
+                    (None, .9), (.1, .8)]:
+                    assert index.query(*region, profile, pthresh, rthresh) \
+                        == _filter(hits, *region, profile, pthresh, rthresh)
+
+        # Whole chroms (i.e. as parsed)
+        assert index.query(*query.parse_region("chr2")) == \
+            _filter(hits, "chr2", 0, sizes["chr2"])
+
+@pytest.mark.parametrize("format", ["bgzf", "columnar"])
+def test_cache(scans, format, monkeypatch):
+
+    # Initialize
+    decoded = []
+    decode_lines = query.decode_lines
+    decode_chunk = columnar.decode_chunk
+
+    def spy_lines(data):
+        decoded.append(data)
+        return(decode_lines(data))
+
+    def spy_chunk(buffer, chunk):
+        decoded.append(int(chunk["offset"]))
+        return(decode_chunk(buffer, chunk))
+
+    monkeypatch.setattr(query, "decode_lines", spy_lines)
+    monkeypatch.setattr(columnar, "decode_chunk", spy_chunk)
+
+    with query.Index(scans[format], cache_size=2) as index:
+
+        # Decoded blocks are reused (i.e. one block per profile)
+        hits = index.query("chr1", 100, 200)
+        assert len(decoded) == 2 and len(index.cache) == 2
+        assert index.query("chr1", 100, 200) == hits
+        assert len(decoded) == 2
+
+        # Least recently used blocks are evicted first
+        keys = list(index.cache)
+        index.query("chr2", 0, 100)
+        assert len(index.cache) == 2
+        assert not any(key in index.cache for key in keys)
+        decoded.clear()
+        assert index.query("chr1", 100, 200) == hits
+        assert len(decoded) == 2
+        assert list(index.cache) == keys
+
+def test_serve(scans):
+
+    # Initialize
+    query_hits = load_script("query-hits.py")
+    hits = scans["hits"]
+
+    with query.Index(scans["bgzf"]) as index:
+
+        # Serve queries (i.e. on localhost)
+        server = query_hits.ThreadingHTTPServer(("127.0.0.1", 0),
+            query_hits._get_handler(index))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = "http://127.0.0.1:%s" % server.server_address[1]
+
+        def get(path):
+            with urllib.request.urlopen(url + path) as response:
+                return(response.headers["Content-Type"],
+                    response.read().decode())
+
+        try:
+
+            # Hits of several regions (i.e. as JSON)
+            content_type, data = get("/query?region=chr1:0-2,000" + \
+                "&region=chr2:100-900&profile=MA0001.1,MA0004.1" + \
+                "&pthresh=0.1&format=json")
+            assert content_type == "application/json"
+            profile = {"MA0001.1", "MA0004.1"}
+            expected = _filter(hits, "chr1", 0, 2000, profile, .1) + \
+                _filter(hits, "chr2", 100, 900, profile, .1)
+            assert len(expected) > 0
+            assert json.loads(data) == [dict(zip(query_hits.header, h)) \
+                for h in expected]
+
+            # Hits as TSV (i.e. with a header)
+            content_type, data = get("/query?region=chr2:0-500&rthresh=0.9")
+            assert content_type == "text/tab-separated-values"
+            lines = data.splitlines()
+            assert lines[0] == "#%s" % "\t".join(query_hits.header)
+            assert lines[1:] == ["\t".join(map(str, h)) for h in \
+                _filter(hits, "chr2", 0, 500, rthresh=.9)]
+
+            # Invalid paths and parameters
+            for path, status in [("/hits?region=chr1", 404),
+                ("/query?region=chr1:10", 400), ("/query?region=chr1" + \
+                "&pthresh=x", 400)]:
+                with pytest.raises(urllib.error.HTTPError) as e:
+                    get(path)
+                assert e.value.code == status
+
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,627 @@
+import gzip
+import io
+import json
+import numpy as np
+import os
+import pytest
+import struct
+import subprocess
+import tempfile
+
+from conftest import load_script, which
+import bgzf
+import bigbed
+import columnar
+import genome
+import pwm
+
+# Globals
+complement = {"A": "T", "C": "G", "G": "C", "T": "A"}
+cutoffs = [
+    1036, # i.e. the consensus (CACGTG) only
+    600, # i.e. windows with an N
+    -1251 # i.e. every window (including runs of Ns)
+]
+profiles = {
+    # i.e. shorter than MA0004.1 (scanned in its own stack)
+    "MA0001.1": ("AGL3", [[90, -60, -60, -60], [-60, 90, -60, -60],
+        [-60, -60, -60, 90], [-60, -60, 90, -60]]),
+    # i.e. as long as MA0004.1 (scanned in the same stack)
+    "MA0002.1": ("RUNX1", [[-245, -245, 179, -245], [-245, -245, -245, 179],
+        [-245, -245, 179, -245], [-245, 179, -245, -245],
+        [172, -245, -153, -245], [-26, 148, -245, -245]]),
+}
+
+#-------------#
+# Functions   #
+#-------------#
+
+def _read_fasta(fasta_file, upper=True):
+
+    # Initialize
+    sequences = []
+
+    # i.e. soft-masked sequence in upper case (unless {upper} is False)
+    with open(fasta_file) as handle:
+        for line in handle:
+            if line.startswith(">"):
+                sequences.append((line[1:].split()[0], []))
+            elif upper:
+                sequences[-1][1].append(line.strip().upper())
+            else:
+                sequences[-1][1].append(line.strip())
+
+    return([(chrom, "".join(seq)) for chrom, seq in sequences])
+
+def _score(matrix, window):
+
+    # Ns score the lowest score of each position
+    return(sum(row[nt] if nt in row else min(row.values()) \
+        for row, nt in zip(matrix, window)))
+
+def _reference_scan(pwm_file, fasta_file, cutoff):
+
+    # Initialize
+    hits = []
+    rows = [dict(zip("ACGT", row)) for row in pwm.read_pwm(pwm_file).tolist()]
+    length = len(rows)
+
+    # Score both strands of every window (i.e. up to the chromosome end)
+    for chrom, seq in _read_fasta(fasta_file):
+        for s in range(len(seq) - length + 1):
+            window = seq[s:s+length]
+            rc = "".join([complement.get(nt, nt) for nt in window[::-1]])
+            for strand, w in zip("+-", [window, rc]):
+                score = _score(rows, w)
+                if score >= cutoff:
+                    hits.append((chrom, s, s + length, score, strand))
+
+    return(sorted(hits))
+
+def _numpy_scan(scan_sequence, pwm_file, fasta_file, cutoff, tmp_path):
+
+    # Initialize
+    handle = io.BytesIO()
+    chroms = genome.encode_genome(fasta_file, str(tmp_path), "genome")
+    genome.index_gaps(fasta_file)
+
+    # Scan (i.e. with the NumPy engine)
+    scan_sequence._numpy_scan(pwm_file, chroms, cutoff, handle, fasta_file)
+
+    return(_parse_hits(handle.getvalue()))
+
+def _check_empty(gz_file):
+
+    # i.e. {gzip.open} reads 0-byte files, unlike `gzip -t` or `zcat`
+    with open(gz_file, "rb") as handle:
+        assert handle.read(2) == b"\x1f\x8b"
+    with gzip.open(gz_file) as handle:
+        assert handle.read() == b""
+
+def _parse_hits(output):
+
+    # Initialize
+    hits = []
+
+    # i.e. chrom, start, end, name (or sequence), score and strand
+    for line in output.decode().splitlines():
+        f = line.split()
+        hits.append((f[0], int(f[1]), int(f[2]), int(f[4]), f[5]))
+
+    return(sorted(hits))
+
+def _add_profiles(profiles_dir):
+
+    # Write PWMs and names (i.e. as from `get-profiles.py`)
+    with open(os.path.join(profiles_dir, "names.json")) as handle:
+        names = json.load(handle)
+    for matrix_id, (name, rows) in profiles.items():
+        with open(os.path.join(profiles_dir, "vertebrates",
+            "%s.pwm" % matrix_id), "w") as handle:
+            for row in rows:
+                handle.write("%s\n" % "".join(["%7s" % v for v in row]))
+        names[matrix_id] = name
+    with open(os.path.join(profiles_dir, "names.json"), "w") as handle:
+        json.dump(names, handle)
+
+def _scan(scan_sequence, fasta_file, profiles_dir, output_dir, dummy_dir,
+    **params):
+
+    # Scan with permissive thresholds (i.e. many hits per profile)
+    kwargs = {"engine": "numpy", "pthresh": .5, "rthresh": .5,
+        "taxon": ["vertebrates"]}
+    kwargs.update(params)
+    scan_sequence.scan_sequence(fasta_file, profiles_dir, dummy_dir,
+        output_dir, **kwargs)
+
+    return(_read_outputs(output_dir))
+
+def _write_random_genome(fasta_file, sizes, seed=0):
+
+    # Initialize
+    rng = np.random.default_rng(seed)
+
+    # i.e. 60 bases per line
+    with open(fasta_file, "w") as handle:
+        for chrom, size in sizes.items():
+            seq = "".join(rng.choice(list("ACGT"), size).tolist())
+            handle.write(">%s\n" % chrom)
+            for i in range(0, size, 60):
+                handle.write("%s\n" % seq[i:i+60])
+
+def _write_twobit(twobit_file, fasta_file):
+
+    # Initialize
+    sequences = _read_fasta(fasta_file, upper=False)
+    offset = 16 + sum(1 + len(chrom) + 4 for chrom, _ in sequences)
+    records = []
+
+    # For each sequence...
+    for chrom, seq in sequences:
+
+        # N blocks and soft-masked blocks (i.e. as runs)
+        blocks = []
+        for mask in [[nt in "Nn" for nt in seq], [nt.islower() for nt in seq]]:
+            runs = []
+            for i, m in enumerate(mask):
+                if m and (i == 0 or not mask[i - 1]):
+                    runs.append([i, 0])
+                if m:
+                    runs[-1][1] += 1
+            blocks.append(struct.pack("<I", len(runs)) + \
+                b"".join([struct.pack("<I", s) for s, _ in runs]) + \
+                b"".join([struct.pack("<I", n) for _, n in runs]))
+
+        # Packed bases (i.e. four per byte, T=0, C=1, A=2 and G=3; Ns as Ts)
+        codes = ["TCAG".find(nt) % 4 for nt in seq.upper()]
+        codes += [0] * (-len(codes) % 4)
+        dna = bytes([(a << 6) | (b << 4) | (c << 2) | d for a, b, c, d in \
+            zip(*[iter(codes)] * 4)])
+        records.append(struct.pack("<I", len(seq)) + blocks[0] + blocks[1] + \
+            struct.pack("<I", 0) + dna)
+
+    # Header, index and sequence records
+    with open(twobit_file, "wb") as handle:
+        handle.write(struct.pack("<IIII", genome.twobit_magic, 0,
+            len(sequences), 0))
+        for (chrom, _), record in zip(sequences, records):
+            handle.write(struct.pack("<B", len(chrom)) + chrom.encode() + \
+                struct.pack("<I", offset))
+            offset += len(record)
+        for record in records:
+            handle.write(record)
+
+def _write_bgzf_fasta(bgzf_file, fasta_file, size=100):
+
+    # i.e. small blocks, so that lines and sequences span blocks
+    with open(fasta_file, "rb") as handle:
+        data = handle.read()
+    with open(bgzf_file, "wb") as handle:
+        for i in range(0, len(data), size):
+            handle.write(bgzf.compress_block(data[i:i+size]))
+        handle.write(bgzf.eof)
+
+def _read_outputs(output_dir):
+
+    # Initialize
+    outputs = {}
+
+    # i.e. decompressed outputs of each profile
+    for file_name in sorted(os.listdir(output_dir)):
+        if file_name.endswith(".tsv.gz"):
+            with gzip.open(os.path.join(output_dir, file_name)) as handle:
+                outputs[file_name] = handle.read()
+
+    return(outputs)
+
+@pytest.mark.parametrize("cutoff", cutoffs)
+def test_numpy_engine(scan_sequence, pwm_file, fasta_file, cutoff, tmp_path):
+
+    hits = _numpy_scan(scan_sequence, pwm_file, fasta_file, cutoff, tmp_path)
+    assert hits == _reference_scan(pwm_file, fasta_file, cutoff)
+
+def test_numpy_engine_ns(scan_sequence, pwm_file, fasta_file, tmp_path):
+
+    hits = _numpy_scan(scan_sequence, pwm_file, fasta_file, 600, tmp_path)
+
+    # Windows with an N (i.e. CACGTN, CACGNG and NACGTG)
+    assert ("chr1", 76, 82, 612, "+") in hits
+    assert ("chr1", 122, 128, 612, "+") in hits
+    assert ("chr1", 224, 230, 643, "+") in hits
+
+    # Soft-masked windows and windows at the chromosome ends (i.e. CACGTG is
+    # palindromic)
+    for start in [0, 178, 311]:
+        for strand in "+-":
+            assert ("chr1", start, start + 6, 1036, strand) in hits
+    assert ("chr3", 65, 71, 1036, "+") in hits
+
+    # Sequences shorter than the motif
+    assert not any(h[0] == "chr2" for h in hits)
+
+@pytest.mark.skipif(which("matrix_scan") is None,
+    reason="matrix_scan (PWMScan) not installed")
+@pytest.mark.parametrize("cutoff", cutoffs)
+def test_numpy_engine_matrix_scan(scan_sequence, pwm_file, fasta_file, cutoff,
+    tmp_path):
+
+    # Scan with matrix_scan (i.e. the PWMScan engine)
+    cmd = [which("matrix_scan"), "-m", pwm_file, "-c", str(cutoff), fasta_file]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+
+    hits = _numpy_scan(scan_sequence, pwm_file, fasta_file, cutoff, tmp_path)
+    assert hits == _parse_hits(output)
+
+@pytest.mark.parametrize("params", [
+    {"window_size": 100},
+    {"window_size": 100, "index": True},
+    {"stream": True},
+    {"stream": True, "threshold": [(.01, .9)]},
+    {"stream": True, "index": True, "threshold": [(.01, .9)]},
+])
+def test_no_hits(scan_sequence, profiles_dir, params, tmp_path):
+
+    # Scan a sequence without hits
+    fasta_file = str(tmp_path / "genome.fa")
+    with open(fasta_file, "w") as handle:
+        handle.write(">chr1\n%s\n" % ("A" * 250))
+    output_dir = str(tmp_path / "scans")
+    scan_sequence.scan_sequence(fasta_file, profiles_dir, str(tmp_path),
+        output_dir, engine="numpy", taxon=["vertebrates"], **params)
+
+    # Outputs are valid (i.e. empty) gzip files
+    _check_empty(os.path.join(output_dir, "MA0004.1.tsv.gz"))
+    for p, r in params.get("threshold", []):
+        _check_empty(os.path.join(scan_sequence._get_threshold_dir(output_dir,
+            p, r), "MA0004.1.tsv.gz"))
+
+@pytest.mark.parametrize("params", [{}, {"index": True}])
+def test_genome_major(scan_sequence, fasta_file, profiles_dir, params,
+    tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+
+    # Scanning each chrom once with all profiles writes the same outputs as
+    # scanning each profile in turn
+    outputs = _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "profile-major"), str(tmp_path), stream=True, **params)
+    assert len(outputs) == 3 and all(len(o) > 0 for o in outputs.values())
+    assert _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "genome-major"), str(tmp_path), genome_major=True,
+        **params) == outputs
+
+@pytest.mark.parametrize("params", [{}, {"index": True}])
+@pytest.mark.parametrize("window_size", [50, 64, 1000])
+def test_windows(scan_sequence, fasta_file, profiles_dir, params, window_size,
+    tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+
+    # Windows (i.e. overlapping by the motif length - 1, including hits
+    # across window boundaries) are stitched into the same outputs as
+    # scans of whole chroms
+    outputs = _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "whole"), str(tmp_path), stream=True, **params)
+    assert _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "windows"), str(tmp_path), window_size=window_size,
+        threads=2, **params) == outputs
+
+def test_score_table_cache(scan_sequence, pwm_file, tmp_path):
+
+    # Initialize
+    cache_dir = str(tmp_path / "cache")
+    scores, rel_scores, log_pvalues = pwm.score_table(
+        *pwm.score_distribution(pwm.read_pwm(pwm_file)))
+
+    # Score tables are returned as arrays (i.e. indexed by PWM score - lowest
+    # score), whether calculated or loaded from the cache
+    for _ in range(2):
+        cutoff, (offset, r, l) = scan_sequence._get_score_table(pwm_file,
+            cache_dir=cache_dir)
+        assert offset == scores.min()
+        assert r[scores - offset].tolist() == rel_scores.tolist()
+        assert l[scores - offset].tolist() == log_pvalues.tolist()
+        assert len(os.listdir(cache_dir)) > 0
+
+    # Nothing else is written (i.e. no score tables in text format)
+    assert os.listdir(tmp_path) == ["cache"]
+
+def test_stream(scan_sequence, fasta_file, profiles_dir, tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+
+    # Scores joined in-process (i.e. from arrays) are those joined by awk
+    outputs = _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "awk"), str(tmp_path))
+    assert len(outputs) == 3 and all(len(o) > 0 for o in outputs.values())
+    assert _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "stream"), str(tmp_path), stream=True) == outputs
+
+@pytest.mark.parametrize("params", [{"stream": True},
+    {"window_size": 15000}, {"genome_major": True}])
+def test_bgzf_query(scan_sequence, profiles_dir, params, tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+    fasta_file = str(tmp_path / "random.fa")
+    _write_random_genome(fasta_file, {"chr1": 40000, "chr2": 20000})
+    output_dir = str(tmp_path / "scans")
+    outputs = _scan(scan_sequence, fasta_file, profiles_dir, output_dir,
+        str(tmp_path), index=True, **params)
+    rng = np.random.default_rng(0)
+    assert max(len(o) for o in outputs.values()) > 2 * bgzf.block_size
+
+    # For each output...
+    for file_name, output in outputs.items():
+
+        # Initialize
+        scan_file = os.path.join(output_dir, file_name)
+        index = bgzf.read_index(scan_file)
+        lines = [l.split("\t") for l in output.decode().splitlines()]
+        coords = [(f[0], int(f[1]), int(f[2])) for f in lines]
+
+        # Hits overlapping each region (i.e. as by a linear scan), including
+        # empty regions, regions past the end and chroms without hits
+        regions = [("chr1", 0, 1), ("chr1", 0, 50000), ("chr2", 20000, 20010),
+            ("chr1", 5000, 5000), ("chrX", 0, 100)]
+        for _ in range(20):
+            start = int(rng.integers(0, 40000))
+            regions.append(("chr1", start, start + int(rng.integers(1,
+                10000))))
+        for chrom, start, end in regions:
+            hits = [f for f, (c, s, e) in zip(lines, coords) if c == chrom \
+                and s < end and e > start]
+            assert list(bgzf.query(scan_file, chrom, start, end)) == hits
+            assert list(bgzf.query(scan_file, chrom, start, end, index)) == \
+                hits
+
+def test_columnar(scan_sequence, profiles_dir, monkeypatch, tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+    fasta_file = str(tmp_path / "random.fa")
+    _write_random_genome(fasta_file, {"chr1": 30000, "chr2": 100,
+        "chr3": 20000})
+    chrom_sizes = str(tmp_path / "random.fa.sizes")
+    with open(chrom_sizes, "w") as handle:
+        for chrom, size in [("chr3", 20000), ("chr1", 30000), ("chr2", 100),
+            ("chrM", 16569)]:
+            handle.write("%s\t%s\n" % (chrom, size))
+    tsv_dir = str(tmp_path / "tsv")
+    outputs = _scan(scan_sequence, fasta_file, profiles_dir, tsv_dir,
+        str(tmp_path), stream=True)
+
+    # Chunks are capped (i.e. regardless of work units)
+    monkeypatch.setattr(columnar, "max_chunk", 500)
+    hits_file = os.path.join(str(tmp_path / "columnar"),
+        scan_sequence.hits_file)
+    _scan(scan_sequence, fasta_file, profiles_dir, str(tmp_path / "columnar"),
+        str(tmp_path), format="columnar", threads=2)
+    with columnar.Reader(hits_file) as reader:
+        assert reader.chunks["n"].max() <= 500
+        assert len(reader.chunks) > 3 * len(outputs)
+
+    # Exported TSV files are the outputs of a scan
+    export_hits = load_script("export-hits.py")
+    export_hits.export_hits(hits_file, str(tmp_path / "export"))
+    assert _read_outputs(str(tmp_path / "export")) == outputs
+
+    # Exported BED files are the output of merge-scans.py, byte for byte
+    # (i.e. ties as by `LC_ALL=C sort`), with chroms in the order of chrom
+    # sizes, except where the genome lists them otherwise (i.e. here, as by
+    # default, in the order of the genome)
+    merge_scans = load_script("merge-scans.py")
+    bed_file = str(tmp_path / "merged.bed")
+    merge_scans.merge_scans(chrom_sizes, tsv_dir, bed_file)
+    with open(bed_file, "rb") as handle:
+        merged = handle.read()
+    for sizes in [chrom_sizes, None]:
+        export_file = str(tmp_path / "export.bed")
+        export_hits.export_hits(hits_file, export_file, bed=True,
+            chrom_sizes=sizes)
+        with open(export_file, "rb") as handle:
+            assert handle.read() == merged
+
+@pytest.mark.parametrize("params", [{}, {"index": True}])
+def test_resume(scan_sequence, fasta_file, profiles_dir, params, monkeypatch,
+    tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+    outputs = _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "whole"), str(tmp_path), stream=True, **params)
+    output_dir = str(tmp_path / "windows")
+    part_dir = os.path.join(output_dir, scan_sequence.parts_dir)
+    stitch_parts = scan_sequence._stitch_parts
+    stitched = {}
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("crash")
+
+    def stitch(part_files, *args, **kwargs):
+        for part_file in part_files:
+            stat = os.stat(part_file)
+            stitched[os.path.basename(part_file)] = (stat.st_ino,
+                stat.st_mtime_ns, stat.st_size)
+        return(stitch_parts(part_files, *args, **kwargs))
+
+    # Crash (i.e. before stitching the work units of any profile)
+    monkeypatch.setattr(scan_sequence, "_stitch_parts", crash)
+    with pytest.raises(RuntimeError):
+        _scan(scan_sequence, fasta_file, profiles_dir, output_dir,
+            str(tmp_path), window_size=50, **params)
+    part_files = sorted([f for f in os.listdir(part_dir) \
+        if os.path.getsize(os.path.join(part_dir, f)) > 0])
+    assert len(part_files) > 2
+
+    # Remove a work unit and truncate another (i.e. partly written)
+    os.remove(os.path.join(part_dir, part_files[0]))
+    with open(os.path.join(part_dir, part_files[1]), "r+b") as handle:
+        size = os.path.getsize(handle.name)
+        handle.truncate(size // 2)
+    stats = {}
+    for part_file in part_files[2:]:
+        stat = os.stat(os.path.join(part_dir, part_file))
+        stats[part_file] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    # Resuming rescans the missing and truncated work units only, and
+    # writes the same outputs as an uninterrupted scan
+    monkeypatch.setattr(scan_sequence, "_stitch_parts", stitch)
+    assert _scan(scan_sequence, fasta_file, profiles_dir, output_dir,
+        str(tmp_path), window_size=50, **params) == outputs
+    assert all(stitched[f] == s for f, s in stats.items())
+    assert part_files[0] in stitched
+    assert stitched[part_files[1]][2] == size
+    assert not os.path.exists(part_dir)
+
+@pytest.mark.parametrize("params", [{"stream": True}, {"index": True}])
+def test_reuse(scan_sequence, fasta_file, profiles_dir, params, tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+    previous_dir = str(tmp_path / "previous")
+    _scan(scan_sequence, fasta_file, profiles_dir, previous_dir,
+        str(tmp_path), **params)
+
+    # Change a profile (i.e. a new version of the same PWM file)
+    pwm_file = os.path.join(profiles_dir, "vertebrates", "MA0002.1.pwm")
+    with open(pwm_file) as handle:
+        rows = handle.read().splitlines()
+    with open(pwm_file, "w") as handle:
+        handle.write("%s\n" % "\n".join(rows[::-1]))
+    outputs = _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "scans"), str(tmp_path), **params)
+    assert outputs["MA0002.1.tsv.gz"] != \
+        _read_outputs(previous_dir)["MA0002.1.tsv.gz"]
+
+    # Unchanged outputs are hard-linked, changed ones rescanned
+    output_dir = str(tmp_path / "reused")
+    assert _scan(scan_sequence, fasta_file, profiles_dir, output_dir,
+        str(tmp_path), reuse_dir=previous_dir, **params) == outputs
+    for file_name in outputs:
+        a = os.stat(os.path.join(previous_dir, file_name))
+        b = os.stat(os.path.join(output_dir, file_name))
+        assert (a.st_ino == b.st_ino) == (file_name != "MA0002.1.tsv.gz")
+
+@pytest.mark.parametrize("params", [{"stream": True}, {"index": True},
+    {"window_size": 50, "threads": 2}, {"genome_major": True},
+    {"genome_major": True, "skip_masked": True}])
+def test_genome_formats(scan_sequence, fasta_file, profiles_dir, params,
+    tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+    twobit_file = str(tmp_path / "genome.2bit")
+    _write_twobit(twobit_file, fasta_file)
+    bgzf_file = str(tmp_path / "genome.fa.gz")
+    _write_bgzf_fasta(bgzf_file, fasta_file)
+    assert genome.get_format(twobit_file) == "2bit"
+    assert genome.get_format(bgzf_file) == "bgzf"
+
+    # Sequences are decoded as from FASTA files (i.e. Ns, in full or in part)
+    sequences = dict(genome.parse_genome(fasta_file))
+    for genome_file in [twobit_file, bgzf_file]:
+        for chrom, seq_file in genome.index_genome(genome_file):
+            sequence = sequences.pop(chrom) if genome_file == bgzf_file \
+                else sequences[chrom]
+            assert genome.load(seq_file).tolist() == sequence.tolist()
+            assert genome.load(seq_file, 5, 70).tolist() == \
+                sequence[5:70].tolist()
+    assert sequences == {}
+
+    # Scanning 2bit and BGZF FASTA files writes the same outputs as scanning
+    # FASTA files (i.e. including gaps and soft-masked sequence)
+    outputs = _scan(scan_sequence, fasta_file, profiles_dir,
+        str(tmp_path / "fasta"), str(tmp_path), **params)
+    assert len(outputs) == 3 and all(len(o) > 0 for o in outputs.values())
+    for genome_file in [twobit_file, bgzf_file]:
+        output_dir = str(tmp_path / genome.get_format(genome_file))
+        assert _scan(scan_sequence, genome_file, profiles_dir, output_dir,
+            str(tmp_path), **params) == outputs
+
+def test_read_only_genome(scan_sequence, fasta_file, profiles_dir,
+    monkeypatch, tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+    bgzf_file = str(tmp_path / "genome.fa.gz")
+    _write_bgzf_fasta(bgzf_file, fasta_file)
+    genome_dir = tmp_path / "genome"
+    genome_dir.mkdir()
+    for genome_file in [fasta_file, bgzf_file]:
+        os.replace(genome_file, genome_dir / os.path.basename(genome_file))
+    dummy_dir = tmp_path / "dummy"
+    dummy_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(dummy_dir))
+    outputs = {}
+
+    def access(path, mode):
+        # i.e. as for any user (the permissions of root are not checked)
+        return(not mode & os.W_OK or bool(os.stat(path).st_mode & 0o200))
+
+    # Genomes in read-only directories are indexed (i.e. gaps, and BGZF
+    # FASTA files) in the temporary directory instead
+    genome_dir.chmod(0o555)
+    monkeypatch.setattr(os, "access", access)
+    try:
+        for file_name in ["genome.fa", "genome.fa.gz"]:
+            genome_file = str(genome_dir / file_name)
+            outputs[file_name] = _scan(scan_sequence, genome_file,
+                profiles_dir, str(tmp_path / file_name), str(tmp_path),
+                genome_major=True)
+            assert os.path.dirname(genome.get_gaps_file(genome_file)) == \
+                str(dummy_dir)
+        assert sorted(os.listdir(genome_dir)) == ["genome.fa", "genome.fa.gz"]
+        assert len(os.listdir(dummy_dir)) == 4
+    finally:
+        genome_dir.chmod(0o755)
+    assert outputs["genome.fa.gz"] == outputs["genome.fa"]
+
+    # Otherwise next to the genome (i.e. as before)
+    monkeypatch.undo()
+    genome_file = str(genome_dir / "genome.fa")
+    genome.index_gaps(genome_file)
+    assert genome.get_gaps_file(genome_file) == "%s.gaps.npz" % genome_file
+    assert os.path.exists(genome.get_gaps_file(genome_file))
+
+@pytest.mark.parametrize("order", [["chr1", "chr2", "chr3", "chrM"],
+    ["chr3", "chr1", "chr2", "chrM"]])
+@pytest.mark.parametrize("params", [{}, {"window_size": 15000, "threads": 2}])
+def test_to_bigbed(scan_sequence, profiles_dir, order, params, tmp_path):
+
+    # Initialize
+    _add_profiles(profiles_dir)
+    fasta_file = str(tmp_path / "random.fa")
+    sizes = {"chr1": 40000, "chr2": 500, "chr3": 20000, "chrM": 16569}
+    _write_random_genome(fasta_file, {c: sizes[c] for c in sizes \
+        if c != "chrM"})
+    chrom_sizes = str(tmp_path / "random.fa.sizes")
+    with open(chrom_sizes, "w") as handle:
+        for chrom in order:
+            handle.write("%s\t%s\n" % (chrom, sizes[chrom]))
+
+    # Scan, then merge outputs into a track (i.e. as scans2bigBed)
+    merge_scans = load_script("merge-scans.py")
+    tsv_dir = str(tmp_path / "tsv")
+    _scan(scan_sequence, fasta_file, profiles_dir, tsv_dir, str(tmp_path),
+        stream=True)
+    bb_file = str(tmp_path / "merged.bb")
+    merge_scans.merge_scans(chrom_sizes, tsv_dir, bb_file)
+    with bigbed.Reader(bb_file) as reader:
+        assert reader.count > 0
+        assert sorted(reader.ids, key=reader.ids.get) == \
+            ["chr1", "chr2", "chr3"]
+
+    # Scanning straight into a track writes the same track, byte for byte
+    # (i.e. with chroms in the order of the genome where chrom sizes list
+    # them otherwise)
+    track_dir = str(tmp_path / "track")
+    _scan(scan_sequence, fasta_file, profiles_dir, track_dir, str(tmp_path),
+        to_bigbed=chrom_sizes, **params)
+    assert _read_outputs(track_dir) == {}
+    with open(bb_file, "rb") as a, \
+         open(os.path.join(track_dir, "random.bb"), "rb") as b:
+        assert a.read() == b.read()
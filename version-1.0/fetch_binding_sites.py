@@ -63,11 +63,14 @@ if __name__ == "__main__":
     if options.format == "csv": delimiter = ","
     if options.output_file is None: dummy_file = None
     else: dummy_file = os.path.join(os.path.abspath(options.dummy_dir), "%s.txt" % os.getpid())
+    if options.compress and dummy_file is not None: dummy_file += ".gz"
     rel_score_thresh = int(options.rel_score_thresh * 1000) # transform relative score threshold
     p_value_thresh = int(log(options.p_value_thresh) * 1000 / -10) # transform p-value threshold
     # Remove dummy file if exist #
     if dummy_file is not None:
         if os.path.exists(dummy_file): os.remove(dummy_file)
+    # Open output (i.e. buffered and, if compress, gzipped as it is written) #
+    out_file = functions.Writer(dummy_file, gz=options.compress)
     # Write #
     if options.format != "bed":
         header = delimiter.join(["chr", "start (1-based)", "end"])
@@ -75,7 +78,7 @@ if __name__ == "__main__":
         elif options.scores == "p_value": header += delimiter + "p_value"
         else: header += delimiter + "rel_score * 1000" + delimiter + "-1 * log10(p_value) * 100"
         # Write #
-        functions.write(dummy_file, header + delimiter + "strand")
+        out_file.write(header + delimiter + "strand")
     # For each matrix id and for each chr file... #
     for file_name in os.listdir(os.path.abspath(options.input_dir)):
         # Initialize #
@@ -123,7 +126,9 @@ if __name__ == "__main__":
             # If both relative scores and p-values are required... #
             else: score = delimiter.join([line[2], line[3]])
             # Write #
-            functions.write(dummy_file, delimiter.join(map(str, [chromosome, start, end, profiles[matrix_id].name, score, strand])))
+            out_file.write(delimiter.join(map(str, [chromosome, start, end, profiles[matrix_id].name, score, strand])))
+    # Close output #
+    out_file.close()
     # If dummy file exists... #
     if dummy_file is not None:
         if os.path.exists(dummy_file):
@@ -131,13 +136,6 @@ if __name__ == "__main__":
             output_file = os.path.abspath(options.output_file)
             # If compress... #
             if options.compress:
-                # Initialize #
                 if not output_file.endswith(".gz"): output_file += ".gz"
-                # Compress #
-                functions.compress(dummy_file, output_file)
-            # ... Else... #
-            else:
-                # Copy #
-                shutil.copy(dummy_file, output_file)
-            # Remove dummy file #
-            os.remove(dummy_file)
+            # Move (i.e. already compressed if compress) #
+            shutil.move(dummy_file, output_file)
@@ -3,6 +3,10 @@ import os, sys, re
 import gzip
 import shutil
 
+# Globals #
+buffer_size = 1048576 # i.e. characters buffered before writing to file
+window_size = 10000 # i.e. nucleotides per window of FASTA sequence
+
 #def get_jaspar_profiles(matrix_id=None):
 #    """
 #    @input:
@@ -25,9 +29,10 @@ import shutil
 #    
 #    return jaspar_db.fetch_motif_by_id(matrix_id)
 
-def parse_file(file_name, gz=False):
+def parse_file(file_name, gz=False, binary=False):
     """
-    This function parses any file and yields lines one by one.
+    This function parses any file and yields lines one by one (as bytes
+    if binary).
     
     @input:
     file_name {string}
@@ -39,16 +44,18 @@ def parse_file(file_name, gz=False):
     if os.path.exists(file_name):
         # Initialize #
         f = None
+        mode = "rb" if binary else "rt"
         # Open file handle #
         if gz:
-            try: f = gzip.open(file_name, "rt")
+            try: f = gzip.open(file_name, mode)
             except: raise ValueError("Could not open file %s" % file_name)
         else:
-            try: f = open(file_name, "rt")
+            try: f = open(file_name, mode)
             except: raise ValueError("Could not open file %s" % file_name)
         # For each line... #
         for line in f:
-            yield line.strip("\n")
+            if binary: yield line.rstrip(b"\r\n")
+            else: yield line.strip("\n")
         f.close()
     else:
         raise ValueError("File %s does not exist!" % file_name)
@@ -66,28 +73,197 @@ def parse_fasta_file(file_name, gz=False, clean=True, uracils_to_thymines=True):
     """
 
     # Initialize #
-    header = ""
-    sequence = ""
+    header = None
+    sequence = bytearray()
+    table = _get_nucleotides_table(clean, uracils_to_thymines)
     # For each line... #
-    for line in parse_file(file_name, gz):
+    for line in parse_file(file_name, gz, binary=True):
         if len(line) == 0: continue
-        if line.startswith("#"): continue
-        if line.startswith(">"):
-            if sequence != "":
-                if clean:
-                    sequence = re.sub("\W|\d", "X", sequence)
-                yield header, sequence
-            m = re.search("^>(.+)", line)
-            header = m.group(1)
-            sequence = ""
+        if line.startswith(b"#"): continue
+        if line.startswith(b">"):
+            if header is not None:
+                yield header, sequence.decode()
+            header = line[1:].decode()
+            sequence = bytearray()
         else:
-            sequence += line.upper()
-    if clean:
-        # Convert non-nucleotides to Ns #
-        sequence = re.sub("[^ACGTU]", "N", sequence)
-    if uracils_to_thymines:
-        # Convert Us to Ts #
-        sequence = re.sub("U", "T", sequence)
+            # Convert to uppercase, non-nucleotides to Ns and Us to Ts #
+            sequence.extend(line.translate(table))
+    if header is not None:
+        yield header, sequence.decode()
+
+def parse_fasta_windows(file_name, window_size=window_size, overlap=0, gz=False, clean=True, uracils_to_thymines=True):
+    """
+    This function parses any FASTA file and yields overlapping windows of
+    each sequence one by one in the form header, offset, window (i.e. the
+    0-based position of the window in the sequence).  Windows are of
+    {window_size} nucleotides (except for the last one of each sequence)
+    and each one starts with the last {overlap} nucleotides of the previous
+    one (i.e. for scanning a motif, overlap = motif length - 1).  Only one
+    window is kept in memory at a time.
+
+    @input:
+    file_name {string}
+    window_size {int}
+    overlap {int}
+    @return:
+    line {list} header, offset, window
+
+    """
+
+    # Initialize #
+    header = None
+    window = bytearray()
+    offset = 0
+    table = _get_nucleotides_table(clean, uracils_to_thymines)
+    if overlap < 0 or overlap >= window_size:
+        raise ValueError("Overlap must be smaller than window size!")
+    # For each line... #
+    for line in parse_file(file_name, gz, binary=True):
+        if len(line) == 0: continue
+        if line.startswith(b"#"): continue
+        if line.startswith(b">"):
+            # Yield last window (i.e. unless fully overlapped) #
+            if len(window) > overlap or (offset == 0 and len(window) > 0):
+                yield header, offset, window.decode()
+            header = line[1:].decode()
+            window = bytearray()
+            offset = 0
+        else:
+            # Convert to uppercase, non-nucleotides to Ns and Us to Ts #
+            window.extend(line.translate(table))
+            # For each full window... #
+            while len(window) >= window_size:
+                yield header, offset, window[:window_size].decode()
+                del window[:window_size - overlap]
+                offset += window_size - overlap
+    # Yield last window (i.e. unless fully overlapped) #
+    if len(window) > overlap or (offset == 0 and len(window) > 0):
+        yield header, offset, window.decode()
+
+def index_fasta_file(file_name):
+    """
+    This function indexes an uncompressed FASTA file (i.e. as samtools
+    faidx, into {file_name}.fai) and returns the index as a {dict} of
+    header (i.e. up to the first space), [length, offset, line bases, line
+    width] pairs.
+
+    @input:
+    file_name {string}
+    @return:
+    index {dict}
+
+    """
+
+    # Initialize #
+    index = {}
+    headers = []
+    header = None
+    offset = 0
+    last = None # i.e. length of the last line of the current sequence
+    # For each line... #
+    with open(file_name, "rb") as f:
+        for line in f:
+            offset += len(line)
+            if line.startswith(b">"):
+                header = line[1:].split()[0].decode()
+                headers.append(header)
+                index[header] = [0, offset, 0, 0]
+                last = None
+                continue
+            if header is None: continue
+            bases = len(line.rstrip(b"\r\n"))
+            # Skip empty lines at the end of the sequence #
+            if bases == 0:
+                last = 0
+                continue
+            # Lines must be of the same length (except for the last one) #
+            if index[header][2] == 0: index[header][2:] = [bases, len(line)]
+            elif last is not None and last != index[header][2] or bases > index[header][2]:
+                raise ValueError("Lines of different lengths in sequence %s!" % header)
+            index[header][0] += bases
+            last = bases
+    # Write index #
+    with open("%s.fai" % file_name, "w") as out_file:
+        for header in headers:
+            out_file.write("%s\t%s\n" % (header, "\t".join(map(str, index[header]))))
+
+    return index
+
+def parse_fasta_index(file_name):
+    """
+    This function parses the index of an uncompressed FASTA file (i.e.
+    {file_name}.fai, which is created if it does not exist) and returns it
+    as in {index_fasta_file}.
+
+    @input:
+    file_name {string}
+    @return:
+    index {dict}
+
+    """
+
+    # Index FASTA file if needed #
+    if not os.path.exists("%s.fai" % file_name):
+        return index_fasta_file(file_name)
+
+    # Initialize #
+    index = {}
+    # For each line... #
+    for line in parse_tsv_file("%s.fai" % file_name):
+        index[line[0]] = list(map(int, line[1:5]))
+
+    return index
+
+def fetch_fasta_sequence(file_name, header, start=0, end=None, index=None, clean=True, uracils_to_thymines=True):
+    """
+    This function returns a region (i.e. 0-based, half-open) of a sequence
+    from an uncompressed FASTA file by seeking to it through the file index
+    (i.e. without parsing the sequences before it).
+
+    @input:
+    file_name {string}
+    header {string} e.g. chr1
+    start {int}
+    end {int}
+    index {dict} i.e. from {parse_fasta_index}
+    @return:
+    sequence {string}
+
+    """
+
+    # Initialize #
+    if file_name.endswith(".gz"):
+        raise ValueError("Random access requires an uncompressed FASTA file: %s" % file_name)
+    if index is None: index = parse_fasta_index(file_name)
+    if header not in index:
+        raise ValueError("Sequence %s not in FASTA file %s" % (header, file_name))
+    length, offset, line_bases, line_width = index[header]
+    if end is None or end > length: end = length
+    if start >= end: return ""
+    table = _get_nucleotides_table(clean, uracils_to_thymines)
+    # Get file positions #
+    first = offset + (start // line_bases) * line_width + start % line_bases
+    last = offset + (end // line_bases) * line_width + end % line_bases
+    # Read sequence #
+    with open(file_name, "rb") as f:
+        f.seek(first)
+        sequence = f.read(last - first)
+
+    return sequence.translate(table, b"\r\n").decode()
+
+def _get_nucleotides_table(clean=True, uracils_to_thymines=True):
+
+    # Initialize #
+    table = bytearray(range(256))
+    # For each character... #
+    for i in range(256):
+        c = chr(i)
+        if "a" <= c <= "z": c = c.upper()
+        if uracils_to_thymines and c == "U": c = "T"
+        if clean and c not in "ACGTU": c = "N"
+        table[i] = ord(c)
+
+    return bytes(table)
 
 def parse_tsv_file(file_name, gz=False):
     """
@@ -132,3 +308,81 @@ def compress(input_file, output_file):
 
     with open(input_file, "rb") as in_file, gzip.open(output_file, "wb") as out_file:
         shutil.copyfileobj(in_file, out_file)
+
+class Writer(object):
+    """
+    This class writes lines to a file (or to stdout if no file was
+    provided).  Unlike {write}, it keeps the file handle open and buffers
+    lines to write them in bulk (i.e. every {buffer_size} characters) and,
+    if gz, it compresses them using gzip as they are written.  It is meant
+    to be used as a context manager: e.g.
+
+        with functions.Writer(file_name, gz=True) as out_file:
+            out_file.write(line)
+
+    @input:
+    file_name {string}
+    gz {boolean}
+    buffer_size {int}
+
+    """
+
+    def __init__(self, file_name=None, gz=False, buffer_size=buffer_size):
+
+        # Initialize #
+        self.file_name = file_name
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        # Open file handle #
+        if file_name is None: self.handle = sys.stdout
+        elif gz:
+            try: self.handle = gzip.open(file_name, "wt")
+            except: raise ValueError("Could not open file %s" % file_name)
+        else:
+            try: self.handle = open(file_name, "wt")
+            except: raise ValueError("Could not open file %s" % file_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, line):
+        """
+        This function adds a {line} to the buffer, and writes the buffer
+        to file once full.
+
+        @input:
+        line {string}
+
+        """
+
+        self.buffer.append(line)
+        self.buffered += len(line) + 1
+        if self.buffered >= self.buffer_size: self.flush()
+
+    def flush(self):
+        """
+        This function writes any buffered lines to file.
+
+        """
+
+        if self.buffer:
+            self.handle.write("\n".join(self.buffer) + "\n")
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        """
+        This function writes any buffered lines and closes the file handle
+        (stdout is flushed but left open).
+
+        """
+
+        if self.handle is None: return
+        self.flush()
+        if self.file_name is None: self.handle.flush()
+        else: self.handle.close()
+        self.handle = None
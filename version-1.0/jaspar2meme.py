@@ -64,17 +64,19 @@ if __name__ == "__main__":
     profile = None
     # If dummy file exists #
     if os.path.exists(dummy_file): os.remove(dummy_file)
-    # For each line... #
-    for line in functions.parse_file(os.path.join(options.jaspar_bundle)):
-        # If header... #
-        if line.startswith(">"):
-            # Write #
-            functions.write(dummy_file, line)
-        # ... Else... #
-        else:
-            m = re.search("^\s*(\w)\s*\[(.+)\]\s*$", line)
-            # Write #
-            if m: functions.write(dummy_file, "%s" % " ".join(map(str, [int(float(i)) for i in re.findall("[+-]?[0-9]*[.]?[0-9]+", m.group(2))])))
+    # Open dummy file #
+    with functions.Writer(dummy_file) as out_file:
+        # For each line... #
+        for line in functions.parse_file(os.path.join(options.jaspar_bundle)):
+            # If header... #
+            if line.startswith(">"):
+                # Write #
+                out_file.write(line)
+            # ... Else... #
+            else:
+                m = re.search("^\s*(\w)\s*\[(.+)\]\s*$", line)
+                # Write #
+                if m: out_file.write("%s" % " ".join(map(str, [int(float(i)) for i in re.findall("[+-]?[0-9]*[.]?[0-9]+", m.group(2))])))
     # Reformat JASPAR profiles to MEME profiles #
     process =  subprocess.check_output([os.path.join(os.path.abspath(options.meme_dir), "jaspar2meme"), "-bundle", dummy_file], stderr=subprocess.STDOUT)
     # For each line... #
@@ -92,7 +94,8 @@ if __name__ == "__main__":
         meme_file = os.path.join(os.path.abspath(options.output_dir), "%s.meme" % profile)
         if not os.path.exists(meme_file):
             # Write #
-            functions.write(meme_file, "\n".join(profiles[profile]))
+            with functions.Writer(meme_file) as out_file:
+                out_file.write("\n".join(profiles[profile]))
 #    # ... Else... #
 #    else:
 #        # For each profile... #
@@ -72,7 +72,8 @@ if __name__ == "__main__":
         jaspar_file = os.path.join(os.path.abspath(options.output_dir), "%s.pfm" % matrix_id)
         if not os.path.exists(jaspar_file):
             # Write #
-            functions.write(jaspar_file, "\n".join(profile))
+            with functions.Writer(jaspar_file) as out_file:
+                out_file.write("\n".join(profile))
 #    # ... Else... #
 #    else:
 #        # For each profile... #
@@ -20,10 +20,11 @@ def parse_options():
 
     """
 
-    parser = optparse.OptionParser("./%prog -f <fasta_file> -j <jaspar_matrix_id> -m <meme_dir> -p <profiles_dir> [--dummy=<dummy_dir> -o <output_dir> -r <results_dir> --pv-thresh=<p_value_thresh> --rs-thresh=<rel_score_thresh>]")
+    parser = optparse.OptionParser("./%prog -f <fasta_file> -j <jaspar_matrix_id> -m <meme_dir> -p <profiles_dir> [-b <batch_size> --dummy=<dummy_dir> -o <output_dir> -r <results_dir> --pv-thresh=<p_value_thresh> --rs-thresh=<rel_score_thresh>]")
 
+    parser.add_option("-b", default=100, action="store", type="int", dest="batch_size", help="Batch size (i.e. number of 10 kb windows scanned per jaspar_search.pl and fimo call; default = 100)", metavar="<batch_size>")
     parser.add_option("--dummy", default="/tmp/", action="store", type="string", dest="dummy_dir", help="Dummy directory (default = /tmp/)", metavar="<dummy_dir>")
-    parser.add_option("-f", action="store", type="string", dest="fasta_file", help="FASTA file (e.g. chr1.fa)", metavar="<fasta_file>")
+    parser.add_option("-f", action="store", type="string", dest="fasta_file", help="FASTA file (e.g. chr1.fa; gzipped if ending in .gz)", metavar="<fasta_file>")
     parser.add_option("-j", action="store", type="string", dest="matrix_id", help="JASPAR matrix ID (e.g. MA0002.2)", metavar="<jaspar_matrix_id>")
     parser.add_option("-m", action="store", type="string", dest="meme_dir", help="Full path to MEME bin directory (i.e. where all MEME executables are located; e.g. $MEME_PATH/bin)", metavar="<meme_dir>")
     parser.add_option("-o", default="./", action="store", type="string", dest="output_dir", help="Output directory (default = ./)", metavar="<output_dir>")
@@ -37,6 +38,9 @@ def parse_options():
     if options.fasta_file is None or options.matrix_id is None or options.meme_dir is None or options.profiles_dir is None:
         parser.error("missing arguments: type option \"-h\" for help")
 
+    if options.batch_size < 1:
+        parser.error("invalid batch size: %s\n\tbatch size must be a positive integer" % options.batch_size)
+
     return options
 
 def jaspar_search(matrix_file, fasta_file, thresh=0.75):
@@ -91,6 +95,145 @@ def fimo_search(meme_dir, meme_file, fasta_file, thresh=0.05):
             yield line[2], int(line[3]), int(line[4]), line[5], float(line[7])	
         else: continue
 
+def batch_search(pfm_file, meme_dir, meme_file, fasta_file, batch, rel_score_thresh=0.8, p_value_thresh=0.05):
+    """
+    This function scans a batch of windows at once (i.e. running both
+    jaspar_search.pl and fimo once on a FASTA file with one record per
+    window) and yields the matches found by both in the form identifier
+    (i.e. header up to the first space), start, strand, relative score *
+    1000, -1 * log10(p-value) * 100, with starts mapped back to sequence
+    coordinates (i.e. window offset + start).
+
+    @input:
+    pfm_file {filename} e.g. MA0002.2.pfm
+    meme_dir {directory} i.e. bin directory where all MEME executables are located
+    meme_file {filename} e.g. MA0002.2.meme
+    fasta_file {filename} i.e. dummy FASTA file
+    batch {list} of header, offset, window (i.e. from functions.parse_fasta_windows)
+    rel_score_thresh {float} e.g. 0.8
+    p_value_thresh {float} e.g. 0.05
+    @yield:
+    match {list} identifier, start, strand, relative score, p-value
+
+    """
+
+    # Initialize #
+    records = {}
+    relative_scores = {}
+    # Create dummy FASTA file (i.e. records named after sequence identifier and offset) #
+    with functions.Writer(fasta_file) as out_file:
+        for header, offset, window in batch:
+            identifier = header.split()[0]
+            record = "%s:%s" % (identifier, offset)
+            records[record] = (identifier, offset)
+            out_file.write(">%s\n%s" % (record, window))
+    # For each jaspar match... #
+    for record, start, end, strand, relative_score in jaspar_search(pfm_file, fasta_file, rel_score_thresh):
+        if record not in records: continue
+        identifier, offset = records[record]
+        # Add to relative scores #
+        relative_scores.setdefault((identifier, start + offset, strand), int(relative_score * 1000))
+    # For each fimo match... #
+    for record, start, end, strand, p_value in fimo_search(meme_dir, meme_file, fasta_file, p_value_thresh):
+        if record not in records: continue
+        identifier, offset = records[record]
+        # If match in relative scores... #
+        if (identifier, start + offset, strand) in relative_scores:
+            yield identifier, start + offset, strand, relative_scores[(identifier, start + offset, strand)], int(log(p_value) * 1000 / -10)
+    # Remove dummy FASTA file if exist #
+    if os.path.exists(fasta_file): os.remove(fasta_file)
+
+def write_batch(batch, out_files, pfm_file, meme_dir, meme_file, fasta_file, rel_score_thresh=0.8, p_value_thresh=0.05, last=False):
+    """
+    This function scans a batch of windows, writes the matches of each
+    sequence to its dummy file and, once a sequence has been fully scanned
+    (i.e. it is not the sequence of the last window of the batch, unless
+    last), moves its dummy file to the output file.
+
+    @input:
+    batch {list} of header, offset, window
+    out_files {dict} of identifier, [writer, dummy_file, output_file]
+    last {boolean} i.e. last batch
+
+    """
+
+    # Initialize #
+    matches = []
+    if len(batch) > 0: matches = batch_search(pfm_file, meme_dir, meme_file, fasta_file, batch, rel_score_thresh, p_value_thresh)
+    # For each match... #
+    for identifier, start, strand, relative_score, p_value in matches:
+        out_files[identifier][0].write("%s\t%s\t%s\t%s" % (start, strand, relative_score, p_value))
+    # For each fully scanned sequence... #
+    for identifier in list(out_files):
+        if not last and identifier == batch[-1][0].split()[0]: continue
+        out_file, dummy_file, output_file = out_files.pop(identifier)
+        # Close dummy file #
+        out_file.close()
+        # Move (i.e. already compressed) #
+        shutil.move(dummy_file, output_file)
+
+def scan_fasta_file(fasta_file, matrix_id, pfm_file, meme_dir, meme_file, motif_length, batch_size=100, dummy_dir="/tmp/", output_dir="./", results_dir=None, rel_score_thresh=0.8, p_value_thresh=0.05, window_size=functions.window_size):
+    """
+    This function scans each sequence of a FASTA file in windows (i.e.
+    overlapping by motif length - 1) packed into batches of {batch_size}
+    windows, and writes the matches of each sequence to its output file
+    (i.e. named after the matrix ID and the sequence identifier, the header
+    up to the first space).  Sequences whose output file exists (or is
+    copied from {results_dir}) are skipped, and identifiers must be unique.
+
+    @input:
+    fasta_file {filename} e.g. chr1.fa
+    matrix_id {str} e.g. MA0002.2
+    motif_length {int}
+    batch_size {int}
+
+    """
+
+    # Initialize #
+    batch = []
+    out_files = {}
+    identifiers = set()
+    skip = False
+    dummy_fasta = os.path.join(dummy_dir, "%s.fa" % os.getpid())
+    batch_args = [pfm_file, meme_dir, meme_file, dummy_fasta, rel_score_thresh, p_value_thresh]
+
+    # For each window (i.e. of 10 kb, overlapping by motif length - 1)... #
+    for header, offset, window in functions.parse_fasta_windows(fasta_file, window_size, motif_length - 1, gz=fasta_file.endswith(".gz")):
+        # If new sequence... #
+        if offset == 0:
+            # Initialize #
+            identifier = header.split()[0]
+            # Identifiers must be unique (i.e. records and outputs are named after them) #
+            if identifier in identifiers:
+                raise ValueError("Duplicate sequence identifier %s!" % identifier)
+            identifiers.add(identifier)
+            dummy_file = os.path.join(dummy_dir, "%s.%s.tab.gz" % (matrix_id, identifier))
+            output_file = os.path.join(output_dir, "%s.%s.tab.gz" % (matrix_id, identifier))
+            skip = True
+            # Skip if output file already exists #
+            if os.path.exists(output_file): continue
+            # If output file exists in a previous JASPAR release... #
+            if results_dir is not None:
+                # Initialize #
+                results_file = os.path.join(results_dir, "%s.%s.tab.gz" % (matrix_id, identifier))
+                # If results file exists... #
+                if os.path.exists(results_file):
+                    # Copy #
+                    shutil.copy(results_file, output_file)
+                    continue
+            skip = False
+            # Open dummy file (i.e. buffered and gzipped as it is written) #
+            out_files[identifier] = [functions.Writer(dummy_file, gz=True), dummy_file, output_file]
+        if skip: continue
+        # Add window to batch #
+        batch.append((header, offset, window))
+        # If batch is full, scan it (i.e. one jaspar_search.pl and one fimo call) #
+        if len(batch) == batch_size:
+            write_batch(batch, out_files, *batch_args)
+            batch = []
+    # Scan last batch #
+    write_batch(batch, out_files, *batch_args, last=True)
+
 #-------------#
 # Main        #
 #-------------#
@@ -105,7 +248,6 @@ if __name__ == "__main__":
         os.makedirs(os.path.abspath(options.output_dir))
 
     # Initialize #
-    dummy_fasta = os.path.join(os.path.abspath(options.dummy_dir), "%s.fa" % os.getpid())
     if os.path.exists(os.path.join(os.path.abspath(options.profiles_dir), "%s.pfm" % options.matrix_id)):
         pfm_file = os.path.join(os.path.abspath(options.profiles_dir), "%s.pfm" % options.matrix_id)
     elif os.path.exists(os.path.join(os.path.abspath(options.profiles_dir), "%s.jaspar" % options.matrix_id)):
@@ -116,56 +258,10 @@ if __name__ == "__main__":
     with open(pfm_file) as f:
         profile = motifs.read(f, "jaspar")
 
-    # For each header, sequence... #
-    for header, sequence in functions.parse_fasta_file(os.path.abspath(options.fasta_file)):
-        # Initialize #
-        dummy_file = os.path.join(os.path.abspath(options.dummy_dir), "%s.%s.tab" % (options.matrix_id, header))
-        output_file = os.path.join(os.path.abspath(options.output_dir), "%s.%s.tab.gz" % (options.matrix_id, header))
-        # Remove dummy file if exist #
-        if os.path.exists(dummy_file): os.remove(dummy_file)
-        # Create an empty dummy file #
-        open(dummy_file, 'a').close()
-        # Skip if output file already exists #
-        if os.path.exists(output_file): continue
-        # If output file exists in a previous JASPAR release... #
-        if options.results_dir is not None:
-            # Initialize #
-            results_file = os.path.join(os.path.abspath(options.results_dir), "%s.%s.tab.gz" % (options.matrix_id, header))
-            # If results file exists... #
-            if os.path.exists(results_file):
-                # Copy #
-                shutil.copy(results_file, output_file)
-                continue
-        # Get chunks #
-        m = 10000;
-        n = len(profile) - 1
-        chunks = [sequence[i:i+m] for i in range(0, len(sequence), m - n)]
-        # If last chunk is too small, merge it to the previous #
-        if len(chunks[-1]) <= n: last_chunk = chunks.pop(-1); chunks[-1] += last_chunk
-        # For each chunk... #
-        for i in range(len(chunks)):
-            # Initialize #
-            relative_scores = {}
-            chunk_start = i * (m - n)
-            # Remove dummy FASTA file if exist #
-            if os.path.exists(dummy_fasta): os.remove(dummy_fasta)
-            # Create dummy FASTA file #
-            functions.write(dummy_fasta, ">%s\n%s" % (header, chunks[i]))
-            # For each jaspar match... #
-            for chromosome, start, end, strand, relative_score in jaspar_search(pfm_file, dummy_fasta, options.rel_score_thresh):
-                # Add to relative scores #
-                relative_scores.setdefault((start + chunk_start, strand), int(relative_score * 1000))
-            # For each fimo match... #
-            for chromosome, start, end, strand, p_value in fimo_search(os.path.abspath(options.meme_dir), os.path.join(os.path.abspath(options.profiles_dir), "%s.meme" % options.matrix_id), dummy_fasta, options.p_value_thresh):
-                # If match in relative scores... #
-                if (start + chunk_start, strand) in relative_scores:
-                    functions.write(dummy_file, "%s\t%s\t%s\t%s" % (start + chunk_start, strand, relative_scores[(start + chunk_start, strand)], int(log(p_value) * 1000 / -10)))
-            # Remove dummy FASTA file if exist #
-            if os.path.exists(dummy_fasta): os.remove(dummy_fasta)
-        # If dummy file exists... #
-        if os.path.exists(dummy_file):
-            # Compress #
-            functions.compress(dummy_file, output_file)
-            # Remove dummy file #
-            os.remove(dummy_file)
-            
+    # Initialize #
+    meme_file = os.path.join(os.path.abspath(options.profiles_dir), "%s.meme" % options.matrix_id)
+    results_dir = None
+    if options.results_dir is not None: results_dir = os.path.abspath(options.results_dir)
+
+    # Scan #
+    scan_fasta_file(os.path.abspath(options.fasta_file), options.matrix_id, pfm_file, os.path.abspath(options.meme_dir), meme_file, len(profile), options.batch_size, os.path.abspath(options.dummy_dir), os.path.abspath(options.output_dir), results_dir, options.rel_score_thresh, options.p_value_thresh)